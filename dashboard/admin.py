@@ -1,13 +1,52 @@
+from django import forms
 from django.contrib import admin
-from dashboard.models import Device, SensorData, Alert, ControlCommand, SystemLog
+from dashboard.models import Device, SensorData, SensorBaseline, Alert, ControlCommand, SystemLog, LLMCallRecord, PrivacyBudget
+from dashboard.models import SensorRollupMinute, SensorRollupHour, SensorRollupDay
+from iotshield_backend.field_encryption import TOKEN_PREFIX, field_encryptor, is_encrypted
+
+
+class DeviceAdminForm(forms.ModelForm):
+    """Edits an encrypted location as plaintext and stores it encrypted again"""
+    
+    class Meta:
+        model = Device
+        fields = '__all__'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.location_encrypted = is_encrypted(self.instance.location)
+        if self.location_encrypted:
+            self.initial['location'] = field_encryptor.reveal(self.instance.location)
+    
+    def clean_location(self):
+        location = self.cleaned_data['location']
+        if self.location_encrypted and location:
+            return field_encryptor.encrypt_value(location)
+        return location
 
 
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
-    list_display = ('device_id', 'name', 'device_type', 'location', 'is_active', 'last_seen')
+    form = DeviceAdminForm
+    list_display = ('device_id', 'name', 'device_type', 'location_display', 'is_active', 'last_seen')
     list_filter = ('device_type', 'is_active')
     search_fields = ('device_id', 'name', 'location')
     date_hierarchy = 'created_at'
+    
+    @admin.display(description='Location', ordering='location')
+    def location_display(self, device):
+        return device.location_plaintext
+    
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # Encrypted locations can't be matched in SQL - there are few devices, so decrypt and compare
+            term = search_term.lower()
+            matches = [pk for pk, location in queryset.filter(location__startswith=TOKEN_PREFIX)
+                       .values_list('pk', 'location') if term in field_encryptor.reveal(location).lower()]
+            if matches:
+                results |= queryset.filter(pk__in=matches)
+        return results, may_have_duplicates
 
 
 @admin.register(SensorData)
@@ -19,13 +58,20 @@ class SensorDataAdmin(admin.ModelAdmin):
     readonly_fields = ('timestamp',)
 
 
+@admin.register(SensorBaseline)
+class SensorBaselineAdmin(admin.ModelAdmin):
+    list_display = ('device', 'sensor_type', 'lookback_days', 'computed_at')
+    list_filter = ('sensor_type',)
+    readonly_fields = ('computed_at',)
+
+
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
-    list_display = ('title', 'severity', 'status', 'created_at')
+    list_display = ('title', 'severity', 'status', 'occurrence_count', 'created_at')
     list_filter = ('severity', 'status', 'created_at')
     search_fields = ('title', 'description')
     date_hierarchy = 'created_at'
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'last_occurrence_at')
 
 
 @admin.register(ControlCommand)
@@ -44,3 +90,26 @@ class SystemLogAdmin(admin.ModelAdmin):
     search_fields = ('module', 'message')
     date_hierarchy = 'timestamp'
     readonly_fields = ('timestamp',)
+
+
+@admin.register(LLMCallRecord)
+class LLMCallRecordAdmin(admin.ModelAdmin):
+    list_display = ('model', 'purpose', 'sensor_type', 'status', 'provenance', 'generated_tokens', 'latency_ms', 'created_at')
+    list_filter = ('model', 'purpose', 'status', 'provenance')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('created_at',)
+
+
+@admin.register(PrivacyBudget)
+class PrivacyBudgetAdmin(admin.ModelAdmin):
+    list_display = ('consumer', 'device_id', 'sensor_type', 'rho', 'epsilon_linear', 'releases', 'updated_at')
+    list_filter = ('consumer', 'sensor_type')
+    search_fields = ('consumer', 'device_id')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(SensorRollupMinute, SensorRollupHour, SensorRollupDay)
+class SensorRollupAdmin(admin.ModelAdmin):
+    list_display = ('device', 'sensor_type', 'bucket', 'readings', 'min_value', 'max_value', 'anomalies')
+    list_filter = ('sensor_type',)
+    date_hierarchy = 'bucket'
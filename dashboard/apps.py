@@ -5,3 +5,7 @@ class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dashboard'
     verbose_name = 'IoTShield Dashboard'
+
+    def ready(self):
+        # Connects the SQLite connection hook before the first query of any process
+        from iotshield_backend import sqlite_profile  # noqa: F401
@@ -0,0 +1,54 @@
+"""
+Django Management Command to delete expired data
+Applies the retention policies (RETENTION_DAYS, RETENTION_POLICIES,
+RETENTION_LOG_DAYS, RETENTION_ROLLUP_DAYS) in small chunks so it can run
+while the MQTT listener is writing. Schedule it, e.g. nightly from cron:
+
+    15 3 * * * cd /path/to/IoTShield && python manage.py apply_retention
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from iotshield_backend.retention import RetentionJob
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sensor readings, alerts, logs and rollups in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.RETENTION_CHUNK_SIZE,
+                            help=f'Rows deleted per transaction (default: {settings.RETENTION_CHUNK_SIZE})')
+        parser.add_argument('--pause', type=float, default=settings.RETENTION_PAUSE,
+                            help=f'Seconds between chunks (default: {settings.RETENTION_PAUSE})')
+        parser.add_argument('--archive', type=str, default=settings.RETENTION_ARCHIVE_DIR,
+                            help='Write deleted rows to gzipped JSONL files in this directory first')
+        parser.add_argument('--sensor-type', type=str, default=None,
+                            help='Only purge readings of this sensor type (skips logs and rollups)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count expired rows without deleting anything')
+
+    def handle(self, *args, **options):
+        job = RetentionJob(chunk_size=options['chunk_size'], pause=options['pause'],
+                           archive_dir=options['archive'], dry_run=options['dry_run'])
+        sensor_types = [options['sensor_type'].upper()] if options['sensor_type'] else None
+
+        reports = job.run(sensor_types)
+
+        total = 0
+        for report in reports:
+            total += report['deleted']
+            if options['dry_run']:
+                self.stdout.write(f"  {report['table']:<28} {report['deleted']:>10} expired rows")
+                continue
+            self.stdout.write(
+                f"  {report['table']:<28} {report['deleted']:>10} rows in {report['chunks']} chunks, "
+                f"{report['rows_per_sec']:,.0f} rows/s, lock max {report['lock_ms_max']:.1f}ms "
+                f"p95 {report['lock_ms_p95']:.1f}ms"
+            )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Dry run: {total} rows would be deleted"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} expired rows"))
+        if job.archive is not None and job.archive.paths:
+            self.stdout.write(f"Archived to: {', '.join(job.archive.paths)}")
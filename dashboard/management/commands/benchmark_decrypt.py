@@ -0,0 +1,95 @@
+"""
+Django Management Command to benchmark MQTT payload decryption
+Encrypts a stream of readings with the legacy RSA-OAEP scheme and decrypts
+it inline (on one thread, like the listener without workers) and through
+DecryptOffload with different worker counts, reporting messages per second
+and checking that every device's readings come out in order.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from iotshield_backend.decrypt_offload import DecryptOffload
+from iotshield_backend.privacy_engine import rsa_encryption
+
+
+class Command(BaseCommand):
+    help = 'Benchmark inline vs multi-process MQTT payload decryption'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Encrypted messages to decrypt (default: 2000)')
+        parser.add_argument('--devices', type=int, default=20, help='Devices the messages are spread over (default: 20)')
+        parser.add_argument('--workers', type=str, default=None,
+                            help='Comma-separated worker counts (default: 1,2,... up to the core count)')
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        if rsa_encryption is None:
+            raise CommandError('RSA encryption is not available')
+        cores = os.cpu_count() or 1
+        if options['workers']:
+            worker_counts = [int(n) for n in options['workers'].split(',')]
+        else:
+            worker_counts = sorted({1, 2, max(cores // 2, 1), cores})
+        if cores == 1:
+            self.stdout.write(self.style.WARNING('Only one core available - workers cannot run in parallel here'))
+
+        self.stdout.write(f"Encrypting {options['messages']} readings for {options['devices']} devices...")
+        messages = []
+        for i in range(options['messages']):
+            reading = {'device_id': f"BENCH_{i % options['devices']:03d}", 'sensor_type': 'TEMPERATURE',
+                       'value': 20.0 + (i % 50) / 10, 'seq': i, 'timestamp': datetime.now().isoformat()}
+            messages.append(rsa_encryption.encrypt_mqtt_payload(reading))
+
+        report = {'messages': len(messages), 'cores': cores, 'runs': {}}
+
+        started = time.perf_counter()
+        for message in messages:
+            rsa_encryption.decrypt_mqtt_payload(message)
+        inline = len(messages) / (time.perf_counter() - started)
+        report['runs']['inline'] = {'msg_per_s': round(inline, 1), 'speedup': 1.0}
+        self.stdout.write(f"  inline      {inline:9.1f} msg/s")
+
+        for workers in worker_counts:
+            rate, in_order = self._run_offload(messages, workers)
+            report['runs'][f'{workers}_workers'] = {'msg_per_s': round(rate, 1), 'speedup': round(rate / inline, 2),
+                                                    'in_order': in_order}
+            self.stdout.write(f"  {workers:2d} workers  {rate:9.1f} msg/s  x{rate / inline:.2f}  "
+                              f"{'in order' if in_order else 'OUT OF ORDER'}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _run_offload(self, messages, workers):
+        last_seq = {}
+        in_order = True
+        done = threading.Event()
+        delivered = [0]
+
+        def handler(topic, data):
+            nonlocal in_order
+            if data.get('seq', -1) <= last_seq.get(data['device_id'], -1):
+                in_order = False
+            last_seq[data['device_id']] = data['seq']
+            delivered[0] += 1
+            if delivered[0] == len(messages):
+                done.set()
+
+        offload = DecryptOffload(handler, workers=workers)
+        try:
+            # Worker start-up (Django setup, key loading) is not part of the steady-state rate
+            offload.start()
+            started = time.perf_counter()
+            for message in messages:
+                offload.submit('bench', message)
+            if not done.wait(timeout=600):
+                raise CommandError(f'Timed out with {workers} workers')
+            return len(messages) / (time.perf_counter() - started), in_order
+        finally:
+            offload.shutdown()
@@ -0,0 +1,127 @@
+"""
+Django Management Command to benchmark LLM response parsing
+Replays a corpus of recorded Ollama responses (LLM_RESPONSE_LOG_PATH) through
+the previous find-and-patch parser, the strict single-pass parser, and the
+strict parser with its repair fallback, and reports failure rates and
+parse time per response.
+"""
+import json
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iotshield_backend.llm_response import ResponseParseError, parse_response, repair_response
+
+
+def legacy_parse(text):
+    """The parser used before structured output, kept here as the baseline"""
+    cleaned = text.strip()
+    if '```json' in cleaned:
+        start, end = cleaned.find('{'), cleaned.rfind('}') + 1
+        if start >= 0 and end > start:
+            cleaned = cleaned[start:end]
+    elif '```' in cleaned:
+        lines = cleaned.split('\n')
+        cleaned = '\n'.join(lines[1:-1] if len(lines) > 2 else lines)
+    if '{' in cleaned:
+        start, end = cleaned.find('{'), cleaned.rfind('}') + 1
+        if start >= 0 and end > start:
+            cleaned = cleaned[start:end]
+
+    try:
+        result = json.loads(cleaned)
+        patched = False
+        for field in ('anomaly', 'explanation', 'severity', 'suggestion'):
+            if field not in result:
+                result[field] = None
+                patched = True
+        if isinstance(result['anomaly'], str):
+            result['anomaly'] = result['anomaly'].lower() in ['true', '1', 'yes']
+        if result['severity'] not in ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']:
+            result['severity'] = 'LOW'
+            patched = True
+    except Exception as e:
+        raise ResponseParseError('invalid_json', str(e))
+    # Field patching "succeeded" but the content is a guess
+    if patched:
+        raise ResponseParseError('patched')
+    return result
+
+
+def strict_with_repair(text):
+    try:
+        return parse_response(text)
+    except ResponseParseError:
+        return repair_response(text)
+
+
+PARSERS = {
+    'legacy': legacy_parse,
+    'strict': parse_response,
+    'strict+repair': strict_with_repair,
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark LLM response parsers on a corpus of recorded responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', type=str, default=None,
+                            help='JSONL file with a "response" field per line (default: LLM_RESPONSE_LOG_PATH)')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Times each response is parsed for timing (default: 20)')
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        path = options['corpus'] or getattr(settings, 'LLM_RESPONSE_LOG_PATH', None)
+        if not path:
+            raise CommandError('No corpus given - pass --corpus or set LLM_RESPONSE_LOG_PATH')
+        try:
+            with open(path) as f:
+                corpus = [json.loads(line)['response'] for line in f if line.strip()]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not read corpus {path}: {e}')
+        if not corpus:
+            raise CommandError('Corpus is empty')
+        self.stdout.write(f"Corpus: {path} - {len(corpus)} responses")
+
+        report = {'corpus': path, 'responses': len(corpus), 'parsers': {}}
+        for name, parse in PARSERS.items():
+            report['parsers'][name] = stats = self._benchmark(parse, corpus, options['repeat'])
+            self.stdout.write(
+                f"  {name:14s} failures {stats['failures']:5d} ({stats['failure_rate']:.1%})  "
+                f"parse p50 {stats['parse_us_p50']:.1f}us p99 {stats['parse_us_p99']:.1f}us  "
+                f"{stats['failure_reasons']}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _benchmark(self, parse, corpus, repeat):
+        reasons = {}
+        durations = np.empty(len(corpus))
+        for i, text in enumerate(corpus):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                try:
+                    parse(text)
+                    reason = None
+                except ResponseParseError as e:
+                    reason = e.reason
+            durations[i] = (time.perf_counter() - started) / repeat * 1e6
+            if reason:
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+        failures = sum(reasons.values())
+        return {
+            'failures': failures,
+            'failure_rate': round(failures / len(corpus), 4),
+            'failure_reasons': reasons,
+            'parse_us_p50': round(float(np.percentile(durations, 50)), 2),
+            'parse_us_p99': round(float(np.percentile(durations, 99)), 2),
+            'parse_us_mean': round(float(durations.mean()), 2),
+        }
@@ -0,0 +1,234 @@
+"""
+Django Management Command to benchmark SQLite under concurrent reads and writes
+Runs writer threads (listener-style: insert a reading, update the device's
+last_seen) and reader threads (dashboard-style per-device aggregates) against
+a scratch database file for a few seconds, once per profile:
+
+- default:       what Django gives us without OPTIONS - rollback journal,
+                 synchronous=FULL, deferred transactions, 5s timeout
+- production:    the sqlite_profile pragmas, WAL, BEGIN IMMEDIATE, readers
+                 on query_only connections
+- single-writer: production, with every write going through one thread that
+                 group-commits (like iotshield_backend.db_writer)
+
+The real database is never touched.
+"""
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from iotshield_backend.sqlite_profile import profile_pragmas
+
+PROFILES = ('default', 'production', 'single-writer')
+
+_SCHEMA = """
+CREATE TABLE device (id INTEGER PRIMARY KEY, device_id TEXT UNIQUE, last_seen TEXT);
+CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, device_id INTEGER REFERENCES device (id),
+                          sensor_type TEXT, value REAL, timestamp REAL);
+CREATE INDEX sensor_data_device_ts ON sensor_data (device_id, timestamp);
+"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent SQLite reads/writes with the default and the production profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run (default: 5)')
+        parser.add_argument('--writers', type=int, default=4, help='Writer threads (default: 4)')
+        parser.add_argument('--readers', type=int, default=4, help='Reader threads (default: 4)')
+        parser.add_argument('--devices', type=int, default=20, help='Devices (default: 20)')
+        parser.add_argument('--seed-rows', type=int, default=50000,
+                            help='Readings in the database before each run (default: 50000)')
+        parser.add_argument('--profiles', type=str, default=','.join(PROFILES),
+                            help=f"Comma-separated profiles to run (default: {','.join(PROFILES)})")
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        self.options = options
+        report = {'seconds': options['seconds'], 'writers': options['writers'], 'readers': options['readers'],
+                  'seed_rows': options['seed_rows'], 'runs': {}}
+        self.stdout.write(f"{options['writers']} writers, {options['readers']} readers, "
+                          f"{options['seconds']:.0f}s per profile, {options['seed_rows']} seeded readings")
+
+        directory = tempfile.mkdtemp(prefix='iotshield-sqlite-bench-')
+        try:
+            for profile in options['profiles'].split(','):
+                path = os.path.join(directory, f'{profile}.sqlite3')
+                self._seed(path, profile)
+                run = self._run(path, profile)
+                report['runs'][profile] = run
+                self.stdout.write(
+                    f"  {profile:<14} {run['writes_per_s']:9.1f} writes/s  {run['reads_per_s']:9.1f} reads/s  "
+                    f"write p95 {run['write_ms_p95']:7.1f}ms  {run['locked_errors']} 'database is locked'"
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        baseline = report['runs'].get('default')
+        if baseline:
+            for profile, run in report['runs'].items():
+                if profile != 'default' and baseline['writes_per_s'] and baseline['reads_per_s']:
+                    run['write_speedup'] = round(run['writes_per_s'] / baseline['writes_per_s'], 2)
+                    run['read_speedup'] = round(run['reads_per_s'] / baseline['reads_per_s'], 2)
+                    self.stdout.write(f"  {profile:<14} x{run['write_speedup']:.2f} writes  "
+                                      f"x{run['read_speedup']:.2f} reads vs default")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    # ---- connections -------------------------------------------------------
+
+    def _connect(self, path, profile, readonly=False):
+        # Autocommit at the sqlite3 level - transactions are begun explicitly, like Django does
+        if profile == 'default':
+            return sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        for pragma in profile_pragmas(readonly=readonly):
+            conn.execute(pragma).fetchall()
+        return conn
+
+    def _seed(self, path, profile):
+        conn = self._connect(path, profile)
+        conn.executescript(_SCHEMA)
+        devices = self.options['devices']
+        now = time.time()
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO device (id, device_id) VALUES (?, ?)',
+                         [(i + 1, f'BENCH_{i:03d}') for i in range(devices)])
+        conn.executemany(
+            'INSERT INTO sensor_data (device_id, sensor_type, value, timestamp) VALUES (?, ?, ?, ?)',
+            [(i % devices + 1, 'TEMPERATURE' if i % 2 else 'HUMIDITY', 20.0 + i % 50 / 10, now - i)
+             for i in range(self.options['seed_rows'])])
+        conn.execute('COMMIT')
+        conn.close()
+
+    # ---- workload ----------------------------------------------------------
+
+    @staticmethod
+    def _write_reading(conn, i, devices):
+        # Look the device up first - with a deferred BEGIN this read-then-write is
+        # exactly what makes SQLite give up with "database is locked"
+        device_id = f'BENCH_{i % devices:03d}'
+        pk = conn.execute('SELECT id FROM device WHERE device_id = ?', (device_id,)).fetchone()[0]
+        conn.execute('INSERT INTO sensor_data (device_id, sensor_type, value, timestamp) VALUES (?, ?, ?, ?)',
+                     (pk, 'TEMPERATURE', 20.0 + i % 50 / 10, time.time()))
+        conn.execute('UPDATE device SET last_seen = ? WHERE id = ?', (str(time.time()), pk))
+
+    def _run(self, path, profile):
+        devices = self.options['devices']
+        deadline = time.perf_counter() + self.options['seconds']
+        begin = 'BEGIN' if profile == 'default' else 'BEGIN IMMEDIATE'
+        lock = threading.Lock()
+        stats = {'writes': 0, 'reads': 0, 'locked': 0, 'other_errors': 0, 'write_ms': []}
+
+        def count_error(e):
+            with lock:
+                stats['locked' if 'locked' in str(e) else 'other_errors'] += 1
+
+        # single-writer: writer threads hand their readings to one committing thread
+        jobs = queue.Queue()
+        committer = None
+        if profile == 'single-writer':
+            def commit_loop():
+                conn = self._connect(path, profile)
+                while True:
+                    batch = [jobs.get()]
+                    while len(batch) < 200:
+                        try:
+                            batch.append(jobs.get_nowait())
+                        except queue.Empty:
+                            break
+                    if None in batch:
+                        break
+                    try:
+                        conn.execute(begin)
+                        for i, _ in batch:
+                            conn.execute('SAVEPOINT job')
+                            self._write_reading(conn, i, devices)
+                            conn.execute('RELEASE job')
+                        conn.execute('COMMIT')
+                        failed = None
+                    except sqlite3.OperationalError as e:
+                        if conn.in_transaction:
+                            conn.execute('ROLLBACK')
+                        failed = e
+                    for _, done in batch:
+                        done[1] = failed
+                        done[0].set()
+                conn.close()
+
+            committer = threading.Thread(target=commit_loop, daemon=True)
+            committer.start()
+
+        def writer(n):
+            conn = None if committer else self._connect(path, profile)
+            i = n
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    if committer:
+                        done = [threading.Event(), None]  # set after the commit, with its error if any
+                        jobs.put((i, done))
+                        done[0].wait()
+                        if done[1] is not None:
+                            raise done[1]
+                    else:
+                        conn.execute(begin)
+                        self._write_reading(conn, i, devices)
+                        conn.execute('COMMIT')
+                    with lock:
+                        stats['writes'] += 1
+                        stats['write_ms'].append((time.perf_counter() - started) * 1000)
+                except sqlite3.OperationalError as e:
+                    if conn is not None and conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    count_error(e)
+                i += self.options['writers']
+            if conn is not None:
+                conn.close()
+
+        def reader(n):
+            conn = self._connect(path, profile, readonly=True)
+            i = n
+            while time.perf_counter() < deadline:
+                try:
+                    conn.execute(
+                        'SELECT sensor_type, COUNT(*), AVG(value), MIN(value), MAX(value) FROM sensor_data '
+                        'WHERE device_id = ? AND timestamp >= ? GROUP BY sensor_type',
+                        (i % devices + 1, time.time() - 3600)).fetchall()
+                    with lock:
+                        stats['reads'] += 1
+                except sqlite3.OperationalError as e:
+                    count_error(e)
+                i += 1
+            conn.close()
+
+        threads = ([threading.Thread(target=writer, args=(n,)) for n in range(self.options['writers'])] +
+                   [threading.Thread(target=reader, args=(n,)) for n in range(self.options['readers'])])
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if committer:
+            jobs.put(None)
+            committer.join()
+
+        write_ms = sorted(stats['write_ms'])
+        return {
+            'writes_per_s': round(stats['writes'] / elapsed, 1),
+            'reads_per_s': round(stats['reads'] / elapsed, 1),
+            'write_ms_p95': round(write_ms[int(len(write_ms) * 0.95)] if write_ms else 0.0, 1),
+            'locked_errors': stats['locked'],
+            'other_errors': stats['other_errors'],
+        }
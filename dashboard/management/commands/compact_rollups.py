@@ -0,0 +1,50 @@
+"""
+Django Management Command to (re)build the sensor rollup tables
+The MQTT listener keeps the 1m/1h/1d rollups current as readings arrive; run
+this once after migrating to backfill existing data, and after anything that
+changes stored readings behind the listener's back (rescore_sensor_data,
+manual imports).
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from dashboard.models import SensorData
+from iotshield_backend.rollups import MINUTE, bucket_start, rebuild, settled_until
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the 1-minute, 1-hour and 1-day sensor rollups from raw readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Rebuild this many hours back from now (default: 24)')
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild everything from the oldest stored reading')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['all']:
+            oldest = SensorData.objects.aggregate(oldest=Min('timestamp'))['oldest']
+            if oldest is None:
+                self.stdout.write(self.style.SUCCESS('No readings to roll up'))
+                return
+            start = bucket_start(oldest, MINUTE)
+        else:
+            start = now - timedelta(hours=options['hours'])
+
+        end = settled_until(now)
+        days = max(1, int((end - start).total_seconds() // 86400) + 1)
+        self.stdout.write(f"Rebuilding rollups from {start.isoformat()} to {end.isoformat()} "
+                          f"({days} day transactions)")
+
+        started = time.time()
+        folded = rebuild(start, end, now=now)
+        elapsed = time.time() - started
+        rate = folded / elapsed if elapsed > 0 else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {folded} readings in {elapsed:.1f}s ({rate:,.0f} rows/s)"
+        ))
@@ -0,0 +1,215 @@
+"""
+Django Management Command to evaluate anomaly detectors offline
+Replays a labeled dataset (ground truth from the sensor simulator) through
+each detector tier and reports precision, recall, severity confusion,
+latency and throughput. Reports are JSON so runs can be compared across
+model and prompt changes.
+"""
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from iotshield_backend.detectors import DETECTOR_FACTORIES, DetectorRegistry
+
+SEVERITIES = ['NONE', 'LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+# Confusion column/row for severities outside SEVERITIES (a typo in a dataset, an LLM's 'SEVERE')
+OTHER = 'OTHER'
+
+# Fixed default start (a Monday) so a seed always reproduces the same dataset
+DEFAULT_START = '2025-01-06T00:00:00+00:00'
+
+
+def _severity_key(severity):
+    """Confusion matrix key for a severity: its SEVERITIES name, or OTHER"""
+    key = str(severity).strip().upper()
+    return key if key in SEVERITIES else OTHER
+
+
+class Command(BaseCommand):
+    help = 'Evaluate detector tiers against a labeled dataset (precision/recall/latency)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=str, default=None,
+                            help='Labeled JSONL dataset to replay (default: generate one with the simulator)')
+        parser.add_argument('--rounds', type=int, default=2000,
+                            help='Simulator cycles to generate when no dataset is given (6 readings each)')
+        parser.add_argument('--seed', type=int, default=42, help='Simulator seed (default: 42)')
+        parser.add_argument('--device-id', type=str, default='ESP32_SIM_001',
+                            help='Device ID for generated readings (match a device with baselines)')
+        parser.add_argument('--start', type=str, default=DEFAULT_START,
+                            help='Timestamp of the first generated reading (ISO format)')
+        parser.add_argument('--save-dataset', type=str, default=None,
+                            help='Write the generated dataset to this JSONL file')
+        parser.add_argument('--detectors', type=str, default='rules,stats,seasonal',
+                            help='Comma-separated detector tiers to evaluate on their own')
+        parser.add_argument('--llm', action='store_true',
+                            help='Also evaluate the Ollama detector (on a sample, it is slow)')
+        parser.add_argument('--llm-sample', type=int, default=100,
+                            help='Readings sent to the LLM, half of them labeled anomalies (default: 100)')
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        rows, source = self._load_dataset(options)
+        if not rows:
+            raise CommandError('Dataset is empty')
+
+        digest = hashlib.sha256(
+            '\n'.join(json.dumps(row, sort_keys=True) for row in rows).encode()
+        ).hexdigest()
+        anomalies = sum(1 for row in rows if row['label_anomaly'])
+        self.stdout.write(f"Dataset: {source} - {len(rows)} readings, {anomalies} labeled anomalies "
+                          f"(sha256 {digest[:12]})")
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'dataset': {
+                'source': source,
+                'sha256': digest,
+                'readings': len(rows),
+                'anomalies': anomalies,
+                'seed': None if options['dataset'] else options['seed'],
+            },
+            'ollama_model': settings.OLLAMA_MODEL,
+            'routes': settings.ANOMALY_DETECTOR_ROUTES,
+            'detectors': {},
+        }
+
+        names = [name.strip() for name in options['detectors'].split(',') if name.strip()]
+        for name in names:
+            if name not in DETECTOR_FACTORIES:
+                raise CommandError(f"Unknown detector: {name}")
+            # Fresh instance so stateful detectors start from scratch
+            detector = DETECTOR_FACTORIES[name]()
+            report['detectors'][name] = self._evaluate(detector.analyze, rows)
+
+        # The fast path the listener actually uses (cheap tiers of each route)
+        registry = DetectorRegistry()
+        report['detectors']['fast_path'] = self._evaluate(registry.analyze_fast, rows)
+
+        if options['llm']:
+            sample = self._llm_sample(rows, options['llm_sample'], options['seed'])
+            detector = DETECTOR_FACTORIES['llm']()
+            report['detectors']['llm'] = self._evaluate(detector.analyze, sample)
+
+        self._print_report(report)
+
+        if options['output']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _load_dataset(self, options):
+        """Read a JSONL dataset, or generate one with the sensor simulator"""
+        if options['dataset']:
+            with open(options['dataset']) as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            return rows, options['dataset']
+
+        from simulator.utils.sensors import SensorSimulator
+
+        config_path = os.path.join(settings.BASE_DIR, 'simulator', 'config.json')
+        simulator = SensorSimulator(config_path, seed=options['seed'])
+        rows = list(simulator.labeled_readings(
+            options['rounds'],
+            device_id=options['device_id'],
+            start=datetime.fromisoformat(options['start']),
+        ))
+
+        if options['save_dataset']:
+            with open(options['save_dataset'], 'w') as f:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+            self.stdout.write(f"Saved dataset to {options['save_dataset']}")
+
+        return rows, f"simulator (seed={options['seed']}, rounds={options['rounds']})"
+
+    @staticmethod
+    def _llm_sample(rows, size, seed):
+        """Seeded sample with up to half labeled anomalies, kept in replay order"""
+        rng = random.Random(seed)
+        anomalous = [i for i, row in enumerate(rows) if row['label_anomaly']]
+        normal = [i for i, row in enumerate(rows) if not row['label_anomaly']]
+        picked = rng.sample(anomalous, min(len(anomalous), size // 2))
+        picked += rng.sample(normal, min(len(normal), size - len(picked)))
+        return [rows[i] for i in sorted(picked)]
+
+    @staticmethod
+    def _evaluate(analyze, rows):
+        """Replay rows in order through one analyze callable and score it"""
+        latencies = np.empty(len(rows))
+        confusion = {truth: {pred: 0 for pred in SEVERITIES + [OTHER]} for truth in SEVERITIES[1:] + [OTHER]}
+        tp = fp = fn = tn = abstained = 0
+
+        for i, row in enumerate(rows):
+            # Detectors never see the labels
+            reading = {k: v for k, v in row.items() if not k.startswith('label_')}
+            started = time.perf_counter()
+            result = analyze(reading)
+            latencies[i] = (time.perf_counter() - started) * 1000
+
+            if result is None:
+                abstained += 1
+            predicted = bool(result and result.get('anomaly'))
+            actual = bool(row['label_anomaly'])
+
+            if predicted and actual:
+                tp += 1
+            elif predicted:
+                fp += 1
+            elif actual:
+                fn += 1
+            else:
+                tn += 1
+
+            if actual and row.get('label_severity'):
+                predicted_severity = _severity_key(result.get('severity', 'LOW')) if predicted else 'NONE'
+                truth = _severity_key(row['label_severity'])
+                confusion[OTHER if truth == 'NONE' else truth][predicted_severity] += 1
+
+        labeled = sum(sum(preds.values()) for preds in confusion.values())
+        exact = sum(confusion[sev][sev] for sev in SEVERITIES[1:])
+        total_ms = float(latencies.sum())
+
+        return {
+            'readings': len(rows),
+            'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+            'abstained': abstained,
+            'precision': round(tp / (tp + fp), 4) if tp + fp else None,
+            'recall': round(tp / (tp + fn), 4) if tp + fn else None,
+            'severity_accuracy': round(exact / labeled, 4) if labeled else None,
+            'severity_confusion': confusion,
+            'latency_ms': {
+                'p50': round(float(np.percentile(latencies, 50)), 4),
+                'p99': round(float(np.percentile(latencies, 99)), 4),
+                'max': round(float(latencies.max()), 4),
+            },
+            'throughput_per_s': round(len(rows) / (total_ms / 1000), 1) if total_ms else None,
+        }
+
+    def _print_report(self, report):
+        fmt = lambda x: '-' if x is None else f"{x:.3f}"
+
+        self.stdout.write('')
+        self.stdout.write(f"{'detector':<12} {'n':>6} {'prec':>6} {'recall':>6} {'sev_acc':>7} "
+                          f"{'abstain':>7} {'p50 ms':>9} {'p99 ms':>9} {'readings/s':>11}")
+        for name, result in report['detectors'].items():
+            self.stdout.write(
+                f"{name:<12} {result['readings']:>6} {fmt(result['precision']):>6} {fmt(result['recall']):>6} "
+                f"{fmt(result['severity_accuracy']):>7} {result['abstained']:>7} {result['latency_ms']['p50']:>9.3f} "
+                f"{result['latency_ms']['p99']:>9.3f} {result['throughput_per_s'] or 0:>11.0f}"
+            )
+
+        for name, result in report['detectors'].items():
+            self.stdout.write(f"\nSeverity confusion - {name} (rows: labeled, columns: predicted)")
+            self.stdout.write(' ' * 10 + ''.join(f"{sev:>9}" for sev in SEVERITIES + [OTHER]))
+            for truth, preds in result['severity_confusion'].items():
+                self.stdout.write(f"{truth:<10}" + ''.join(f"{preds[sev]:>9}" for sev in SEVERITIES + [OTHER]))
@@ -0,0 +1,62 @@
+"""
+Django Management Command to manage the field encryption keyring
+Lists, rotates and removes keys, and encrypts, decrypts or re-encrypts a
+model field at rest, e.g.
+
+    python manage.py field_keys --encrypt dashboard.Device.location
+    python manage.py field_keys --rotate --reencrypt dashboard.Device.location
+    python manage.py field_keys --remove <old key id>
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from iotshield_backend.field_encryption import KeyringError, field_encryptor
+
+
+class Command(BaseCommand):
+    help = 'Manage field encryption keys and encrypt model fields at rest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rotate', action='store_true', help='Create a new active key (old ones still decrypt)')
+        parser.add_argument('--remove', type=str, default=None, metavar='KEY_ID',
+                            help='Remove a retired key once nothing is encrypted with it')
+        parser.add_argument('--encrypt', type=str, default=None, metavar='APP.MODEL.FIELD',
+                            help='Encrypt a text field in every row')
+        parser.add_argument('--decrypt', type=str, default=None, metavar='APP.MODEL.FIELD',
+                            help='Store a field as plaintext again')
+        parser.add_argument('--reencrypt', type=str, default=None, metavar='APP.MODEL.FIELD',
+                            help='Move values encrypted with retired keys onto the active key')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per bulk update')
+
+    def handle(self, *args, **options):
+        keyring = field_encryptor.keyring
+        try:
+            if options['rotate']:
+                self.stdout.write(self.style.SUCCESS(f"New active key: {keyring.rotate()}"))
+
+            for action in ('encrypt', 'decrypt', 'reencrypt'):
+                if options[action]:
+                    model, field_name = self._resolve(options[action])
+                    rewrite = getattr(field_encryptor, f'{action}_queryset')
+                    changed = rewrite(model.objects.all(), field_name, batch_size=options['batch_size'])
+                    self.stdout.write(self.style.SUCCESS(f"{action}: {changed} {options[action]} values rewritten"))
+
+            if options['remove']:
+                keyring.remove(options['remove'])
+                self.stdout.write(self.style.SUCCESS(f"Removed key {options['remove']}"))
+        except KeyringError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Keyring: {keyring.path}")
+        for key in keyring.keys():
+            status = 'active' if key['active'] else f"retired {key['retired_at']}"
+            self.stdout.write(f"  {key['id']}  created {key['created_at']}  {status}")
+
+    def _resolve(self, target):
+        try:
+            app_label, model_name, field_name = target.split('.')
+            model = apps.get_model(app_label, model_name)
+            model._meta.get_field(field_name)
+        except (ValueError, LookupError) as e:
+            raise CommandError(f"Expected APP.MODEL.FIELD, got {target}: {e}")
+        return model, field_name
@@ -1,8 +1,12 @@
 """
 Django Management Command to run MQTT listener
 """
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from iotshield_backend.db_writer import db_writer
 from iotshield_backend.mqtt_client import mqtt_client
+from iotshield_backend.utils.metrics import metrics
+import signal
 import time
 
 
@@ -10,6 +14,11 @@ class Command(BaseCommand):
     help = 'Start MQTT listener for IoTShield'
     
     def handle(self, *args, **options):
+        # kill -HUP <pid> reloads the RSA keys after manage_rsa_keys.py rotated them
+        self._reload_keys = False
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._request_key_reload)
+        
         self.stdout.write(self.style.SUCCESS("""
 ╔══════════════════════════════════════════════════════╗
 ║       IoTShield MQTT Listener Started               ║
@@ -18,15 +27,42 @@ class Command(BaseCommand):
         """))
         
         try:
-            # Connect to MQTT broker
+            if settings.DB_SINGLE_WRITER:
+                # SQLite has one write lock - all of the listener's writes go through one thread
+                db_writer.start()
+            
+            # Fill caches before the first reading arrives
+            steps = mqtt_client.warm_up_caches()
+            self.stdout.write(f"Caches warmed: {', '.join(f'{k} {v:.0f}ms' for k, v in steps.items())}")
+            
+            # Connect to MQTT broker - readings use the fast detectors while the model loads
             mqtt_client.connect()
             
+            report = mqtt_client.warm_up_llm()
+            for host, result in report.get('ollama', {}).items():
+                status = (f"load {result['load_ms']:.0f}ms, first generation {result['generate_ms']:.0f}ms"
+                          if result['ok'] else 'FAILED')
+                self.stdout.write(f"Ollama {host}: {status}")
+            self.stdout.write(self.style.SUCCESS(f"Ready after {report['total'] / 1000:.1f}s warm-up"))
+            metrics.dump(settings.METRICS_SNAPSHOT_PATH)
+            
             self.stdout.write(self.style.SUCCESS('MQTT listener is running'))
             self.stdout.write(self.style.WARNING('Press Ctrl+C to stop'))
             
-            # Keep running
+            # Keep running, periodically publishing metrics for the web API
+            last_dump = last_cleanup = time.time()
             while True:
                 time.sleep(1)
+                if time.time() - last_dump >= 10:
+                    metrics.dump(settings.METRICS_SNAPSHOT_PATH)
+                    last_dump = time.time()
+                if self._reload_keys:
+                    self._reload_keys = False
+                    self._reload_rsa_keys()
+                if time.time() - last_cleanup >= 3600:
+                    # Forget drift state for devices that went away
+                    mqtt_client.change_point_detector.cleanup_idle()
+                    last_cleanup = time.time()
         
         except KeyboardInterrupt:
             self.stdout.write(self.style.WARNING('\nStopping MQTT listener...'))
@@ -36,3 +72,23 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error: {e}'))
             mqtt_client.disconnect()
+    
+    def _request_key_reload(self, signum, frame):
+        # Only set a flag - the main loop does the reload outside the signal handler
+        self._reload_keys = True
+    
+    def _reload_rsa_keys(self):
+        from iotshield_backend.privacy_engine import rsa_encryption
+        if rsa_encryption is None:
+            return
+        try:
+            rsa_encryption.reload_keys()
+            if mqtt_client.decrypt_offload is not None:
+                # Each worker process holds its own copy of the keys
+                workers = mqtt_client.decrypt_offload.reload_keys()
+                self.stdout.write(f"Restarted {workers} decryption workers")
+            for key in rsa_encryption.key_stats():
+                self.stdout.write(f"RSA key {key['fingerprint']}: {'active' if key['active'] else 'retired'}, "
+                                  f"{key['decrypts']} decrypts")
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'RSA key reload failed: {e}'))
@@ -0,0 +1,299 @@
+"""
+Django Management Command to re-score historical sensor data
+Re-evaluates is_anomaly/anomaly_score for stored readings in bulk using the
+vectorized rule and statistical detectors (no LLM calls)
+"""
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Avg, Count, F
+
+from dashboard.models import SensorData
+from iotshield_backend.vectorized_detectors import SCORE_DECIMALS, score_readings
+
+
+CHECKPOINT_PATH = Path(settings.BASE_DIR) / '.rescore_checkpoint.json'
+
+# Per-process state for worker processes (set once by _init_worker)
+_worker_stream_stats = None
+_worker_z_threshold = None
+
+
+def _init_worker(stream_stats, z_threshold):
+    """Ship the stream statistics to each worker once instead of with every chunk"""
+    global _worker_stream_stats, _worker_z_threshold
+    _worker_stream_stats = stream_stats
+    _worker_z_threshold = z_threshold
+
+
+def _score_chunk_in_worker(chunk):
+    return _score_chunk(chunk, _worker_stream_stats, _worker_z_threshold)
+
+
+def _score_chunk(chunk, stream_stats, z_threshold):
+    """
+    Score one chunk of readings (runs in a worker process when --workers > 1)
+
+    Args:
+        chunk: List of (id, device_id, sensor_type, value, is_anomaly, anomaly_score) tuples
+        stream_stats: Dict of (device_id, sensor_type) -> (mean, std)
+        z_threshold: Statistical detector threshold
+
+    Returns:
+        Tuple of (ids, old_flags, new_flags, old_scores, new_scores, sensor_types) arrays
+    """
+    ids = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk))
+    sensor_types = np.array([row[2] for row in chunk], dtype=object)
+    values = np.fromiter((row[3] for row in chunk), dtype=np.float64, count=len(chunk))
+    old_flags = np.fromiter((row[4] for row in chunk), dtype=bool, count=len(chunk))
+    old_scores = np.array([row[5] if row[5] is not None else np.nan for row in chunk], dtype=np.float64)
+
+    # Look up stream statistics once per distinct (device, sensor) pair in the chunk
+    stream_keys = [(row[1], row[2]) for row in chunk]
+    unique_keys = list(dict.fromkeys(stream_keys))
+    key_index = {key: i for i, key in enumerate(unique_keys)}
+    inverse = np.fromiter((key_index[key] for key in stream_keys), dtype=np.int64, count=len(chunk))
+    key_stats = np.array([stream_stats.get(key, (0.0, 0.0)) for key in unique_keys], dtype=np.float64)
+
+    means = key_stats[inverse, 0]
+    stds = key_stats[inverse, 1]
+
+    new_flags, new_scores = score_readings(sensor_types, values, means, stds, z_threshold)
+    return ids, old_flags, new_flags, old_scores, new_scores, sensor_types
+
+
+class Command(BaseCommand):
+    help = 'Re-score historical sensor data with the vectorized rule and statistical detectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows scored and written per chunk (default: 5000)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Worker processes for scoring chunks (default: 1, inline)')
+        parser.add_argument('--z-threshold', type=float, default=3.0,
+                            help='|z| at which the statistical detector flags a reading (default: 3.0)')
+        parser.add_argument('--sensor-type', type=str, default=None,
+                            help='Only re-score this sensor type')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Score everything and print a diff summary without writing')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue from the last checkpoint instead of starting over')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+        z_threshold = options['z_threshold']
+        dry_run = options['dry_run']
+
+        queryset = SensorData.objects.all()
+        if options['sensor_type']:
+            queryset = queryset.filter(sensor_type=options['sensor_type'].upper())
+        # The rows a checkpoint covers depend on these - resuming with others would skip rows
+        run_args = {'sensor_type': options['sensor_type'].upper() if options['sensor_type'] else None,
+                    'z_threshold': z_threshold}
+
+        # Resume from checkpoint if requested
+        checkpoint = self._load_checkpoint() if options['resume'] and not dry_run else None
+        if checkpoint and checkpoint.get('args') != run_args:
+            raise CommandError(
+                f"The checkpoint was written with {checkpoint.get('args')}, not {run_args}. "
+                f"Resume with the same --sensor-type/--z-threshold, or start over without --resume."
+            )
+        last_id = checkpoint['last_id'] if checkpoint else 0
+        summary = checkpoint['summary'] if checkpoint else self._empty_summary()
+        if checkpoint:
+            self.stdout.write(self.style.WARNING(f"Resuming after id {last_id}"))
+
+        stream_stats = self._compute_stream_stats(queryset)
+        self.stdout.write(f"Computed statistics for {len(stream_stats)} device/sensor streams")
+
+        remaining = queryset.filter(id__gt=last_id)
+        total = remaining.count()
+        if total == 0:
+            self.stdout.write(self.style.SUCCESS('Nothing to re-score'))
+            return
+
+        self.stdout.write(
+            f"Re-scoring {total} readings in chunks of {chunk_size}"
+            f"{' with ' + str(workers) + ' workers' if workers > 1 else ''}"
+            f"{' (dry run)' if dry_run else ''}"
+        )
+
+        chunks = self._iter_chunks(remaining, chunk_size)
+        started = time.time()
+        processed = 0
+
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(stream_stats, z_threshold),
+            )
+            results = self._ordered_results(executor, chunks, max_pending=workers * 2)
+        else:
+            executor = None
+            results = (_score_chunk(chunk, stream_stats, z_threshold) for chunk in chunks)
+
+        try:
+            # Results come back in chunk order, so the checkpoint always marks a contiguous prefix
+            for ids, old_flags, new_flags, old_scores, new_scores, sensor_types in results:
+                self._accumulate_summary(summary, old_flags, new_flags, sensor_types)
+
+                if not dry_run:
+                    self._write_chunk(ids, old_flags, new_flags, old_scores, new_scores)
+                    self._save_checkpoint(int(ids[-1]), summary, run_args)
+
+                processed += len(ids)
+                elapsed = time.time() - started
+                rate = processed / elapsed if elapsed > 0 else 0
+                self.stdout.write(
+                    f"  {processed}/{total} ({processed / total * 100:.1f}%) - {rate:,.0f} rows/s"
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if not dry_run:
+            self._clear_checkpoint()
+
+        self._print_summary(summary, dry_run, time.time() - started)
+        if not dry_run and (summary['newly_flagged'] or summary['cleared']):
+            # The rollups still count the old flags
+            self.stdout.write(self.style.WARNING(
+                'Anomaly counts in the rollup tables are out of date - run: python manage.py compact_rollups --all'
+            ))
+
+    def _ordered_results(self, executor, chunks, max_pending):
+        """Yield chunk results in order, keeping at most max_pending chunks in flight"""
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_score_chunk_in_worker, chunk))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _compute_stream_stats(self, queryset):
+        """Mean and standard deviation per (device, sensor_type) in one aggregate query"""
+        # order_by() clears the default ordering so it doesn't leak into GROUP BY
+        rows = queryset.order_by().values('device_id', 'sensor_type').annotate(
+            mean=Avg('value'),
+            mean_sq=Avg(F('value') * F('value')),
+            n=Count('id'),
+        )
+
+        stats = {}
+        for row in rows:
+            variance = max((row['mean_sq'] or 0.0) - (row['mean'] or 0.0) ** 2, 0.0)
+            std = float(np.sqrt(variance)) if row['n'] > 1 else 0.0
+            stats[(row['device_id'], row['sensor_type'])] = (row['mean'] or 0.0, std)
+        return stats
+
+    def _iter_chunks(self, queryset, chunk_size):
+        """
+        Stream rows in id order as lists of tuples, without loading model instances.
+        Each chunk is its own keyset query, so writes between chunks never
+        disturb an open cursor on SQLite.
+        """
+        last_id = 0
+        while True:
+            chunk = list(
+                queryset.filter(id__gt=last_id).order_by('id').values_list(
+                    'id', 'device_id', 'sensor_type', 'value', 'is_anomaly', 'anomaly_score'
+                )[:chunk_size].iterator(chunk_size=chunk_size)
+            )
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1][0]
+
+    def _write_chunk(self, ids, old_flags, new_flags, old_scores, new_scores):
+        """
+        Write back only the rows whose flag or score actually changed.
+
+        Rows are grouped by their new (flag, score) pair and written with one
+        UPDATE ... WHERE id IN (...) per group. Scores have SCORE_DECIMALS
+        decimals, so a chunk needs at most a couple hundred statements -
+        bulk_update() builds a CASE expression per row, which is far slower in
+        Django than the SQL itself.
+        """
+        scale = 10 ** SCORE_DECIMALS
+        changed = (old_flags != new_flags) | ~np.isclose(old_scores, new_scores, equal_nan=False)
+        if not changed.any():
+            return
+
+        ids = ids[changed]
+        # Scores are in [0, 1], so (flag, score) packs into flag * (scale + 1) + score * scale
+        groups = (new_flags[changed].astype(np.int64) * (scale + 1)
+                  + np.rint(new_scores[changed] * scale).astype(np.int64))
+
+        with transaction.atomic():
+            for group in np.unique(groups):
+                group_ids = ids[groups == group].tolist()
+                flag, score = bool(group // (scale + 1)), (group % (scale + 1)) / scale
+                # Stay under SQLite's bound-parameter limit
+                for start in range(0, len(group_ids), 900):
+                    SensorData.objects.filter(id__in=group_ids[start:start + 900]).update(
+                        is_anomaly=flag, anomaly_score=score
+                    )
+
+    def _empty_summary(self):
+        return {'scored': 0, 'anomalies_before': 0, 'anomalies_after': 0,
+                'newly_flagged': 0, 'cleared': 0, 'by_sensor_type': {}}
+
+    def _accumulate_summary(self, summary, old_flags, new_flags, sensor_types):
+        """Add one chunk's flag changes to the running diff summary"""
+        newly_flagged = ~old_flags & new_flags
+        cleared = old_flags & ~new_flags
+
+        summary['scored'] += len(new_flags)
+        summary['anomalies_before'] += int(old_flags.sum())
+        summary['anomalies_after'] += int(new_flags.sum())
+        summary['newly_flagged'] += int(newly_flagged.sum())
+        summary['cleared'] += int(cleared.sum())
+
+        for sensor_type in np.unique(sensor_types):
+            mask = sensor_types == sensor_type
+            entry = summary['by_sensor_type'].setdefault(
+                sensor_type, {'scored': 0, 'newly_flagged': 0, 'cleared': 0}
+            )
+            entry['scored'] += int(mask.sum())
+            entry['newly_flagged'] += int((newly_flagged & mask).sum())
+            entry['cleared'] += int((cleared & mask).sum())
+
+    def _print_summary(self, summary, dry_run, elapsed):
+        """Print the before/after diff"""
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Dry run' if dry_run else 'Re-scoring'} complete: {summary['scored']} readings in {elapsed:.1f}s"
+        ))
+        self.stdout.write(f"  Anomalies before: {summary['anomalies_before']}")
+        self.stdout.write(f"  Anomalies after:  {summary['anomalies_after']}")
+        self.stdout.write(f"  Newly flagged:    {summary['newly_flagged']}")
+        self.stdout.write(f"  Cleared:          {summary['cleared']}")
+        for sensor_type, entry in sorted(summary['by_sensor_type'].items()):
+            self.stdout.write(
+                f"    {sensor_type:<16} scored={entry['scored']:<8} "
+                f"+{entry['newly_flagged']:<6} -{entry['cleared']}"
+            )
+
+    def _load_checkpoint(self):
+        if not CHECKPOINT_PATH.exists():
+            return None
+        with open(CHECKPOINT_PATH, 'r') as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, last_id, summary, run_args):
+        with open(CHECKPOINT_PATH, 'w') as f:
+            json.dump({'last_id': last_id, 'summary': summary, 'args': run_args}, f)
+
+    def _clear_checkpoint(self):
+        if CHECKPOINT_PATH.exists():
+            CHECKPOINT_PATH.unlink()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='last_occurrence_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='occurrence_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
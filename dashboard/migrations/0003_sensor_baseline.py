@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_alert_occurrence_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorBaseline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_type', models.CharField(max_length=20)),
+                ('quantiles', models.JSONField(default=list)),
+                ('lookback_days', models.PositiveIntegerField(default=28)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='baselines', to='dashboard.device')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['computed_at'], name='dashboard_s_compute_5998ef_idx')],
+                'unique_together': {('device', 'sensor_type')},
+            },
+        ),
+    ]
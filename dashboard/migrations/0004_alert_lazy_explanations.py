@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_sensor_baseline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='explained_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='explanation_status',
+            field=models.CharField(choices=[('NONE', 'Not Needed'), ('PENDING', 'Pending'), ('GENERATING', 'Generating'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='NONE', max_length=12),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_alert_lazy_explanations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(blank=True, max_length=20)),
+                ('purpose', models.CharField(max_length=20)),
+                ('endpoint', models.CharField(blank=True, max_length=200)),
+                ('sensor_type', models.CharField(blank=True, max_length=20)),
+                ('provenance', models.CharField(choices=[('LIVE', 'Live Generation'), ('CACHE', 'Served From Cache')], default='LIVE', max_length=10)),
+                ('status', models.CharField(choices=[('OK', 'OK'), ('PARSE_ERROR', 'Parse Error'), ('ERROR', 'Error')], default='OK', max_length=12)),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('generated_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('total_ms', models.FloatField(blank=True, null=True)),
+                ('load_ms', models.FloatField(blank=True, null=True)),
+                ('prompt_eval_ms', models.FloatField(blank=True, null=True)),
+                ('eval_ms', models.FloatField(blank=True, null=True)),
+                ('latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['-created_at'], name='dashboard_l_created_579e7a_idx'), models.Index(fields=['model', 'created_at'], name='dashboard_l_model_9572ba_idx')],
+            },
+        ),
+    ]
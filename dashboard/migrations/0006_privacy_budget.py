@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_llm_call_record'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrivacyBudget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('sensor_type', models.CharField(max_length=20)),
+                ('consumer', models.CharField(max_length=150)),
+                ('rho', models.FloatField(default=0.0)),
+                ('epsilon_linear', models.FloatField(default=0.0)),
+                ('releases', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('device_id', 'sensor_type', 'consumer')},
+            },
+        ),
+    ]
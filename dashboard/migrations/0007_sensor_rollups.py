@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_privacy_budget'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollupDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_type', models.CharField(max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('sum_squares', models.FloatField(default=0.0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('anomalies', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dashboard.device')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket', 'sensor_type'], name='sensorrollupday_bucket')],
+                'unique_together': {('device', 'sensor_type', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_type', models.CharField(max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('sum_squares', models.FloatField(default=0.0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('anomalies', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dashboard.device')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket', 'sensor_type'], name='sensorrolluphour_bucket')],
+                'unique_together': {('device', 'sensor_type', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_type', models.CharField(max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('sum_squares', models.FloatField(default=0.0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('anomalies', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dashboard.device')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket', 'sensor_type'], name='sensorrollupminute_bucket')],
+                'unique_together': {('device', 'sensor_type', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+# What the detector used to return when the LLM response couldn't be parsed
+FAILURE_TEXT = 'Unable to analyze - check Ollama connection'
+
+
+def fail_placeholder_explanations(apps, schema_editor):
+    # These were stored as READY; mark them FAILED so they are not reused and can be retried
+    Alert = apps.get_model('dashboard', 'Alert')
+    Alert.objects.filter(explanation_status='READY', description=FAILURE_TEXT).update(explanation_status='FAILED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_sensor_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='explanation_reused_from',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_placeholder_explanations, migrations.RunPython.noop),
+    ]
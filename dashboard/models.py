@@ -27,6 +27,12 @@ class Device(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.device_id})"
+    
+    @property
+    def location_plaintext(self):
+        """location for display - it may be encrypted at rest (manage.py field_keys --encrypt)"""
+        from iotshield_backend.field_encryption import field_encryptor
+        return field_encryptor.reveal(self.location)
 
 
 class SensorData(models.Model):
@@ -60,6 +66,60 @@ class SensorData(models.Model):
         return f"{self.sensor_type}: {self.value}{self.unit} @ {self.timestamp}"
 
 
+class SensorRollup(models.Model):
+    """Aggregates of one device's readings of one sensor type over one time bucket"""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='+')
+    sensor_type = models.CharField(max_length=20)
+    bucket = models.DateTimeField()  # Bucket start, aligned to the resolution in UTC
+    readings = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0.0)
+    sum_squares = models.FloatField(default=0.0)  # For the standard deviation
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    anomalies = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        abstract = True
+        unique_together = ('device', 'sensor_type', 'bucket')
+        indexes = [
+            models.Index(fields=['bucket', 'sensor_type'], name='%(class)s_bucket'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sensor_type} x{self.readings} @ {self.bucket}"
+
+
+class SensorRollupMinute(SensorRollup):
+    """1-minute rollup (maintained by the MQTT listener, see iotshield_backend.rollups)"""
+
+
+class SensorRollupHour(SensorRollup):
+    """1-hour rollup"""
+
+
+class SensorRollupDay(SensorRollup):
+    """1-day rollup (UTC days)"""
+
+
+class SensorBaseline(models.Model):
+    """Time-of-day baseline per device and sensor type (one row per stream)"""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='baselines')
+    sensor_type = models.CharField(max_length=20)
+    # 168 entries (hour of week, Monday 00:00 = 0), each [p05, p50, p95, sample_count]
+    quantiles = models.JSONField(default=list)
+    lookback_days = models.PositiveIntegerField(default=28)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('device', 'sensor_type')
+        indexes = [
+            models.Index(fields=['computed_at']),
+        ]
+    
+    def __str__(self):
+        return f"Baseline {self.device_id}/{self.sensor_type} @ {self.computed_at}"
+
+
 class Alert(models.Model):
     """Alert Model for Anomaly Notifications"""
     SEVERITY_LEVELS = [
@@ -76,12 +136,28 @@ class Alert(models.Model):
         ('IGNORED', 'Ignored'),
     ]
     
+    EXPLANATION_STATUS_CHOICES = [
+        ('NONE', 'Not Needed'),        # Sensor type is not routed to the LLM
+        ('PENDING', 'Pending'),        # Rule text only, LLM explanation not generated yet
+        ('GENERATING', 'Generating'),
+        ('READY', 'Ready'),
+        ('FAILED', 'Failed'),
+    ]
+    
     sensor_data = models.ForeignKey(SensorData, on_delete=models.CASCADE, related_name='alerts')
     title = models.CharField(max_length=200)
     description = models.TextField()
     ai_suggestion = models.TextField(blank=True)
     severity = models.CharField(max_length=10, choices=SEVERITY_LEVELS, default='MEDIUM')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='NEW')
+    # Number of readings folded into this alert while its anomaly episode was open
+    occurrence_count = models.PositiveIntegerField(default=1)
+    last_occurrence_at = models.DateTimeField(null=True, blank=True)
+    # LLM explanations are generated lazily and cached in description/ai_suggestion
+    explanation_status = models.CharField(max_length=12, choices=EXPLANATION_STATUS_CHOICES, default='NONE')
+    explained_at = models.DateTimeField(null=True, blank=True)
+    # Alert whose explanation was reused for this one (None = generated by the LLM)
+    explanation_reused_from = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -152,3 +228,64 @@ class SystemLog(models.Model):
     
     def __str__(self):
         return f"[{self.level}] {self.module}: {self.message[:50]}"
+
+
+class LLMCallRecord(models.Model):
+    """Cost and outcome of one Ollama call (written in batches by llm_telemetry)"""
+    STATUS_CHOICES = [
+        ('OK', 'OK'),
+        ('PARSE_ERROR', 'Parse Error'),  # Ollama answered but the JSON was unusable
+        ('ERROR', 'Error'),              # Request failed (connection, timeout, HTTP error)
+    ]
+    
+    PROVENANCE_CHOICES = [
+        ('LIVE', 'Live Generation'),
+        ('CACHE', 'Served From Cache'),
+    ]
+    
+    model = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20, blank=True)
+    purpose = models.CharField(max_length=20)  # 'analyze' or 'explain'
+    endpoint = models.CharField(max_length=200, blank=True)
+    sensor_type = models.CharField(max_length=20, blank=True)
+    provenance = models.CharField(max_length=10, choices=PROVENANCE_CHOICES, default='LIVE')
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='OK')
+    # Token counts and durations as reported by Ollama (durations in ms)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    generated_tokens = models.PositiveIntegerField(null=True, blank=True)
+    total_ms = models.FloatField(null=True, blank=True)
+    load_ms = models.FloatField(null=True, blank=True)
+    prompt_eval_ms = models.FloatField(null=True, blank=True)
+    eval_ms = models.FloatField(null=True, blank=True)
+    # Wall-clock time seen by the backend, including queueing in Ollama
+    latency_ms = models.FloatField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['model', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.model} {self.purpose} [{self.status}] {self.latency_ms:.0f}ms"
+
+
+class PrivacyBudget(models.Model):
+    """Differential-privacy budget spent by one consumer on one sensor stream"""
+    device_id = models.CharField(max_length=100)
+    sensor_type = models.CharField(max_length=20)
+    consumer = models.CharField(max_length=150)  # username, or 'anonymous'
+    # zCDP parameter (rho) summed over releases - composes much tighter than epsilon
+    rho = models.FloatField(default=0.0)
+    # Plain sum of per-release epsilons, kept for comparison with linear composition
+    epsilon_linear = models.FloatField(default=0.0)
+    releases = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('device_id', 'sensor_type', 'consumer')
+    
+    def __str__(self):
+        return f"Privacy budget {self.consumer} on {self.device_id}/{self.sensor_type}: rho={self.rho:.4f}"
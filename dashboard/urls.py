@@ -19,8 +19,13 @@ urlpatterns = [
     
     # API endpoints
     path('api/sensors/data/', views.api_sensor_data, name='api_sensor_data'),
+    path('api/sensors/export/', views.api_sensor_export, name='api_sensor_export'),
     path('api/alerts/list/', views.api_alerts_list, name='api_alerts_list'),
+    path('api/alerts/<int:alert_id>/', views.api_alert_detail, name='api_alert_detail'),
+    path('api/alerts/<int:alert_id>/explain/', views.api_alert_explain, name='api_alert_explain'),
     path('api/devices/list/', views.api_devices_list, name='api_devices_list'),
     path('api/stats/summary/', views.api_stats_summary, name='api_stats_summary'),
+    path('api/metrics/', views.api_metrics, name='api_metrics'),
+    path('api/llm/telemetry/', views.api_llm_telemetry, name='api_llm_telemetry'),
     path('api/control/command/', views.api_send_control_command, name='api_control_command'),
 ]
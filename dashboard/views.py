@@ -1,11 +1,11 @@
 """Dashboard views for IoTShield"""
 
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Count, Avg, Q
+from django.db.models import Count
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.models import User
 import json
@@ -69,42 +69,139 @@ def alerts(request):
 # API Views
 
 def api_sensor_data(request):
-    """API: Get sensor data"""
+    """API: Get sensor data (raw readings, or 1m/1h/1d rollups for longer ranges)"""
+    from django.conf import settings
+    from iotshield_backend import rollups
+    
     hours = int(request.GET.get('hours', 24))
     sensor_type = request.GET.get('sensor_type', None)
     device_id = request.GET.get('device_id', None)
-    cutoff_time = timezone.now() - timedelta(hours=hours)
-    queryset = SensorData.objects.filter(timestamp__gte=cutoff_time)
+    now = timezone.now()
+    cutoff_time = now - timedelta(hours=hours)
+    
+    # ?resolution=raw|1m|1h|1d, default: the finest that keeps each series within ?points
+    resolution = request.GET.get('resolution', 'auto')
+    if resolution == 'auto':
+        points = int(request.GET.get('points', getattr(settings, 'ROLLUP_MAX_POINTS', 1500)))
+        resolution = rollups.choose_resolution(timedelta(hours=hours), points)
+    elif resolution in rollups.RESOLUTIONS_BY_NAME:
+        resolution = rollups.RESOLUTIONS_BY_NAME[resolution]
+    elif resolution != rollups.RAW:
+        return JsonResponse({'error': 'resolution must be auto, raw, 1m, 1h or 1d'}, status=400)
+    
     # Support multiple sensor types (comma separated)
-    if sensor_type:
-        if ',' in sensor_type:
-            types = [t.strip() for t in sensor_type.split(',')]
+    types = None
+    if sensor_type and sensor_type != 'ALL':
+        types = [t.strip() for t in sensor_type.split(',')]
+    
+    if resolution == rollups.RAW:
+        queryset = SensorData.objects.filter(timestamp__gte=cutoff_time)
+        if types:
             queryset = queryset.filter(sensor_type__in=types)
-        elif sensor_type != 'ALL':
-            queryset = queryset.filter(sensor_type=sensor_type)
-    if device_id:
-        queryset = queryset.filter(device__device_id=device_id)
-    data = []
-    for reading in queryset.order_by('timestamp'):
-        data.append({
-            'timestamp': reading.timestamp.isoformat(),
-            'sensor_type': reading.sensor_type,
-            'value': reading.value,
-            'unit': reading.unit,
-            'device_id': reading.device.device_id,
-            'is_anomaly': reading.is_anomaly,
-            'anomaly_score': reading.anomaly_score,
-        })
-    return JsonResponse({'data': data})
+        if device_id:
+            queryset = queryset.filter(device__device_id=device_id)
+        data = []
+        for reading in queryset.select_related('device').order_by('timestamp'):
+            data.append({
+                'timestamp': reading.timestamp.isoformat(),
+                'sensor_type': reading.sensor_type,
+                'value': reading.value,
+                'unit': reading.unit,
+                'device_id': reading.device.device_id,
+                'is_anomaly': reading.is_anomaly,
+                'anomaly_score': reading.anomaly_score,
+            })
+    else:
+        # One point per bucket: 'value' is the mean, plus min/max/stddev/count/anomalies
+        data = rollups.series(cutoff_time, now, resolution, sensor_types=types, device_id=device_id, now=now)
+        resolution = resolution.name
+    
+    # Differentially private values (?private=true, or always with PRIVACY_NOISE_API)
+    private = (request.GET.get('private', '').lower() in ('1', 'true')
+               or getattr(settings, 'PRIVACY_NOISE_API', False))
+    if not private or not data:
+        return JsonResponse({'data': data, 'private': private, 'resolution': resolution})
+    
+    from iotshield_backend.privacy_budget import privacy_accountant, release_cache
+    from iotshield_backend.privacy_engine import privacy_engine
+    
+    # Each stream in the response is one release for this consumer's budget
+    consumer = request.user.username if request.user.is_authenticated else 'anonymous'
+    release_key = (consumer, request.GET.urlencode())
+    streams = {(row['device_id'], row['sensor_type'], consumer) for row in data}
+    exhausted = privacy_accountant.charge(sorted(streams), *privacy_engine.release_cost())
+    if exhausted:
+        # Re-serving an earlier noisy answer costs nothing; otherwise refuse
+        cached = release_cache.get(release_key)
+        if cached is not None:
+            return JsonResponse(dict(cached, cached=True))
+        return JsonResponse({
+            'error': 'Privacy budget exhausted',
+            'exhausted': [{'device_id': d, 'sensor_type': t} for d, t, _ in exhausted],
+        }, status=429)
+    
+    noisy = privacy_engine.add_noise_to_readings(
+        [row['sensor_type'] for row in data], [row['value'] for row in data]
+    )
+    for row, value in zip(data, noisy.tolist()):
+        row['value'] = value
+        # Only the value is noised - exact min/max/stddev/counts would give it away
+        for field in rollups.EXACT_FIELDS:
+            row.pop(field, None)
+    release = {'data': data, 'private': True, 'resolution': resolution}
+    release_cache.put(release_key, release)
+    return JsonResponse(release)
+
+
+def api_sensor_export(request):
+    """API: Stream a k-anonymous export of sensor data (?format=csv|jsonl)"""
+    from django.conf import settings
+    from iotshield_backend.k_anonymity import stream_sensor_export
+    
+    hours = int(request.GET.get('hours', 24))
+    sensor_type = request.GET.get('sensor_type', None)
+    output_format = request.GET.get('format', 'csv')
+    if output_format not in ('csv', 'jsonl'):
+        return JsonResponse({'error': 'format must be csv or jsonl'}, status=400)
+    # k can be raised per export but never below the configured minimum
+    k = max(int(request.GET.get('k', 0)), getattr(settings, 'K_ANONYMITY_K', 5))
+    
+    queryset = SensorData.objects.filter(timestamp__gte=timezone.now() - timedelta(hours=hours))
+    if sensor_type and sensor_type != 'ALL':
+        queryset = queryset.filter(sensor_type__in=[t.strip() for t in sensor_type.split(',')])
+    
+    response = StreamingHttpResponse(
+        stream_sensor_export(queryset, k=k, output_format=output_format),
+        content_type='text/csv' if output_format == 'csv' else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = f'attachment; filename="sensor_data_k{k}.{output_format}"'
+    return response
+
+
+def _serialize_alert(alert):
+    return {
+        'id': alert.id,
+        'title': alert.title,
+        'description': alert.description,
+        'ai_suggestion': alert.ai_suggestion,
+        'explanation_status': alert.explanation_status,
+        'severity': alert.severity,
+        'status': alert.status,
+        'sensor_type': alert.sensor_data.sensor_type,
+        'device_name': alert.sensor_data.device.name,
+        'occurrence_count': alert.occurrence_count,
+        'last_occurrence_at': alert.last_occurrence_at.isoformat() if alert.last_occurrence_at else None,
+        'created_at': alert.created_at.isoformat(),
+    }
 
 
 def api_alerts_list(request):
-    """API: Get alerts list"""
+    """API: Get alerts list (never queues LLM explanations - the dashboard polls it)"""
     status = request.GET.get('status', None)
     severity = request.GET.get('severity', None)
     limit = int(request.GET.get('limit', 50))
     
-    queryset = Alert.objects.all()
+    queryset = Alert.objects.select_related('sensor_data__device')
     
     if status:
         queryset = queryset.filter(status=status)
@@ -112,25 +209,42 @@ def api_alerts_list(request):
     if severity:
         queryset = queryset.filter(severity=severity)
     
-    alerts = []
-    for alert in queryset.order_by('-created_at')[:limit]:
-        alerts.append({
-            'id': alert.id,
-            'title': alert.title,
-            'description': alert.description,
-            'ai_suggestion': alert.ai_suggestion,
-            'severity': alert.severity,
-            'status': alert.status,
-            'sensor_type': alert.sensor_data.sensor_type,
-            'device_name': alert.sensor_data.device.name,
-            'created_at': alert.created_at.isoformat(),
-        })
-    
+    alerts = [_serialize_alert(alert) for alert in queryset.order_by('-created_at')[:limit]]
     return JsonResponse({'alerts': alerts})
 
 
+def api_alert_detail(request, alert_id):
+    """API: Get one alert"""
+    try:
+        alert = Alert.objects.select_related('sensor_data__device').get(id=alert_id)
+    except Alert.DoesNotExist:
+        return JsonResponse({'error': 'Alert not found'}, status=404)
+    
+    return JsonResponse({'alert': _serialize_alert(alert)})
+
+
+@csrf_exempt
+def api_alert_explain(request, alert_id):
+    """API: Queue the LLM explanation of an alert (poll api_alert_detail for the result)"""
+    from iotshield_backend.alert_explanations import explanation_service
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+    
+    try:
+        alert = Alert.objects.select_related('sensor_data__device').get(id=alert_id)
+    except Alert.DoesNotExist:
+        return JsonResponse({'error': 'Alert not found'}, status=404)
+    
+    queued = explanation_service.explain_on_demand(alert) is not None
+    alert.refresh_from_db()
+    return JsonResponse({'alert': _serialize_alert(alert), 'queued': queued}, status=202 if queued else 200)
+
+
 def api_devices_list(request):
     """API: Get devices list"""
+    from iotshield_backend.field_encryption import field_encryptor
+    
     devices = []
     
     for device in Device.objects.all():
@@ -144,7 +258,7 @@ def api_devices_list(request):
             'device_id': device.device_id,
             'name': device.name,
             'type': device.device_type,
-            'location': device.location,
+            'location': field_encryptor.reveal(device.location),  # may be encrypted at rest
             'is_active': device.is_active,
             'last_seen': device.last_seen.isoformat(),
             'total_readings_24h': recent_data.count(),
@@ -156,45 +270,140 @@ def api_devices_list(request):
 
 def api_stats_summary(request):
     """API: Get summary statistics"""
+    from django.conf import settings
+    
     # Time period
     hours = int(request.GET.get('hours', 24))
     cutoff_time = timezone.now() - timedelta(hours=hours)
     
     # Overall stats
     total_devices = Device.objects.filter(is_active=True).count()
-    total_readings = SensorData.objects.filter(timestamp__gte=cutoff_time).count()
-    total_anomalies = SensorData.objects.filter(
-        timestamp__gte=cutoff_time,
-        is_anomaly=True
-    ).count()
+    
+    # Differentially private aggregates (?private=true, or always with DP_AGGREGATES_API)
+    private = (request.GET.get('private', '').lower() in ('1', 'true')
+               or getattr(settings, 'DP_AGGREGATES_API', False))
+    if private:
+        from iotshield_backend.dp_aggregates import BudgetExhausted, dp_aggregates
+        
+        consumer = request.user.username if request.user.is_authenticated else 'anonymous'
+        try:
+            release = dp_aggregates.stats_summary(hours, consumer)
+        except BudgetExhausted as e:
+            return JsonResponse({
+                'error': 'Privacy budget exhausted',
+                'exhausted': [{'device_id': d, 'sensor_type': t} for d, t, _ in e.keys],
+            }, status=429)
+        # The device registry isn't sensor data - its count stays exact
+        return JsonResponse(dict(release, total_devices=total_devices, period_hours=hours, private=True))
+    # Sensor type statistics - whole days/hours/minutes from the rollup tables,
+    # only the ragged edges and the last minute or so from SensorData
+    from iotshield_backend.rollups import summarize
+    by_type = summarize(cutoff_time, timezone.now())
+    sensor_stats = [
+        {'sensor_type': t, 'avg_value': s['avg_value'], 'count': s['count'], 'anomalies': s['anomalies']}
+        for t, s in sorted(by_type.items())
+    ]
+    total_readings = sum(s['count'] for s in sensor_stats)
+    total_anomalies = sum(s['anomalies'] for s in sensor_stats)
     
     # Alerts by severity
     alerts_by_severity = Alert.objects.filter(
         created_at__gte=cutoff_time
     ).values('severity').annotate(count=Count('id'))
     
-    # Sensor type statistics
-    sensor_stats = SensorData.objects.filter(
-        timestamp__gte=cutoff_time
-    ).values('sensor_type').annotate(
-        avg_value=Avg('value'),
-        count=Count('id'),
-        anomalies=Count('id', filter=Q(is_anomaly=True))
-    )
-    
     summary = {
         'total_devices': total_devices,
         'total_readings': total_readings,
         'total_anomalies': total_anomalies,
         'anomaly_rate': (total_anomalies / total_readings * 100) if total_readings > 0 else 0,
         'alerts_by_severity': list(alerts_by_severity),
-        'sensor_stats': list(sensor_stats),
+        'sensor_stats': sensor_stats,
         'period_hours': hours,
     }
     
     return JsonResponse(summary)
 
 
+def api_metrics(request):
+    """API: Get runtime metrics (detector latency, verdict counts, ...)"""
+    from django.conf import settings
+    from iotshield_backend.utils.metrics import metrics
+    
+    # Detection runs in the MQTT listener process, which writes its metrics to disk
+    listener_metrics = None
+    snapshot_path = settings.METRICS_SNAPSHOT_PATH
+    try:
+        with open(snapshot_path, 'r') as f:
+            listener_metrics = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        return JsonResponse({'error': f'Could not read metrics snapshot: {e}'}, status=500)
+    
+    return JsonResponse({
+        'listener': listener_metrics,
+        'web': metrics.snapshot(),
+    })
+
+
+def api_llm_telemetry(request):
+    """API: LLM call cost per model and prompt version (latency, tokens/s, parse failures)"""
+    import numpy as np
+    from dashboard.models import LLMCallRecord
+    
+    hours = int(request.GET.get('hours', 24))
+    queryset = LLMCallRecord.objects.filter(created_at__gte=timezone.now() - timedelta(hours=hours))
+    if request.GET.get('model'):
+        queryset = queryset.filter(model=request.GET['model'])
+    
+    rows = queryset.order_by().values_list(
+        'model', 'prompt_version', 'status', 'provenance',
+        'latency_ms', 'prompt_tokens', 'generated_tokens', 'eval_ms', 'load_ms'
+    )
+    
+    groups = {}
+    for model, version, status, provenance, latency, prompt_tokens, generated, eval_ms, load_ms in rows:
+        group = groups.setdefault((model, version), {
+            'status': {'OK': 0, 'PARSE_ERROR': 0, 'ERROR': 0},
+            'provenance': {}, 'latency': [], 'prompt_tokens': [], 'generated': 0, 'eval_ms': 0.0, 'load_ms': [],
+        })
+        group['status'][status] = group['status'].get(status, 0) + 1
+        group['provenance'][provenance] = group['provenance'].get(provenance, 0) + 1
+        # Cache hits are index lookups, not generations - keep them out of the cost figures
+        if status == 'ERROR' or provenance == 'CACHE':
+            continue
+        group['latency'].append(latency)
+        if prompt_tokens is not None:
+            group['prompt_tokens'].append(prompt_tokens)
+        if generated and eval_ms:
+            group['generated'] += generated
+            group['eval_ms'] += eval_ms
+        if load_ms is not None:
+            group['load_ms'].append(load_ms)
+    
+    models = []
+    for (model, version), group in sorted(groups.items()):
+        answered = group['status']['OK'] + group['status']['PARSE_ERROR']
+        latency = np.array(group['latency']) if group['latency'] else None
+        models.append({
+            'model': model,
+            'prompt_version': version,
+            'calls': sum(group['status'].values()),
+            'errors': group['status']['ERROR'],
+            'parse_failures': group['status']['PARSE_ERROR'],
+            'parse_failure_rate': round(group['status']['PARSE_ERROR'] / answered, 4) if answered else None,
+            'provenance': group['provenance'],
+            'reuse_rate': round(group['provenance'].get('CACHE', 0) / sum(group['status'].values()), 4),
+            'latency_ms_p50': round(float(np.percentile(latency, 50)), 1) if latency is not None else None,
+            'latency_ms_p95': round(float(np.percentile(latency, 95)), 1) if latency is not None else None,
+            'tokens_per_s': round(group['generated'] / group['eval_ms'] * 1000, 1) if group['eval_ms'] else None,
+            'avg_prompt_tokens': round(float(np.mean(group['prompt_tokens'])), 1) if group['prompt_tokens'] else None,
+            'avg_load_ms': round(float(np.mean(group['load_ms'])), 1) if group['load_ms'] else None,
+        })
+    
+    return JsonResponse({'hours': hours, 'models': models})
+
+
 @csrf_exempt
 def api_send_control_command(request):
     """API: Send control command to device"""
@@ -0,0 +1,83 @@
+"""
+Adaptive Concurrency Limit for IoTShield
+AIMD (additive increase, multiplicative decrease) limit on parallel Ollama
+generations, driven by observed latency and errors instead of a hand-tuned
+constant
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit for one inference host.
+
+    - Every completion under the target latency, while the limit is actually
+      in use, adds 1/limit (so roughly +1 per limit's worth of requests)
+    - A completion over target, or an error, multiplies the limit by `backoff`,
+      at most once per cooldown - requests already in flight were started under
+      the old limit and shouldn't each cut it again
+    """
+
+    def __init__(self, name='', initial=None, min_limit=None, max_limit=None,
+                 target_latency_ms=None, backoff=0.7):
+        self.name = name
+        self.min_limit = min_limit or getattr(settings, 'OLLAMA_MIN_CONCURRENCY', 1)
+        self.max_limit = max_limit or getattr(settings, 'OLLAMA_MAX_CONCURRENCY', 8)
+        self.target_latency_ms = target_latency_ms or getattr(settings, 'OLLAMA_TARGET_LATENCY_MS', 8000)
+        self.backoff = backoff
+        self.limit = float(initial or getattr(settings, 'OLLAMA_INITIAL_CONCURRENCY', 2))
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+        metrics.set_gauge('ollama_concurrency_limit', self.current, endpoint=self.name)
+
+    @property
+    def current(self):
+        """Whole number of requests allowed in flight right now"""
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    def on_sample(self, latency_ms, in_flight, error=False):
+        """
+        Feed one completed request
+
+        Args:
+            latency_ms: Request latency (ignored when error is True)
+            in_flight: Requests still in flight, not counting this one
+            error: The request failed or timed out
+
+        Returns:
+            'increase', 'decrease' or 'hold'
+        """
+        now = time.time()
+        with self._lock:
+            before = self.current
+            if error or latency_ms > self.target_latency_ms:
+                if now < self._cooldown_until:
+                    decision = 'hold'
+                else:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    # Let the requests started under the old limit drain first
+                    wait_ms = self.target_latency_ms if error else max(latency_ms, self.target_latency_ms)
+                    self._cooldown_until = now + wait_ms / 1000
+                    decision = 'decrease'
+            elif in_flight + 1 >= before:
+                # Only grow when the current limit is actually the bottleneck
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                decision = 'increase'
+            else:
+                decision = 'hold'
+            after = self.current
+
+        metrics.increment('ollama_limit_decisions', endpoint=self.name, decision=decision)
+        if after != before:
+            metrics.set_gauge('ollama_concurrency_limit', after, endpoint=self.name)
+            logger.info(f"Ollama concurrency limit for {self.name}: {before} -> {after}"
+                        f"{' (error)' if error else f' (latency {latency_ms:.0f}ms)'}")
+        return decision
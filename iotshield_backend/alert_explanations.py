@@ -0,0 +1,221 @@
+"""
+Lazy LLM Explanations for IoTShield Alerts
+Alerts are raised immediately by the fast detectors; the Ollama explanation
+is generated afterwards (right away for HIGH/CRITICAL, on demand otherwise)
+and cached on the alert row
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db_writer import db_writer
+from .explanation_index import ExplanationIndex
+from .field_encryption import field_encryptor
+from .llm_dispatcher import llm_dispatcher
+from .llm_telemetry import llm_telemetry
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class ExplanationService:
+    """Generates and caches LLM explanations for alerts"""
+
+    def __init__(self, detector=None, dispatcher=None, index=None):
+        self._detector = detector
+        self.dispatcher = dispatcher or llm_dispatcher
+        # Similar past alerts reuse their explanation instead of calling Ollama
+        if index is None and getattr(settings, 'LLM_REUSE_ENABLED', True):
+            index = ExplanationIndex()
+        self.index = index or None
+        self.eager_severities = getattr(settings, 'LLM_EXPLANATION_EAGER_SEVERITIES', ['HIGH', 'CRITICAL'])
+        # A GENERATING claim older than this was lost (process died, job dropped)
+        self.stale_after = getattr(settings, 'LLM_EXPLANATION_STALE_AFTER', 300)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def detector(self):
+        # Created lazily so importing this module never touches Ollama settings
+        if self._detector is None:
+            from .ollama_anomaly_detector import OllamaAnomalyDetector
+            self._detector = OllamaAnomalyDetector()
+        return self._detector
+
+    def is_eager(self, severity):
+        """Should this severity be explained right away instead of on demand?"""
+        return severity in self.eager_severities
+
+    def request(self, alert_id, severity='LOW', reading_time=None, on_complete=None):
+        """
+        Queue explanation generation for an alert (no-op if already queued)
+
+        Args:
+            alert_id: Alert primary key
+            severity: Alert severity, used as the queue priority
+            reading_time: UNIX time of the reading that raised the alert
+            on_complete: Optional callback(alert) run after generation, success or not
+                (also run with the rule-based alert if the job expires in the queue)
+
+        Returns:
+            Future for the generation job
+        """
+        with self._lock:
+            future = self._in_flight.get(alert_id)
+            if future is not None:
+                return future
+            future = self.dispatcher.submit(
+                lambda: self._generate(alert_id, on_complete),
+                severity=severity,
+                reading_time=reading_time,
+                fallback=lambda: self._expired(alert_id, on_complete),
+            )
+            self._in_flight[alert_id] = future
+        future.add_done_callback(lambda _: self._forget(alert_id))
+        return future
+
+    def explain_on_demand(self, alert):
+        """
+        Queue the explanation of an alert a user asked for, ahead of
+        background work. A FAILED alert is retried and one stuck in
+        GENERATING is recovered once its claim is stale. Doesn't wait.
+
+        Returns:
+            Future for the generation job, or None if the alert needs no explanation
+        """
+        if alert.explanation_status not in ('PENDING', 'GENERATING', 'FAILED'):
+            return None
+
+        if alert.explanation_status == 'FAILED':
+            # Allow a retry when someone explicitly asks for it
+            db_writer.call(type(alert).objects.filter(id=alert.id, explanation_status='FAILED').update,
+                           explanation_status='PENDING')
+        elif alert.explanation_status == 'GENERATING':
+            self.reset_stale(alert_id=alert.id)
+
+        priority = alert.severity if alert.severity == 'CRITICAL' else 'HIGH'
+        return self.request(alert.id, severity=priority, reading_time=time.time())
+
+    def reset_stale(self, alert_id=None):
+        """
+        Put alerts claimed for generation more than LLM_EXPLANATION_STALE_AFTER
+        seconds ago back to PENDING. _generate only claims PENDING alerts, so
+        without this an alert whose generator died stays GENERATING forever.
+
+        Args:
+            alert_id: Only look at this alert (default: all of them)
+
+        Returns:
+            Number of alerts reset
+        """
+        from dashboard.models import Alert
+
+        queryset = Alert.objects.filter(explanation_status='GENERATING',
+                                        updated_at__lt=timezone.now() - timedelta(seconds=self.stale_after))
+        if alert_id is not None:
+            queryset = queryset.filter(id=alert_id)
+        reset = db_writer.call(queryset.update, explanation_status='PENDING')
+        if reset:
+            logger.warning(f"Reset {reset} stale explanation claim{'s' if reset > 1 else ''} to PENDING")
+            metrics.increment('llm_explanations_stale', reset)
+        return reset
+
+    def _forget(self, alert_id):
+        with self._lock:
+            self._in_flight.pop(alert_id, None)
+
+    def _expired(self, alert_id, on_complete=None):
+        """The job went stale in the queue - keep the rule-based text"""
+        from dashboard.models import Alert
+
+        # Status stays PENDING so the explanation can still be generated on demand
+        alert = Alert.objects.select_related('sensor_data__device').get(id=alert_id)
+        metrics.increment('llm_explanations', severity=alert.severity, outcome='expired')
+        self._run_callback(alert, on_complete)
+        return alert
+
+    def _run_callback(self, alert, on_complete):
+        if on_complete is not None:
+            try:
+                on_complete(alert)
+            except Exception as e:
+                logger.error(f"Error in explanation callback for alert {alert.id}: {e}")
+
+    def _reuse(self, sensor_dict, severity):
+        """Explanation of a near-identical past alert, or None"""
+        if self.index is None:
+            return None
+        started = time.perf_counter()
+        try:
+            result = self.index.lookup(sensor_dict, severity)
+        except Exception as e:
+            logger.error(f"Explanation index lookup failed: {e}")
+            return None
+        if result is not None:
+            from .ollama_anomaly_detector import PROMPT_VERSION
+            logger.debug(f"Reusing explanation of alert {result['reused_from']} for {sensor_dict['sensor_type']}")
+            llm_telemetry.record(self.detector.model_name, 'explain', (time.perf_counter() - started) * 1000,
+                                 provenance='CACHE', sensor_type=sensor_dict['sensor_type'],
+                                 prompt_version=PROMPT_VERSION)
+        return result
+
+    def _generate(self, alert_id, on_complete=None):
+        """Generate the explanation and store it on the alert"""
+        from dashboard.models import Alert
+
+        # Claim the alert - another process may already be generating it.
+        # updated_at records when, so a lost claim can be detected (reset_stale)
+        claimed = db_writer.call(
+            Alert.objects.filter(id=alert_id, explanation_status='PENDING').update,
+            explanation_status='GENERATING', updated_at=timezone.now()
+        )
+        if not claimed:
+            return None
+
+        alert = Alert.objects.select_related('sensor_data__device').get(id=alert_id)
+        sensor_data = alert.sensor_data
+        device = sensor_data.device
+        sensor_dict = {
+            'device_id': device.device_id,
+            'sensor_type': sensor_data.sensor_type,
+            'value': sensor_data.value,
+            'unit': sensor_data.unit,
+            'device_name': device.name,
+            'location': field_encryptor.reveal(device.location),
+            'timestamp': sensor_data.timestamp.isoformat(),
+        }
+
+        try:
+            result = self._reuse(sensor_dict, alert.severity)
+            if result is None:
+                with metrics.timer('llm_explanation_latency_ms', severity=alert.severity):
+                    # Raises rather than returning a placeholder, so only real output gets this far
+                    result = self.detector.explain(sensor_dict, alert.severity)
+                if self.index is not None:
+                    self.index.add(sensor_dict, alert.severity, result, alert_id=alert.id)
+
+            alert.description = result.get('explanation') or alert.description
+            alert.ai_suggestion = result.get('suggestion') or alert.ai_suggestion
+            alert.explanation_status = 'READY'
+            alert.explanation_reused_from = result.get('reused_from')
+            alert.explained_at = timezone.now()
+            db_writer.call(alert.save, update_fields=['description', 'ai_suggestion', 'explanation_status',
+                                                      'explanation_reused_from', 'explained_at', 'updated_at'])
+            metrics.increment('llm_explanations', severity=alert.severity, outcome='ready')
+        except Exception as e:
+            # Keep the rule-based text; the user can retry from the dashboard
+            logger.error(f"Failed to generate explanation for alert {alert_id}: {e}")
+            db_writer.call(Alert.objects.filter(id=alert_id).update, explanation_status='FAILED')
+            alert.explanation_status = 'FAILED'
+            metrics.increment('llm_explanations', severity=alert.severity, outcome='failed')
+
+        self._run_callback(alert, on_complete)
+        return alert
+
+
+# Global explanation service instance
+explanation_service = ExplanationService()
@@ -0,0 +1,196 @@
+"""
+Anomaly Episode Tracking for IoTShield
+Groups consecutive anomalous readings from the same sensor into one episode,
+so a sustained incident produces one alert instead of one alert per reading
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+
+from .sensor_rules import classify_severity, is_within_band, severity_rank
+
+logger = logging.getLogger('iotshield')
+
+
+class AnomalyEpisode:
+    """State of one open (or recently closed) episode for a device/sensor pair"""
+
+    def __init__(self, alert_id, severity, opened_at):
+        self.alert_id = alert_id
+        self.severity = severity
+        self.opened_at = opened_at
+        self.last_alert_at = opened_at
+        self.closed_at = None
+        self.readings = 1
+        # Reservations only: set once the alert exists or the reservation is released
+        self.resolved = None
+        self.previous = None
+
+    @property
+    def is_open(self):
+        return self.closed_at is None
+
+    @property
+    def pending(self):
+        """Reserved by a reading whose alert is still being created"""
+        return self.alert_id is None
+
+
+class AnomalyEpisodeTracker:
+    """
+    In-memory episode tracker keyed by (device_id, sensor_type).
+
+    Hysteresis: an episode opens when a reading is flagged as anomalous and
+    only closes once the value is back inside the normal band shrunk by
+    `hysteresis` (a fraction of the band width). Readings bouncing around
+    the alert threshold therefore stay in the same episode.
+
+    Readings are analyzed on their own threads. A reading that may open an
+    episode reserves it in check(); concurrent readings of the same stream
+    wait until open_episode() or release() resolves the reservation instead
+    of raising a second alert.
+    """
+
+    # Possible decisions returned by check()
+    ANALYZE = 'ANALYZE'      # No episode applies - run the normal detector
+    REPEAT = 'REPEAT'        # Same episode, same or lower severity - just count it
+    ESCALATE = 'ESCALATE'    # Same episode but severity went up - re-analyze and re-alert
+
+    def __init__(self, hysteresis=None, min_realert_interval=None, reservation_timeout=30):
+        self.hysteresis = hysteresis if hysteresis is not None else getattr(
+            settings, 'ANOMALY_EPISODE_HYSTERESIS', 0.1)
+        self.min_realert_interval = min_realert_interval if min_realert_interval is not None else getattr(
+            settings, 'ANOMALY_MIN_REALERT_INTERVAL', 300)
+
+        # Seconds a reading waits for another reading's alert before analyzing on its own
+        self.reservation_timeout = reservation_timeout
+
+        self._episodes = {}
+        self._lock = threading.Lock()
+
+        logger.debug(
+            f"Anomaly episode tracker initialized (hysteresis={self.hysteresis}, "
+            f"min_realert_interval={self.min_realert_interval}s)"
+        )
+
+    def check(self, device_id, sensor_type, value, now=None):
+        """
+        Decide what to do with a new reading before any LLM call is made
+
+        Args:
+            device_id: Device identifier
+            sensor_type: Sensor type
+            value: Sensor reading
+            now: Optional time.time() value (for testing)
+
+        Returns:
+            Tuple of (decision, episode). For ANALYZE, episode is the reservation
+            made for this reading (None if the value is in the normal band);
+            pass it to release() unless open_episode() was called.
+        """
+        now = time.time() if now is None else now
+        key = (device_id, sensor_type)
+        deadline = time.time() + self.reservation_timeout
+
+        while True:
+            with self._lock:
+                episode = self._episodes.get(key)
+                if episode is None or not episode.pending:
+                    return self._decide(key, episode, value, now)
+                resolved = episode.resolved
+
+            # Another reading of this stream may be opening an episode - wait for its alert
+            if not resolved.wait(max(deadline - time.time(), 0)):
+                logger.warning(f"Timed out waiting for the episode alert of {device_id}/{sensor_type}")
+                return self.ANALYZE, None
+
+    def _decide(self, key, episode, value, now):
+        """check() for a stream without a pending reservation; called with the lock held"""
+        device_id, sensor_type = key
+
+        # Back inside the exit band - the incident is over
+        if is_within_band(sensor_type, value, self.hysteresis):
+            if episode is not None and episode.is_open:
+                episode.closed_at = now
+                logger.info(
+                    f"Anomaly episode closed for {device_id}/{sensor_type} "
+                    f"after {episode.readings} readings"
+                )
+            return self.ANALYZE, None
+
+        if episode is None:
+            return self._reserve(key, None, now)
+
+        rule_severity = classify_severity(sensor_type, value)
+
+        # Closed episode: only reuse it inside the re-alert window
+        if not episode.is_open:
+            if now - episode.last_alert_at >= self.min_realert_interval:
+                return self._reserve(key, episode, now)
+            if rule_severity is None:
+                # Between the exit and enter thresholds - not anomalous on its own
+                return self._reserve(key, episode, now)
+            episode.closed_at = None
+
+        if severity_rank(rule_severity) > severity_rank(episode.severity):
+            return self.ESCALATE, episode
+
+        episode.readings += 1
+        return self.REPEAT, episode
+
+    def _reserve(self, key, previous, now):
+        reservation = AnomalyEpisode(None, None, now)
+        reservation.resolved = threading.Event()
+        reservation.previous = previous
+        self._episodes[key] = reservation
+        return self.ANALYZE, reservation
+
+    def open_episode(self, device_id, sensor_type, alert_id, severity, now=None):
+        """Start tracking a new episode after an alert has been created"""
+        now = time.time() if now is None else now
+        with self._lock:
+            current = self._episodes.get((device_id, sensor_type))
+            self._episodes[(device_id, sensor_type)] = AnomalyEpisode(alert_id, severity, now)
+        # Readings waiting on the reservation now count against this alert
+        if current is not None and current.resolved is not None:
+            current.resolved.set()
+        logger.debug(f"Anomaly episode opened for {device_id}/{sensor_type} ({severity})")
+
+    def release(self, device_id, sensor_type, reservation):
+        """Drop a reservation from check() that did not lead to an alert (no-op after open_episode)"""
+        with self._lock:
+            if self._episodes.get((device_id, sensor_type)) is reservation:
+                if reservation.previous is None:
+                    del self._episodes[(device_id, sensor_type)]
+                else:
+                    self._episodes[(device_id, sensor_type)] = reservation.previous
+        reservation.resolved.set()
+
+    def escalate(self, device_id, sensor_type, severity, now=None):
+        """Record that the episode's alert was raised to a higher severity"""
+        now = time.time() if now is None else now
+        with self._lock:
+            episode = self._episodes.get((device_id, sensor_type))
+            if episode is not None:
+                episode.severity = severity
+                episode.last_alert_at = now
+                episode.readings += 1
+
+    def close_episode(self, device_id, sensor_type, now=None):
+        """Close an episode explicitly (e.g. the detector said the reading is normal)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            episode = self._episodes.get((device_id, sensor_type))
+            if episode is not None and episode.is_open and not episode.pending:
+                episode.closed_at = now
+
+    def get_stats(self):
+        """Summary of tracked episodes"""
+        with self._lock:
+            open_episodes = [e for e in self._episodes.values() if e.is_open and not e.pending]
+            return {
+                'tracked_streams': len(self._episodes),
+                'open_episodes': len(open_episodes),
+                'readings_in_open_episodes': sum(e.readings for e in open_episodes),
+            }
@@ -0,0 +1,140 @@
+"""
+Seasonal Baselines for IoTShield
+Per-(device, sensor_type, hour-of-week) quantiles computed from historical
+readings, kept in memory as one small NumPy table per stream
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('iotshield')
+
+HOURS_PER_WEEK = 168
+
+# 1970-01-01 was a Thursday; shift so that Monday 00:00 is hour 0
+_EPOCH_WEEK_OFFSET_HOURS = 3 * 24
+
+# Columns of a baseline table
+P05, P50, P95, COUNT = 0, 1, 2, 3
+
+
+def hour_of_week(dt):
+    """Hour of week (0-167, Monday 00:00 = 0) in the project time zone"""
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    return dt.weekday() * 24 + dt.hour
+
+
+def hours_of_week(epoch_seconds, utc_offset_seconds=0):
+    """Vectorized hour_of_week for an array of UNIX timestamps"""
+    local_hours = (np.asarray(epoch_seconds, dtype=np.int64) + int(utc_offset_seconds)) // 3600
+    return ((local_hours + _EPOCH_WEEK_OFFSET_HOURS) % HOURS_PER_WEEK).astype(np.int16)
+
+
+def compute_quantile_table(epoch_seconds, values, utc_offset_seconds=0):
+    """
+    Compute the baseline table for one stream
+
+    Args:
+        epoch_seconds: Array of UNIX timestamps
+        values: Array of readings
+        utc_offset_seconds: Offset of the project time zone from UTC
+
+    Returns:
+        float array of shape (168, 4): p05, p50, p95, sample count per hour of week.
+        Hours without samples are NaN with count 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    hours = hours_of_week(epoch_seconds, utc_offset_seconds)
+
+    table = np.full((HOURS_PER_WEEK, 4), np.nan)
+    table[:, COUNT] = np.bincount(hours, minlength=HOURS_PER_WEEK)
+
+    # Sort once by (hour, value) and slice out each hour's run
+    order = np.lexsort((values, hours))
+    sorted_hours = hours[order]
+    sorted_values = values[order]
+    bounds = np.searchsorted(sorted_hours, np.arange(HOURS_PER_WEEK + 1))
+
+    for hour in np.flatnonzero(table[:, COUNT]):
+        run = sorted_values[bounds[hour]:bounds[hour + 1]]
+        table[hour, P05:P95 + 1] = np.quantile(run, [0.05, 0.5, 0.95])
+
+    return table
+
+
+class BaselineStore:
+    """
+    In-memory lookup of baseline tables keyed by (device_id, sensor_type).
+
+    Tables are loaded from SensorBaseline rows and refreshed at most every
+    reload_interval seconds, so lookups never hit the database.
+    """
+
+    def __init__(self, reload_interval=None):
+        self.reload_interval = reload_interval or getattr(settings, 'BASELINE_RELOAD_INTERVAL', 3600)
+        self._tables = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)load all baseline tables from the database"""
+        from dashboard.models import SensorBaseline
+
+        tables = {}
+        rows = SensorBaseline.objects.values_list('device__device_id', 'sensor_type', 'quantiles')
+        for device_id, sensor_type, quantiles in rows:
+            if len(quantiles) == HOURS_PER_WEEK:
+                # Empty hours are stored as null, which becomes NaN here
+                tables[(device_id, sensor_type)] = np.array(quantiles, dtype=np.float64)
+
+        with self._lock:
+            self._tables = tables
+            self._loaded_at = time.time()
+        logger.info(f"Loaded {len(tables)} seasonal baselines")
+        return len(tables)
+
+    def _maybe_reload(self):
+        if time.time() - self._loaded_at >= self.reload_interval:
+            try:
+                self.load()
+            except Exception as e:
+                # Keep serving the old tables (and don't retry on every reading)
+                self._loaded_at = time.time()
+                logger.error(f"Failed to reload seasonal baselines: {e}")
+
+    def lookup(self, device_id, sensor_type, when):
+        """
+        Baseline row for a reading
+
+        Args:
+            device_id: Device identifier
+            sensor_type: Sensor type
+            when: datetime of the reading
+
+        Returns:
+            Array [p05, p50, p95, count] or None if there is no baseline
+        """
+        self._maybe_reload()
+        table = self._tables.get((device_id, sensor_type))
+        if table is None:
+            return None
+        return table[hour_of_week(when)]
+
+    def __len__(self):
+        return len(self._tables)
+
+
+def parse_timestamp(value):
+    """Accept a datetime or an ISO string (as used in sensor dicts)"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return timezone.now()
@@ -0,0 +1,208 @@
+"""
+Streaming Change-Point Detection for IoTShield
+Two-sided CUSUM per (device, sensor_type) that catches slow drifts in the
+mean (filling disks, leaking memory, a humidity sensor going bad) that never
+cross a fixed severity band. Constant memory per stream, no history queries.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class _Stream:
+    """CUSUM state for one stream - a handful of floats"""
+    __slots__ = ('count', 'mean', 'm2', 'ref_mean', 'ref_std',
+                 'pos', 'neg', 'run', 'run_sum', 'last_seen',
+                 'alert_id', 'alert_direction', 'alert_at', 'alert_baseline')
+
+    def __init__(self):
+        self.reset()
+        self.last_seen = 0.0
+        # Trend alert raised for the last change point (kept across resets)
+        self.alert_id = None
+        self.alert_direction = None
+        self.alert_at = 0.0
+        self.alert_baseline = None
+
+    def reset(self):
+        # Reference (learned with Welford during warm-up)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ref_mean = None
+        self.ref_std = None
+        # Cumulative sums for upward / downward shifts
+        self.pos = 0.0
+        self.neg = 0.0
+        # Readings since the active sum last left zero, for the new-mean estimate
+        self.run = 0
+        self.run_sum = 0.0
+
+
+class ChangePointDetector:
+    """
+    Two-sided CUSUM on standardized readings.
+
+    Each stream first learns a reference mean/std from min_samples readings.
+    After that every reading updates
+
+        S+ = max(0, S+ + z - k)      S- = max(0, S- - z - k)
+
+    where z is the reading's z-score against the reference, clipped to
+    +/- clip so a single spike can't trigger a trend alert on its own.
+    When either sum exceeds the threshold h a change point is reported and
+    the stream re-learns its reference from the new level.
+
+    A steady ramp produces a change point every so often; ones in the same
+    direction within realert_interval of the last are reported with the
+    existing trend alert's id so the caller can update it instead of
+    raising a new one.
+    """
+
+    def __init__(self, threshold=None, drift=None, min_samples=None, clip=None, sensor_types=None,
+                 realert_interval=None):
+        self.threshold = threshold or getattr(settings, 'CHANGE_POINT_THRESHOLD', 10.0)
+        self.drift = drift if drift is not None else getattr(settings, 'CHANGE_POINT_DRIFT', 0.5)
+        self.min_samples = min_samples or getattr(settings, 'CHANGE_POINT_MIN_SAMPLES', 100)
+        self.clip = clip or getattr(settings, 'CHANGE_POINT_CLIP', 3.0)
+        self.realert_interval = realert_interval or getattr(settings, 'CHANGE_POINT_REALERT_INTERVAL', 3600)
+        self.sensor_types = set(sensor_types or getattr(settings, 'CHANGE_POINT_SENSOR_TYPES', [
+            'TEMPERATURE', 'HUMIDITY', 'CPU_TEMPERATURE', 'MEMORY_USAGE', 'DISK_USAGE',
+        ]))
+        self._streams = {}
+        self._lock = threading.Lock()
+
+        logger.debug(
+            f"Change-point detector initialized (h={self.threshold}, k={self.drift}, "
+            f"warm-up={self.min_samples}) for {', '.join(sorted(self.sensor_types))}"
+        )
+
+    def handles(self, sensor_type):
+        return sensor_type in self.sensor_types
+
+    def update(self, device_id, sensor_type, value, now=None):
+        """
+        Feed one reading
+
+        Args:
+            device_id: Device identifier
+            sensor_type: Sensor type
+            value: Sensor reading
+            now: UNIX time of the reading (defaults to now)
+
+        Returns:
+            None, or a dict describing the change point:
+            direction ('UP' / 'DOWN'), reference_mean, reference_std, new_mean,
+            samples, baseline_mean (level before the drift began - differs from
+            reference_mean when continuing) and alert_id (the trend alert this
+            continues, or None)
+        """
+        if sensor_type not in self.sensor_types:
+            return None
+
+        key = (device_id, sensor_type)
+        value = float(value)
+        now = now or time.time()
+
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = _Stream()
+                metrics.set_gauge('change_point_streams', len(self._streams))
+            stream.last_seen = time.time()
+
+            if stream.ref_mean is None:
+                self._learn(stream, value)
+                return None
+
+            z = (value - stream.ref_mean) / stream.ref_std
+            z = max(-self.clip, min(self.clip, z))
+
+            was_active = stream.pos > 0 or stream.neg > 0
+            stream.pos = max(0.0, stream.pos + z - self.drift)
+            stream.neg = max(0.0, stream.neg - z - self.drift)
+
+            if stream.pos > 0 or stream.neg > 0:
+                if not was_active:
+                    stream.run = 0
+                    stream.run_sum = 0.0
+                stream.run += 1
+                stream.run_sum += value
+
+            if stream.pos <= self.threshold and stream.neg <= self.threshold:
+                return None
+
+            direction = 'UP' if stream.pos > self.threshold else 'DOWN'
+            continuing = (
+                stream.alert_id is not None
+                and stream.alert_direction == direction
+                and now - stream.alert_at < self.realert_interval
+            )
+            if not continuing:
+                stream.alert_baseline = stream.ref_mean
+            change = {
+                'device_id': device_id,
+                'sensor_type': sensor_type,
+                'direction': direction,
+                'reference_mean': stream.ref_mean,
+                'reference_std': stream.ref_std,
+                'new_mean': stream.run_sum / stream.run,
+                'samples': stream.run,
+                'baseline_mean': stream.alert_baseline,
+                'alert_id': stream.alert_id if continuing else None,
+            }
+            if continuing:
+                stream.alert_at = now
+            # Start over at the new level
+            stream.reset()
+
+        metrics.increment('change_points', sensor_type=sensor_type, direction=change['direction'])
+        logger.info(
+            f"Change point on {device_id}/{sensor_type}: mean {change['reference_mean']:.2f} -> "
+            f"{change['new_mean']:.2f} over {change['samples']} readings"
+        )
+        return change
+
+    def attach_alert(self, device_id, sensor_type, alert_id, direction, now=None):
+        """Remember the trend alert raised for a stream's latest change point"""
+        with self._lock:
+            stream = self._streams.get((device_id, sensor_type))
+            if stream is not None:
+                stream.alert_id = alert_id
+                stream.alert_direction = direction
+                stream.alert_at = now or time.time()
+
+    def _learn(self, stream, value):
+        """Welford update of the reference; freezes it after min_samples"""
+        stream.count += 1
+        delta = value - stream.mean
+        stream.mean += delta / stream.count
+        stream.m2 += delta * (value - stream.mean)
+
+        if stream.count >= self.min_samples:
+            stream.ref_mean = stream.mean
+            # Floor the std so perfectly flat sensors don't divide by zero
+            std = math.sqrt(stream.m2 / (stream.count - 1))
+            stream.ref_std = max(std, 1e-6, abs(stream.mean) * 1e-3)
+
+    def cleanup_idle(self, max_idle=86400):
+        """Drop streams that haven't reported in max_idle seconds"""
+        cutoff = time.time() - max_idle
+        with self._lock:
+            idle = [key for key, stream in self._streams.items() if stream.last_seen < cutoff]
+            for key in idle:
+                del self._streams[key]
+            metrics.set_gauge('change_point_streams', len(self._streams))
+        return len(idle)
+
+    def get_stats(self):
+        with self._lock:
+            warming = sum(1 for stream in self._streams.values() if stream.ref_mean is None)
+            return {'streams': len(self._streams), 'warming_up': warming}
@@ -0,0 +1,141 @@
+"""
+Serialized Database Writer for IoTShield
+SQLite has one write lock per file. In the MQTT listener the message loop,
+the per-reading analysis threads, the explanation workers and the rollup and
+telemetry flushers used to take it independently. Under load they queued up
+on it and failed with "database is locked" once the busy timeout ran out.
+
+With the writer started, all of them hand their writes to one thread. That
+thread commits whatever has queued since its last commit in one transaction,
+each job in its own savepoint, so a burst of readings costs one commit and a
+failing job rolls back only itself. Callers get the job's result (or its
+exception) once the commit is done. Where the writer is not running (web
+workers, management commands, tests) jobs run inline on the caller's thread.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class DatabaseWriter:
+    """One thread that runs and group-commits a process's database writes"""
+
+    def __init__(self, max_batch=None):
+        self.max_batch = max_batch or getattr(settings, 'DB_WRITER_MAX_BATCH', 200)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Start the writer thread (no-op if it is running)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+        logger.info(f"Database writer started (up to {self.max_batch} jobs per commit)")
+
+    def stop(self, timeout=10):
+        """Commit everything queued so far and stop the thread; later jobs run inline"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def _inline(self):
+        thread = self._thread
+        # A job that writes through the writer again must not wait on itself
+        return thread is None or thread is threading.current_thread()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); the returned Future resolves after its transaction commits"""
+        future = Future()
+        if self._inline():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the writer and wait for the commit; returns its result or raises"""
+        if self._inline():
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self):
+        from django.db import connection
+
+        stopping = False
+        while True:
+            try:
+                # Once stopped, keep going only while jobs queued around the stop are coming in
+                item = self._queue.get(timeout=0.1 if stopping else None)
+            except queue.Empty:
+                break
+            jobs = []
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    jobs.append(item)
+                if len(jobs) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if jobs:
+                self._commit(jobs)
+        connection.close()
+
+    def _commit(self, jobs):
+        from django.db import transaction
+
+        results = []
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                for fn, args, kwargs, future in jobs:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, fn(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed - none of the batch was written
+            logger.error(f"Database writer failed to commit {len(jobs)} jobs: {e}")
+            metrics.increment('db_writer_failed_commits')
+            for *_, future in jobs:
+                future.set_exception(e)
+            return
+
+        metrics.observe('db_writer_commit_ms', (time.perf_counter() - started) * 1000)
+        metrics.observe('db_writer_batch_size', len(jobs))
+        metrics.increment('db_writer_jobs', len(jobs))
+        for future, result, error in results:
+            if error is not None:
+                metrics.increment('db_writer_failed_jobs')
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+# Global writer instance - started by the MQTT listener (DB_SINGLE_WRITER)
+db_writer = DatabaseWriter()
@@ -0,0 +1,241 @@
+"""
+Decryption Offload for IoTShield
+Moves RSA-OAEP payload decryption off paho's network thread onto a pool of
+worker processes (each loads the private key once), while messages are
+still handed to the listener in the order they arrived. Workers send their
+metrics back with each result, and are replaced when the keys are reloaded.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+# Set in each worker process by _init_worker
+_worker_rsa = None
+
+
+def _init_worker():
+    """Load the private key once per worker process"""
+    global _worker_rsa
+    import django
+    from django.conf import settings as worker_settings
+    if not worker_settings.configured:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+    django.setup()
+
+    # Importing privacy_engine loads the private key (once, for this process)
+    from .privacy_engine import rsa_encryption
+    _worker_rsa = rsa_encryption
+
+
+def _worker_ready():
+    time.sleep(0.01)
+    return os.getpid()
+
+
+def _decrypt_in_worker(payload):
+    """
+    Returns:
+        (decrypted payload, metrics recorded while decrypting it) - the worker's
+        own registry is never dumped, so per-key decrypt counts and timings are
+        counted in the listener (see DecryptOffload._unwrap)
+    """
+    # Drop whatever worker start-up recorded - only this message's metrics go back
+    metrics.collect()
+    data = _worker_rsa.decrypt_mqtt_payload(payload)
+    return data, metrics.collect()
+
+
+def needs_offload(payload):
+    """
+    Only the legacy scheme costs an RSA operation per message. Hybrid
+    envelopes are one AES-GCM call with a cached key - cheaper inline than
+    the round trip to another process.
+    """
+    from .privacy_engine import LEGACY_ENCRYPTION_TYPE
+    return isinstance(payload, dict) and payload.get('encrypted') and \
+        payload.get('encryption_type') == LEGACY_ENCRYPTION_TYPE
+
+
+class DecryptOffload:
+    """
+    Decrypts MQTT payloads in parallel and delivers them in arrival order.
+
+    submit() blocks once `max_pending` messages are in flight, which pushes
+    back on paho (and the broker) instead of growing memory. Results are
+    delivered by a single thread in submission order, so readings from any
+    one device are handled in the order they were published.
+    """
+
+    def __init__(self, handler, workers=None, max_pending=None):
+        """
+        Args:
+            handler: Called as handler(topic, data) with each decrypted message
+            workers: Worker processes (0 = decrypt inline, still in order)
+            max_pending: Messages allowed in flight before submit() blocks
+        """
+        self.handler = handler
+        self.workers = workers if workers is not None else decrypt_workers()
+        self.max_pending = max_pending or getattr(settings, 'MQTT_DECRYPT_MAX_PENDING', 1000)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._pool = None
+        self._delivery = None
+
+    def submit(self, topic, payload):
+        """Queue one parsed (still encrypted) message"""
+        if not self._slots.acquire(blocking=False):
+            # Full - wait for the oldest messages to be delivered
+            started = time.perf_counter()
+            self._slots.acquire()
+            metrics.observe('mqtt_decrypt_backpressure_ms', (time.perf_counter() - started) * 1000)
+
+        self._ensure_delivery()
+        submitted = time.perf_counter()
+        future = self._decrypt(payload)
+        with self._cond:
+            self._pending.append((topic, future, submitted))
+            metrics.set_gauge('mqtt_decrypt_pending', len(self._pending))
+        future.add_done_callback(self._notify)
+
+    def _decrypt(self, payload):
+        if self.workers and needs_offload(payload):
+            metrics.increment('mqtt_decrypt_messages', path='offload')
+            future = Future()
+            self._ensure_pool().submit(_decrypt_in_worker, payload).add_done_callback(
+                lambda done: self._unwrap(done, future))
+            return future
+
+        metrics.increment('mqtt_decrypt_messages', path='inline')
+        future = Future()
+        try:
+            from .privacy_engine import rsa_encryption
+            future.set_result(rsa_encryption.decrypt_mqtt_payload(payload) if rsa_encryption else payload)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def _unwrap(done, future):
+        """Count the worker's metrics here and pass its decrypted payload on"""
+        try:
+            data, worker_metrics = done.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        metrics.merge(worker_metrics)
+        future.set_result(data)
+
+    def _notify(self, _future):
+        with self._cond:
+            self._cond.notify()
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            with self._cond:
+                if self._pool is None:
+                    # spawn, not fork - the listener already runs threads and DB connections
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker,
+                    )
+                    logger.info(f"Started {self.workers} decryption worker processes")
+        return self._pool
+
+    def _ensure_delivery(self):
+        if self._delivery is not None:
+            return
+        with self._cond:
+            if self._delivery is None:
+                self._delivery = threading.Thread(target=self._deliver_loop, name='mqtt-decrypt-delivery',
+                                                  daemon=True)
+                self._delivery.start()
+
+    def _deliver_loop(self):
+        while True:
+            with self._cond:
+                # Only the oldest message may be delivered, even if later ones finished first
+                while not self._pending or not self._pending[0][1].done():
+                    self._cond.wait()
+                topic, future, submitted = self._pending.popleft()
+                metrics.set_gauge('mqtt_decrypt_pending', len(self._pending))
+            self._slots.release()
+            # Queueing + decryption + waiting behind older messages
+            metrics.observe('mqtt_decrypt_latency_ms', (time.perf_counter() - submitted) * 1000)
+
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.error(f"Error decrypting MQTT payload: {e}")
+                metrics.increment('mqtt_decrypt_errors')
+                continue
+            try:
+                self.handler(topic, data)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+
+    def drain(self, timeout=None):
+        """Wait until every submitted message has been delivered"""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            with self._cond:
+                if not self._pending:
+                    return True
+            if deadline and time.time() > deadline:
+                return False
+            time.sleep(0.001)
+
+    def start(self):
+        """Spawn every worker now so the first messages don't pay for Django setup and key loading"""
+        if not self.workers:
+            return 0
+        pool = self._ensure_pool()
+        pids = set()
+        deadline = time.time() + 60
+        # Ready workers can answer for ones still starting, so keep asking until all have replied
+        while len(pids) < self.workers and time.time() < deadline:
+            pids.update(future.result() for future in [pool.submit(_worker_ready) for _ in range(self.workers)])
+        return len(pids)
+
+    def reload_keys(self):
+        """
+        Replace the worker processes so they load the current RSA keys (the
+        listener forwards its SIGHUP here). Messages already queued finish on
+        the old workers.
+
+        Returns:
+            Number of new workers that are ready
+        """
+        with self._cond:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            # Not started yet - the first offloaded message loads the keys from disk
+            return 0
+        pool.shutdown(wait=False)
+        logger.info("Restarting decryption workers to load the reloaded RSA keys")
+        return self.start()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def decrypt_workers():
+    """Worker processes from MQTT_DECRYPT_WORKERS, by default one per spare core"""
+    configured = getattr(settings, 'MQTT_DECRYPT_WORKERS', None)
+    if configured is not None:
+        return configured
+    # Leave one core for paho, Django and the analysis threads
+    return max((os.cpu_count() or 1) - 1, 0)
@@ -0,0 +1,405 @@
+"""
+Pluggable Anomaly Detectors for IoTShield
+Detector interface, cheap rule/statistical detectors and a registry that
+routes each sensor type through a chain of detector tiers
+"""
+import logging
+import math
+import threading
+from typing import Dict, List
+
+import numpy as np
+from django.conf import settings
+
+from .sensor_rules import SENSOR_RULES, classify_severity, severity_rank
+from .utils.metrics import metrics
+from .vectorized_detectors import SEVERITY_NAMES, rule_severity_ranks
+
+logger = logging.getLogger('iotshield')
+
+
+# Generic recommendations used by the non-LLM detectors
+RULE_SUGGESTIONS = {
+    'LOW': 'No immediate action needed. Keep an eye on this sensor.',
+    'MEDIUM': 'Monitor this sensor closely and check the device if the reading persists.',
+    'HIGH': 'Investigate the device and its surroundings soon.',
+    'CRITICAL': 'Immediate action required - check the location for danger now.',
+}
+
+
+class BaseDetector:
+    """
+    Interface every detector implements.
+
+    analyze() takes the same sensor dict the Ollama detector uses and returns
+    a result dict with: anomaly, explanation, severity, suggestion.
+    A detector may return None to abstain (e.g. it has no data for this
+    sensor yet) - the chain then keeps the previous tier's verdict.
+    """
+    name = 'base'
+    # Expensive detectors (the LLM) are left out of the fast detection path
+    is_expensive = False
+    # Most severe earlier verdict this detector may clear or lower
+    max_downgrade_severity = 'CRITICAL'
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        raise NotImplementedError
+
+    def observe(self, sensor_data: Dict):
+        """Learn from a reading the chain did not send to this tier (stateful detectors only)"""
+
+    def analyze_batch(self, readings: List[Dict]) -> List[Dict]:
+        """Analyze several readings. Override when a detector can do better than a loop."""
+        return [self.analyze(reading) for reading in readings]
+
+    @staticmethod
+    def _normal_result(explanation='Reading is within the normal range'):
+        return {
+            'anomaly': False,
+            'explanation': explanation,
+            'severity': 'LOW',
+            'suggestion': 'Continue normal operation',
+        }
+
+
+class RuleDetector(BaseDetector):
+    """Fixed severity bands from sensor_rules - essentially free"""
+    name = 'rules'
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        sensor_type = sensor_data.get('sensor_type', '')
+        value = float(sensor_data.get('value', 0))
+        return self._build_result(sensor_type, value, sensor_data.get('unit', ''),
+                                  classify_severity(sensor_type, value))
+
+    def analyze_batch(self, readings: List[Dict]) -> List[Dict]:
+        if not readings:
+            return []
+        sensor_types = np.array([r.get('sensor_type', '') for r in readings], dtype=object)
+        values = np.array([float(r.get('value', 0)) for r in readings], dtype=np.float64)
+        severities = SEVERITY_NAMES[rule_severity_ranks(sensor_types, values)]
+        return [
+            self._build_result(reading.get('sensor_type', ''), value, reading.get('unit', ''), severity)
+            for reading, value, severity in zip(readings, values, severities)
+        ]
+
+    def _build_result(self, sensor_type, value, unit, severity):
+        if severity is None:
+            return self._normal_result()
+
+        low, high = SENSOR_RULES[sensor_type]['normal']
+        unit = f" {unit}" if unit else ''
+        return {
+            'anomaly': True,
+            'explanation': f"{sensor_type} reading {value}{unit} is outside the normal range ({low}-{high}{unit}).",
+            'severity': severity,
+            'suggestion': RULE_SUGGESTIONS[severity],
+        }
+
+
+class StatisticalDetector(BaseDetector):
+    """
+    Per-stream z-score detector with O(1) state per (device, sensor_type).
+
+    Keeps a running mean/variance (Welford) and flags readings more than
+    z_threshold standard deviations away, once min_samples have been seen.
+    The chain feeds it every reading (see observe), not only the ones earlier
+    tiers flagged - otherwise the history it compares against would be made
+    of anomalies. A sensor stuck at a dangerous level soon looks "normal" to
+    it, so it may not clear or lower a rule verdict of HIGH or above.
+    """
+    name = 'stats'
+    max_downgrade_severity = 'MEDIUM'
+
+    def __init__(self, z_threshold=None, min_samples=None):
+        self.z_threshold = z_threshold if z_threshold is not None else getattr(
+            settings, 'STATS_DETECTOR_Z_THRESHOLD', 3.0
+        )
+        self.min_samples = min_samples if min_samples is not None else getattr(
+            settings, 'STATS_DETECTOR_MIN_SAMPLES', 30
+        )
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        key = (sensor_data.get('device_id', sensor_data.get('device_name', '')), sensor_data.get('sensor_type', ''))
+        value = float(sensor_data.get('value', 0))
+
+        with self._lock:
+            count, mean, m2 = self._streams.get(key, (0, 0.0, 0.0))
+            warmed_up = count >= self.min_samples and m2 > 0
+            z = abs(value - mean) / math.sqrt(m2 / (count - 1)) if warmed_up else 0.0
+            self._update(key, value)
+
+        # Not enough history yet - abstain rather than clear the reading
+        if not warmed_up:
+            return None
+
+        if z < self.z_threshold:
+            return self._normal_result('Reading is consistent with this sensor\'s recent history')
+
+        severity = 'CRITICAL' if z >= 3 * self.z_threshold else 'HIGH' if z >= 2 * self.z_threshold else 'MEDIUM'
+        return {
+            'anomaly': True,
+            'explanation': f"{key[1]} reading {value} is {z:.1f} standard deviations from this sensor's typical value ({mean:.2f}).",
+            'severity': severity,
+            'suggestion': RULE_SUGGESTIONS[severity],
+        }
+
+    def observe(self, sensor_data: Dict):
+        key = (sensor_data.get('device_id', sensor_data.get('device_name', '')), sensor_data.get('sensor_type', ''))
+        with self._lock:
+            self._update(key, float(sensor_data.get('value', 0)))
+
+    def _update(self, key, value):
+        # Welford update; called with the lock held
+        count, mean, m2 = self._streams.get(key, (0, 0.0, 0.0))
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        m2 += delta * (value - mean)
+        self._streams[key] = (count, mean, m2)
+
+
+class SeasonalBaselineDetector(BaseDetector):
+    """
+    Hour-of-week baseline detector. Clears readings that are normal for this
+    device at this time of the week (e.g. 50 lux at 2 am) with an O(1)
+    lookup into the precomputed baseline tables.
+    The baseline is learned from whatever happened before, including
+    incidents that recur at the same hour, so it may only clear or lower
+    LOW and MEDIUM rule verdicts - a gas leak is never "usual".
+    """
+    name = 'seasonal'
+    max_downgrade_severity = 'MEDIUM'
+
+    def __init__(self, store=None, min_samples=None, margin=None):
+        from .baselines import BaselineStore
+        self.store = store or BaselineStore()
+        self.min_samples = min_samples if min_samples is not None else getattr(settings, 'BASELINE_MIN_SAMPLES', 5)
+        self.margin = margin if margin is not None else getattr(settings, 'BASELINE_MARGIN', 0.1)
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        from .baselines import COUNT, P05, P50, P95, parse_timestamp
+
+        sensor_type = sensor_data.get('sensor_type', '')
+        value = float(sensor_data.get('value', 0))
+        when = parse_timestamp(sensor_data.get('timestamp'))
+
+        baseline = self.store.lookup(sensor_data.get('device_id', ''), sensor_type, when)
+        if baseline is None or baseline[COUNT] < self.min_samples:
+            return None
+
+        # Allow a margin around the p05-p95 band, scaled by its width
+        spread = max(baseline[P95] - baseline[P05], 1e-9)
+        low = baseline[P05] - self.margin * spread
+        high = baseline[P95] + self.margin * spread
+
+        if low <= value <= high:
+            return self._normal_result(
+                f"{sensor_type} reading {value} is typical for this time of week "
+                f"(usual range {baseline[P05]:.2f}-{baseline[P95]:.2f})"
+            )
+
+        # Severity from how many band-widths the reading is outside the band
+        distance = (low - value if value < low else value - high) / spread
+        severity = 'CRITICAL' if distance >= 2 else 'HIGH' if distance >= 1 else 'MEDIUM' if distance >= 0.5 else 'LOW'
+        return {
+            'anomaly': True,
+            'explanation': (
+                f"{sensor_type} reading {value} is unusual for this time of week "
+                f"(typical {baseline[P50]:.2f}, usual range {baseline[P05]:.2f}-{baseline[P95]:.2f})."
+            ),
+            'severity': severity,
+            'suggestion': RULE_SUGGESTIONS[severity],
+        }
+
+
+class DetectorChain:
+    """
+    Runs detector tiers in order. Each tier only runs if the previous tier
+    flagged the reading, so expensive detectors only see escalations. Tiers
+    that are skipped still observe() the reading.
+    """
+
+    def __init__(self, detectors):
+        self.detectors = detectors
+
+    @property
+    def names(self):
+        return [detector.name for detector in self.detectors]
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        result = None
+        for position, detector in enumerate(self.detectors):
+            tier_result = _timed_analyze(detector, sensor_data)
+            if tier_result is None or _overruled(detector, result, tier_result):
+                continue
+            result = tier_result
+            if not result.get('anomaly', False):
+                for skipped in self.detectors[position + 1:]:
+                    skipped.observe(sensor_data)
+                break
+        # Every tier abstained - nothing to report
+        return result if result is not None else BaseDetector._normal_result()
+
+    def analyze_batch(self, readings: List[Dict]) -> List[Dict]:
+        results = [None] * len(readings)
+        pending = list(range(len(readings)))
+        stopped = []
+
+        for detector in self.detectors:
+            # Readings an earlier tier cleared still feed this one
+            for index in stopped:
+                detector.observe(readings[index])
+            if not pending:
+                continue
+            batch = [readings[i] for i in pending]
+            batch_results = _timed_analyze_batch(detector, batch)
+
+            escalated = []
+            for index, result in zip(pending, batch_results):
+                if result is not None and not _overruled(detector, results[index], result):
+                    results[index] = result
+                if results[index] is None or results[index].get('anomaly', False):
+                    escalated.append(index)
+                else:
+                    stopped.append(index)
+            pending = escalated
+
+        return [result if result is not None else BaseDetector._normal_result() for result in results]
+
+
+def _overruled(detector, previous, result):
+    """True if result would clear or lower a verdict more severe than this detector may downgrade"""
+    if previous is None or not previous.get('anomaly', False):
+        return False
+    previous_rank = severity_rank(previous.get('severity'))
+    if previous_rank <= severity_rank(detector.max_downgrade_severity):
+        return False
+    return not result.get('anomaly', False) or severity_rank(result.get('severity')) < previous_rank
+
+
+def _record_verdict(detector, result):
+    if result is None:
+        metrics.increment('detector_verdicts', detector=detector.name, verdict='abstain')
+        return
+    result['detector'] = detector.name
+    verdict = 'anomaly' if result.get('anomaly') else 'normal'
+    metrics.increment('detector_verdicts', detector=detector.name, verdict=verdict)
+
+
+def _timed_analyze(detector, sensor_data):
+    with metrics.timer('detector_latency_ms', detector=detector.name):
+        result = detector.analyze(sensor_data)
+    _record_verdict(detector, result)
+    return result
+
+
+def _timed_analyze_batch(detector, readings):
+    with metrics.timer('detector_batch_latency_ms', detector=detector.name) as timer:
+        results = detector.analyze_batch(readings)
+    # Also record the amortized per-reading latency so tiers can be compared
+    per_reading = timer.elapsed_ms / max(len(readings), 1)
+    for result in results:
+        metrics.observe('detector_latency_ms', per_reading, detector=detector.name)
+        _record_verdict(detector, result)
+    return results
+
+
+def _create_llm_detector():
+    from .ollama_anomaly_detector import OllamaAnomalyDetector
+    return OllamaAnomalyDetector()
+
+
+# Detector name -> factory. Use DetectorRegistry.register() to add more.
+DETECTOR_FACTORIES = {
+    'rules': RuleDetector,
+    'stats': StatisticalDetector,
+    'seasonal': SeasonalBaselineDetector,
+    'llm': _create_llm_detector,
+}
+
+
+class DetectorRegistry:
+    """
+    Builds one shared instance per detector and one chain per sensor type
+    from settings.ANOMALY_DETECTOR_ROUTES.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = routes or getattr(settings, 'ANOMALY_DETECTOR_ROUTES', {'default': ['llm']})
+        self._factories = dict(DETECTOR_FACTORIES)
+        self._detectors = {}
+        self._chains = {}
+        self._lock = threading.Lock()
+
+        for sensor_type, tiers in self.routes.items():
+            logger.debug(f"Detector route {sensor_type}: {' -> '.join(tiers)}")
+
+    def register(self, name, factory):
+        """Add or replace a detector factory (call before the first analysis)"""
+        with self._lock:
+            self._factories[name] = factory
+            self._detectors.pop(name, None)
+            self._chains.clear()
+
+    def get_detector(self, name):
+        """Shared detector instance, created on first use"""
+        with self._lock:
+            if name not in self._detectors:
+                if name not in self._factories:
+                    raise ValueError(f"Unknown detector: {name}")
+                self._detectors[name] = self._factories[name]()
+            return self._detectors[name]
+
+    def _tiers(self, sensor_type):
+        return self.routes.get(sensor_type, self.routes.get('default', ['llm']))
+
+    def get_chain(self, sensor_type, include_expensive=True) -> DetectorChain:
+        key = (sensor_type, include_expensive)
+        chain = self._chains.get(key)
+        if chain is None:
+            detectors = [self.get_detector(name) for name in self._tiers(sensor_type)]
+            if not include_expensive:
+                detectors = [d for d in detectors if not d.is_expensive] or [self.get_detector('rules')]
+            chain = DetectorChain(detectors)
+            self._chains[key] = chain
+        return chain
+
+    def uses_expensive_tier(self, sensor_type):
+        """True if this sensor type's route ends in an expensive detector (the LLM)"""
+        return any(self.get_detector(name).is_expensive for name in self._tiers(sensor_type))
+
+    def analyze(self, sensor_data: Dict) -> Dict:
+        return self.get_chain(sensor_data.get('sensor_type', '')).analyze(sensor_data)
+
+    def analyze_fast(self, sensor_data: Dict) -> Dict:
+        """Run only the cheap tiers of the route - used to raise alerts without waiting for the LLM"""
+        return self.get_chain(sensor_data.get('sensor_type', ''), include_expensive=False).analyze(sensor_data)
+
+    def analyze_batch(self, readings: List[Dict]) -> List[Dict]:
+        """Analyze a mixed batch, grouping readings by sensor type so each chain sees one batch"""
+        results = [None] * len(readings)
+        by_type = {}
+        for index, reading in enumerate(readings):
+            by_type.setdefault(reading.get('sensor_type', ''), []).append(index)
+
+        for sensor_type, indexes in by_type.items():
+            chain_results = self.get_chain(sensor_type).analyze_batch([readings[i] for i in indexes])
+            for index, result in zip(indexes, chain_results):
+                results[index] = result
+        return results
+
+    def get_stats(self):
+        """Per-detector latency and verdict counts"""
+        snapshot = metrics.snapshot()
+        stats = {}
+        for name in self._factories:
+            stats[name] = {
+                'latency_ms': snapshot['timings'].get(f"detector_latency_ms{{detector={name}}}"),
+                'anomaly': snapshot['counters'].get(f"detector_verdicts{{detector={name},verdict=anomaly}}", 0),
+                'normal': snapshot['counters'].get(f"detector_verdicts{{detector={name},verdict=normal}}", 0),
+                'abstain': snapshot['counters'].get(f"detector_verdicts{{detector={name},verdict=abstain}}", 0),
+            }
+        return stats
@@ -0,0 +1,214 @@
+"""
+Differentially Private Aggregates for IoTShield
+Noisy count / sum / mean / histogram releases over time windows. Queries are
+aligned to release windows, so identical queries within a window are served
+the same cached noisy answer at no further privacy cost and without hitting
+the database again.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+
+from .privacy_budget import ReleaseCache, laplace_rho, privacy_accountant
+from .privacy_engine import DEFAULT_BOUNDS, SENSOR_BOUNDS, privacy_engine
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+# Device id used for budget streams that aggregate over every device
+ALL_DEVICES = '*'
+# Budget stream for alert statistics
+ALERTS_STREAM = 'ALERTS'
+
+# Concurrent misses on the same query wait on one of these instead of all computing
+_LOCK_STRIPES = 64
+
+
+class BudgetExhausted(Exception):
+    """No cached release to fall back on and the budget can't cover a new one"""
+
+    def __init__(self, keys):
+        super().__init__(f"Privacy budget exhausted for {len(keys)} streams")
+        self.keys = keys
+
+
+def sum_sensitivity(sensor_type):
+    """Largest change one (clipped) reading can make to a sum"""
+    bounds = SENSOR_BOUNDS.get(sensor_type, DEFAULT_BOUNDS)
+    return max(abs(bounds['min']), abs(bounds['max']))
+
+
+class DPAggregateEngine:
+    """
+    Laplace-noised aggregates with one release per (consumer, query, window).
+
+    A query's time range always ends at the current window boundary
+    (DP_RELEASE_WINDOW seconds), so a dashboard polling every few seconds
+    keeps getting the release made at the start of the window. Each new
+    release is charged to the privacy accountant; once a stream's budget is
+    gone the last release is served again (marked stale) instead.
+    """
+
+    def __init__(self, engine=None, accountant=None, window=None, epsilon=None):
+        self.engine = engine or privacy_engine
+        self.accountant = accountant or privacy_accountant
+        self.window = window or getattr(settings, 'DP_RELEASE_WINDOW', 300)
+        self.epsilon = epsilon or getattr(settings, 'DP_AGGREGATE_EPSILON', self.engine.epsilon)
+        # (consumer, query) -> (window_end, release); LRU so arbitrary query parameters stay bounded
+        self._releases = ReleaseCache()
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    # ---- mechanisms ------------------------------------------------------
+
+    def noisy_count(self, true_count, epsilon):
+        """Count + Laplace(1/epsilon), rounded and floored at zero"""
+        return max(0, int(round(true_count + self.engine.rng.laplace(0.0, 1.0 / epsilon))))
+
+    def noisy_sum(self, clipped_sum, sensitivity, epsilon):
+        """Sum of clipped values + Laplace(sensitivity/epsilon)"""
+        return float(clipped_sum + self.engine.rng.laplace(0.0, sensitivity / epsilon))
+
+    def noisy_mean(self, clipped_sum, count, sensor_type, epsilon):
+        """Noisy sum / noisy count with epsilon split evenly, clamped to the sensor's bounds"""
+        bounds = SENSOR_BOUNDS.get(sensor_type, DEFAULT_BOUNDS)
+        noisy_total = self.noisy_sum(clipped_sum, sum_sensitivity(sensor_type), epsilon / 2)
+        noisy_count = self.noisy_count(count, epsilon / 2)
+        if noisy_count == 0:
+            return None, 0
+        return min(max(noisy_total / noisy_count, bounds['min']), bounds['max']), noisy_count
+
+    def noisy_histogram(self, counts, domain, epsilon):
+        """
+        Laplace(1/epsilon) on every bin of a fixed, public domain. Each record
+        is in one bin, so the whole histogram costs epsilon once; bins missing
+        from `counts` are noised too so their absence doesn't leak.
+        """
+        true = np.array([counts.get(label, 0) for label in domain], dtype=np.float64)
+        noisy = np.rint(true + self.engine.rng.laplace(0.0, 1.0 / epsilon, len(domain)))
+        return {label: max(0, int(n)) for label, n in zip(domain, noisy.tolist())}
+
+    # ---- windowed release cache ------------------------------------------
+
+    def window_end(self, now=None):
+        """End of the current release window (queries cover data up to here)"""
+        if now is None:
+            now = time.time()
+        return datetime.fromtimestamp(now - now % self.window, tz=timezone.utc)
+
+    def release(self, consumer, query, streams, compute, epsilon=None):
+        """
+        Serve a noisy release for this window, computing and charging it once
+
+        Args:
+            consumer: Who is asking (budget is per consumer)
+            query: Hashable description of the query (same query -> same release)
+            streams: [(device_id, sensor_type)] budget streams the release reads
+            compute: Called as compute(window_end) -> release dict
+            epsilon: Total epsilon charged to each stream (default: DP_AGGREGATE_EPSILON)
+
+        Returns:
+            Release dict with `window_end` and `cached` / `stale` flags
+
+        Raises:
+            BudgetExhausted
+        """
+        epsilon = epsilon or self.epsilon
+        key = (consumer, query)
+        window_end = self.window_end()
+
+        cached = self._releases.get(key)
+        if cached is not None and cached[0] == window_end:
+            metrics.increment('dp_release', outcome='cached')
+            return dict(cached[1], cached=True)
+
+        with self._locks[hash(key) % _LOCK_STRIPES]:
+            # Another request may have made this window's release meanwhile
+            cached = self._releases.get(key)
+            if cached is not None and cached[0] == window_end:
+                metrics.increment('dp_release', outcome='cached')
+                return dict(cached[1], cached=True)
+
+            keys = [(device_id, sensor_type, consumer) for device_id, sensor_type in streams]
+            exhausted = self.accountant.charge(keys, laplace_rho(epsilon), epsilon)
+            if exhausted:
+                if cached is not None:
+                    # Re-serving an old release is free; it just stops updating
+                    metrics.increment('dp_release', outcome='stale')
+                    return dict(cached[1], cached=True, stale=True)
+                metrics.increment('dp_release', outcome='refused')
+                raise BudgetExhausted(exhausted)
+
+            with metrics.timer('dp_release_ms'):
+                release = compute(window_end)
+            release = dict(release, window_end=window_end.isoformat(), epsilon=epsilon)
+            self._releases.put(key, (window_end, release))
+            metrics.increment('dp_release', outcome='fresh')
+            return dict(release, cached=False)
+
+    # ---- queries ---------------------------------------------------------
+
+    def stats_summary(self, hours, consumer):
+        """
+        Noisy version of the dashboard summary: readings, anomalies and mean
+        value per sensor type and alerts per severity over the last `hours`
+        (up to the window boundary). Sensor types are disjoint, so each type's
+        stream is charged epsilon once for its count, sum and anomaly count.
+        """
+        from dashboard.models import Alert, SensorData
+
+        sensor_types = [t for t, _ in SensorData.SENSOR_TYPES]
+        streams = [(ALL_DEVICES, t) for t in sensor_types] + [(ALL_DEVICES, ALERTS_STREAM)]
+
+        def compute(window_end):
+            from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+            from django.db.models.functions import Greatest, Least
+
+            start = window_end - timedelta(hours=hours)
+            readings = SensorData.objects.filter(timestamp__gte=start, timestamp__lt=window_end)
+            clipped = Case(
+                *[When(sensor_type=t, then=Greatest(Least(F('value'), Value(float(b['max']))), Value(float(b['min']))))
+                  for t, b in SENSOR_BOUNDS.items()],
+                default=Greatest(Least(F('value'), Value(float(DEFAULT_BOUNDS['max']))),
+                                 Value(float(DEFAULT_BOUNDS['min']))),
+                output_field=FloatField(),
+            )
+            exact = {row['sensor_type']: row for row in readings.values('sensor_type').annotate(
+                count=Count('id'), clipped_sum=Sum(clipped), anomalies=Count('id', filter=Q(is_anomaly=True)))}
+
+            part = self.epsilon / 3
+            sensor_stats = []
+            total_readings = total_anomalies = 0
+            for sensor_type in sensor_types:
+                row = exact.get(sensor_type, {'count': 0, 'clipped_sum': 0.0, 'anomalies': 0})
+                count = self.noisy_count(row['count'], part)
+                avg_value, _ = self.noisy_mean(row['clipped_sum'] or 0.0, row['count'], sensor_type, part)
+                anomalies = min(self.noisy_count(row['anomalies'], part), count)
+                total_readings += count
+                total_anomalies += anomalies
+                # Dropping near-empty types is post-processing of noisy counts
+                if count:
+                    sensor_stats.append({'sensor_type': sensor_type, 'count': count, 'anomalies': anomalies,
+                                         'avg_value': round(avg_value, 2) if avg_value is not None else None})
+
+            severities = [s for s, _ in Alert.SEVERITY_LEVELS]
+            alert_counts = dict(Alert.objects.filter(created_at__gte=start, created_at__lt=window_end)
+                                .values_list('severity').annotate(count=Count('id')))
+            alerts = self.noisy_histogram(alert_counts, severities, self.epsilon)
+
+            return {
+                'total_readings': total_readings,
+                'total_anomalies': total_anomalies,
+                'anomaly_rate': (total_anomalies / total_readings * 100) if total_readings > 0 else 0,
+                'alerts_by_severity': [{'severity': s, 'count': n} for s, n in alerts.items() if n],
+                'sensor_stats': sensor_stats,
+            }
+
+        return self.release(consumer, ('stats_summary', hours), streams, compute)
+
+
+# Global aggregate engine (shares the noise generator and budget accountant)
+dp_aggregates = DPAggregateEngine()
@@ -0,0 +1,218 @@
+"""
+Explanation Reuse Index for IoTShield
+Nearest-neighbour lookup over past alerts so a reading that looks like one
+the LLM already explained reuses that explanation (with the new value,
+device and location filled in) instead of another Ollama call
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .baselines import parse_timestamp
+from .field_encryption import field_encryptor
+from .sensor_rules import SENSOR_RULES
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+# Weight of the hour-of-day features relative to the normalized value
+_HOUR_WEIGHT = 0.1
+# Locations are one-hot over this many hashed buckets. Two different locations are
+# _LOCATION_WEIGHT * sqrt(2) = 0.03 apart: the same location wins a near tie, and
+# another location's explanation is only reused for a very close value
+_LOCATION_BUCKETS = 16
+_LOCATION_WEIGHT = 0.03 / math.sqrt(2)
+FEATURE_DIMS = 3 + _LOCATION_BUCKETS
+
+
+def _location_bucket(location):
+    # hash() is salted per process - this has to be stable across restarts
+    return int.from_bytes(hashlib.blake2b(location.strip().lower().encode(), digest_size=2).digest(),
+                          'big') % _LOCATION_BUCKETS
+
+
+def feature_vector(sensor_type, value, when, location=None):
+    """
+    [value normalized to the sensor's normal band, hour-of-day (sin, cos), location one-hot]
+
+    A distance of 0.05 is 5% of the normal band's width at the same time of day
+    and location. An unknown location is all zeros.
+    """
+    low, high = SENSOR_RULES.get(sensor_type, {}).get('normal', (0.0, 1.0))
+    angle = 2 * math.pi * (when.hour + when.minute / 60) / 24
+    features = np.zeros(FEATURE_DIMS)
+    features[0] = (float(value) - low) / max(high - low, 1e-9)
+    features[1] = _HOUR_WEIGHT * math.sin(angle)
+    features[2] = _HOUR_WEIGHT * math.cos(angle)
+    if location:
+        features[3 + _location_bucket(location)] = _LOCATION_WEIGHT
+    return features
+
+
+def _features(sensor_data):
+    return feature_vector(sensor_data.get('sensor_type', ''), sensor_data.get('value', 0),
+                          parse_timestamp(sensor_data.get('timestamp')), sensor_data.get('location'))
+
+
+def _value_pattern(value):
+    """Regex matching the ways an LLM tends to write a reading (0.8, 0.80, 0.800)"""
+    value = float(value)
+    forms = {repr(value), f"{value:g}", f"{value:.1f}", f"{value:.2f}", f"{value:.3f}"}
+    alternatives = '|'.join(re.escape(f) for f in sorted(forms, key=len, reverse=True))
+    # Don't match inside a longer number (0.8 in 0.85)
+    return re.compile(rf"(?<![\d.])(?:{alternatives})(?![\d])")
+
+
+def make_template(text, sensor_data):
+    """Turn an explanation into a template with {value}, {device_name} and {location} slots"""
+    if not text:
+        return ''
+    template = text.replace('{', '{{').replace('}', '}}')
+    for field in ('device_name', 'location'):
+        name = sensor_data.get(field)
+        if name:
+            template = template.replace(name, '{' + field + '}')
+    return _value_pattern(sensor_data.get('value', 0)).sub('{value}', template)
+
+
+def fill_template(template, sensor_data):
+    return template.format(
+        value=sensor_data.get('value', ''),
+        device_name=sensor_data.get('device_name') or 'the device',
+        location=sensor_data.get('location') or 'its location',
+    )
+
+
+class _Partition:
+    """Feature matrix and templates for one (sensor_type, severity)"""
+    __slots__ = ('features', 'templates', 'size', 'next')
+
+    def __init__(self, capacity, dims=FEATURE_DIMS):
+        self.features = np.full((capacity, dims), np.inf)
+        self.templates = [None] * capacity
+        self.size = 0
+        self.next = 0  # ring buffer - the oldest entry is overwritten first
+
+
+class ExplanationIndex:
+    """
+    In-memory similarity index over explained alerts, partitioned by
+    (sensor_type, severity). Each partition is a fixed-size NumPy matrix,
+    so a lookup is one vectorized distance computation.
+    """
+
+    def __init__(self, max_distance=None, capacity=None):
+        self.max_distance = max_distance if max_distance is not None else getattr(
+            settings, 'LLM_REUSE_MAX_DISTANCE', 0.05
+        )
+        self.capacity = capacity or getattr(settings, 'LLM_REUSE_INDEX_SIZE', 500)
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, sensor_data, severity):
+        """
+        Find a reusable explanation
+
+        Returns:
+            Result dict (explanation, suggestion, severity, anomaly, reused_from)
+            or None if nothing close enough has been explained yet
+        """
+        started = time.perf_counter()
+        sensor_type = sensor_data.get('sensor_type', '')
+        query = _features(sensor_data)
+
+        partition = self._partition(sensor_type, severity)
+        with self._lock:
+            match = None
+            if partition.size:
+                distances = np.linalg.norm(partition.features[:partition.size] - query, axis=1)
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    match = partition.templates[best]
+
+        metrics.observe('explanation_index_lookup_ms', (time.perf_counter() - started) * 1000)
+        metrics.increment('explanation_reuse', outcome='hit' if match else 'miss')
+        if match is None:
+            return None
+
+        explanation, suggestion, alert_id = match
+        return {
+            'anomaly': True,
+            'explanation': fill_template(explanation, sensor_data),
+            'suggestion': fill_template(suggestion, sensor_data),
+            'severity': severity,
+            'reused_from': alert_id,
+        }
+
+    def add(self, sensor_data, severity, result, alert_id=None):
+        """Index a freshly generated explanation (never a reused one or a failure)"""
+        partition = self._partition(sensor_data.get('sensor_type', ''), severity)
+        self._insert(partition, sensor_data, result.get('explanation', ''), result.get('suggestion', ''), alert_id)
+
+    def warm(self, sensor_types, severities=('LOW', 'MEDIUM', 'HIGH', 'CRITICAL')):
+        """Load the partitions for these sensor types up front; returns the entries loaded"""
+        return sum(self._partition(sensor_type, severity).size
+                   for sensor_type in sensor_types for severity in severities)
+
+    def _insert(self, partition, sensor_data, explanation, suggestion, alert_id):
+        features = _features(sensor_data)
+        template = (make_template(explanation, sensor_data), make_template(suggestion, sensor_data), alert_id)
+        with self._lock:
+            slot = partition.next
+            partition.features[slot] = features
+            partition.templates[slot] = template
+            partition.next = (slot + 1) % self.capacity
+            partition.size = min(partition.size + 1, self.capacity)
+
+    def _partition(self, sensor_type, severity):
+        key = (sensor_type, severity)
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = _Partition(self.capacity)
+            self._load(partition, sensor_type, severity)
+            with self._lock:
+                # Another thread may have loaded it meanwhile - keep the first
+                partition = self._partitions.setdefault(key, partition)
+        return partition
+
+    def _load(self, partition, sensor_type, severity):
+        """Seed a partition with the most recent alerts the LLM itself explained"""
+        from dashboard.models import Alert
+
+        try:
+            rows = (
+                Alert.objects
+                # Reused explanations are copies - seeding them would count one original many times
+                .filter(explanation_status='READY', explanation_reused_from__isnull=True,
+                        severity=severity, sensor_data__sensor_type=sensor_type)
+                .order_by('-explained_at')
+                .values_list('id', 'description', 'ai_suggestion', 'sensor_data__value',
+                             'sensor_data__timestamp', 'sensor_data__device__name', 'sensor_data__device__location')
+            )[:self.capacity]
+            # Oldest first so the newest end up last in the ring buffer
+            for alert_id, description, suggestion, value, timestamp, name, location in reversed(list(rows)):
+                sensor_data = {'sensor_type': sensor_type, 'value': value, 'timestamp': timestamp,
+                               'device_name': name, 'location': field_encryptor.reveal(location)}
+                self._insert(partition, sensor_data, description, suggestion, alert_id)
+        except Exception as e:
+            logger.error(f"Failed to load explanation index for {sensor_type}/{severity}: {e}")
+
+    def get_stats(self):
+        """Reuse rate and lookup latency"""
+        snapshot = metrics.snapshot()
+        hits = snapshot['counters'].get('explanation_reuse{outcome=hit}', 0)
+        misses = snapshot['counters'].get('explanation_reuse{outcome=miss}', 0)
+        return {
+            'partitions': len(self._partitions),
+            'entries': sum(p.size for p in self._partitions.values()),
+            'hits': hits,
+            'misses': misses,
+            'reuse_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            'lookup_ms': snapshot['timings'].get('explanation_index_lookup_ms'),
+        }
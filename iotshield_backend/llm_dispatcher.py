@@ -0,0 +1,200 @@
+"""
+Priority Dispatch for LLM Jobs in IoTShield
+Pending Ollama jobs are served by preliminary severity (CRITICAL first) and
+then by reading age, so a backlog of low-priority work never delays a
+critical alert. Stale low-priority jobs expire and fall back to the rule result.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .sensor_rules import severity_rank
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class _Job:
+    __slots__ = ('severity', 'reading_time', 'enqueued_at', 'fn', 'fallback', 'future')
+
+    def __init__(self, severity, reading_time, fn, fallback):
+        self.severity = severity
+        self.reading_time = reading_time
+        self.enqueued_at = time.time()
+        self.fn = fn
+        self.fallback = fallback
+        self.future = Future()
+
+
+class LLMDispatcher:
+    """
+    Priority queue with a fixed pool of worker threads in front of Ollama.
+
+    Jobs are ordered by (severity rank descending, reading time ascending).
+    A job whose reading is older than the max age for its severity is not
+    sent to the LLM; its fallback() result is returned instead.
+
+    `capacity` is an optional callable returning how many jobs may run at
+    once right now (the Ollama pool's adaptive limit). Workers only take a
+    job off the heap when there is capacity, so jobs wait in priority order
+    rather than blocked inside the HTTP client.
+
+    hold()/release() pause job execution (e.g. while the model is loading);
+    jobs submitted meanwhile wait in the queue in priority order.
+    """
+
+    def __init__(self, workers=None, max_age=None, max_queue=None, capacity=None):
+        self.workers = workers or getattr(settings, 'LLM_DISPATCH_WORKERS', 8)
+        self.max_age = max_age or getattr(settings, 'LLM_QUEUE_MAX_AGE', {
+            'LOW': 60, 'MEDIUM': 180, 'HIGH': 600, 'CRITICAL': None,
+        })
+        self.max_queue = max_queue or getattr(settings, 'LLM_QUEUE_MAX_SIZE', 1000)
+
+        self.capacity = capacity
+        self._active = 0
+        self._held = False
+
+        self._heap = []
+        self._counter = itertools.count()  # tie-breaker so jobs are never compared
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, fn, severity='LOW', reading_time=None, fallback=None):
+        """
+        Queue an LLM job
+
+        Args:
+            fn: Callable doing the LLM work; its return value resolves the future
+            severity: Preliminary severity from the fast detectors
+            reading_time: UNIX time of the reading (defaults to now)
+            fallback: Optional callable used instead of fn if the job expires
+
+        Returns:
+            concurrent.futures.Future
+        """
+        job = _Job(severity, reading_time or time.time(), fn, fallback)
+        key = (-severity_rank(severity), job.reading_time, next(self._counter))
+
+        dropped = None
+        with self._cond:
+            self._ensure_workers()
+            heapq.heappush(self._heap, (key, job))
+            if len(self._heap) > self.max_queue:
+                # Shed the lowest-priority, newest job
+                dropped = max(self._heap)
+                self._heap.remove(dropped)
+                heapq.heapify(self._heap)
+            self._update_depth()
+            self._cond.notify()
+
+        if dropped is not None:
+            self._expire(dropped[1], reason='shed')
+        return job.future
+
+    def hold(self):
+        """Stop starting new jobs until release() (running jobs finish)"""
+        with self._cond:
+            self._held = True
+        metrics.set_gauge('llm_dispatch_held', 1)
+
+    def release(self):
+        """Resume starting jobs"""
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+        metrics.set_gauge('llm_dispatch_held', 0)
+
+    def _ensure_workers(self):
+        """Start the worker threads on first use (caller holds the lock)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'llm-dispatch-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._held or not self._has_capacity():
+                    # The capacity can grow without a notify - re-check periodically
+                    self._cond.wait(timeout=0.5 if self._heap else None)
+                _, job = heapq.heappop(self._heap)
+                self._active += 1
+                self._update_depth()
+
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify()
+
+    def _has_capacity(self):
+        """Caller holds the lock"""
+        if self.capacity is None:
+            return True
+        try:
+            return self._active < max(1, self.capacity())
+        except Exception:
+            return True
+
+    def _run(self, job):
+        max_age = self.max_age.get(job.severity)
+        if max_age is not None and time.time() - job.reading_time > max_age:
+            self._expire(job, reason='stale')
+            return
+
+        wait_ms = (time.time() - job.enqueued_at) * 1000
+        metrics.observe('llm_queue_wait_ms', wait_ms, priority=job.severity)
+
+        try:
+            job.future.set_result(job.fn())
+            metrics.increment('llm_jobs', priority=job.severity, outcome='done')
+        except Exception as e:
+            logger.error(f"LLM job ({job.severity}) failed: {e}")
+            job.future.set_exception(e)
+            metrics.increment('llm_jobs', priority=job.severity, outcome='failed')
+
+    def _expire(self, job, reason):
+        """Resolve a job without calling the LLM"""
+        metrics.increment('llm_jobs', priority=job.severity, outcome=reason)
+        logger.debug(f"LLM job ({job.severity}) {reason} - using fallback")
+        try:
+            job.future.set_result(job.fallback() if job.fallback else None)
+        except Exception as e:
+            job.future.set_exception(e)
+
+    def _update_depth(self):
+        """Export queue depth per priority (caller holds the lock)"""
+        depth = {'LOW': 0, 'MEDIUM': 0, 'HIGH': 0, 'CRITICAL': 0}
+        for _, job in self._heap:
+            depth[job.severity] = depth.get(job.severity, 0) + 1
+        for severity, count in depth.items():
+            metrics.set_gauge('llm_queue_depth', count, priority=severity)
+
+    def get_stats(self):
+        """Queue depth plus wait-time percentiles per priority"""
+        snapshot = metrics.snapshot()
+        stats = {}
+        for severity in ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW'):
+            stats[severity] = {
+                'depth': snapshot['gauges'].get(f"llm_queue_depth{{priority={severity}}}", 0),
+                'wait_ms': snapshot['timings'].get(f"llm_queue_wait_ms{{priority={severity}}}"),
+            }
+        return stats
+
+
+def _ollama_capacity():
+    from .ollama_pool import get_endpoint_pool
+    return get_endpoint_pool().capacity()
+
+
+# Global dispatcher shared by everything that talks to Ollama; it runs as
+# many jobs at once as the Ollama pool's adaptive limits currently allow
+llm_dispatcher = LLMDispatcher(capacity=_ollama_capacity)
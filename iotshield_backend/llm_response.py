@@ -0,0 +1,123 @@
+"""
+LLM Response Parsing for IoTShield
+JSON schema for Ollama's structured output mode, a strict single-pass parser
+for the analysis response, and a cheap repair step that is only tried when
+the strict parse fails
+"""
+import json
+import re
+
+SEVERITIES = ('LOW', 'MEDIUM', 'HIGH', 'CRITICAL')
+
+# Field name -> exact Python type (bool is checked exactly, so 1/0 are rejected)
+RESPONSE_FIELDS = (
+    ('anomaly', bool),
+    ('explanation', str),
+    ('severity', str),
+    ('suggestion', str),
+)
+
+# Sent as Ollama's `format` so the server constrains generation to this shape
+RESPONSE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'anomaly': {'type': 'boolean'},
+        'explanation': {'type': 'string'},
+        'severity': {'type': 'string', 'enum': list(SEVERITIES)},
+        'suggestion': {'type': 'string'},
+    },
+    'required': [field for field, _ in RESPONSE_FIELDS],
+}
+
+# Words small models use instead of the severity enum
+_SEVERITY_ALIASES = {
+    'NONE': 'LOW', 'INFO': 'LOW', 'MINOR': 'LOW',
+    'MODERATE': 'MEDIUM', 'WARNING': 'MEDIUM',
+    'SEVERE': 'HIGH', 'MAJOR': 'HIGH',
+    'EMERGENCY': 'CRITICAL',
+}
+_TEXT_DEFAULTS = {'explanation': 'Analysis incomplete', 'suggestion': 'Review sensor data manually'}
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+_decoder = json.JSONDecoder()
+
+
+class ResponseParseError(ValueError):
+    """The response doesn't match RESPONSE_SCHEMA; `reason` is a short metric label"""
+
+    def __init__(self, reason, detail=''):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def parse_response(text):
+    """
+    Strict parse: decode the first JSON object in the text and check every
+    field's type and the severity enum in one pass. Anything after the
+    object (chatter, closing fences) is ignored without being scanned.
+
+    Raises:
+        ResponseParseError
+    """
+    start = text.find('{')
+    if start < 0:
+        raise ResponseParseError('no_json')
+    try:
+        obj, _ = _decoder.raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise ResponseParseError('invalid_json', str(e))
+    return validate_response(obj)
+
+
+def validate_response(obj):
+    """Check types and enums; returns a dict with exactly the schema fields"""
+    if not isinstance(obj, dict):
+        raise ResponseParseError('bad_type', 'not an object')
+    result = {}
+    for field, kind in RESPONSE_FIELDS:
+        if field not in obj:
+            raise ResponseParseError('missing_field', field)
+        value = obj[field]
+        if type(value) is not kind:
+            raise ResponseParseError('bad_type', field)
+        result[field] = value
+    if result['severity'] not in SEVERITIES:
+        raise ResponseParseError('bad_enum', result['severity'])
+    return result
+
+
+def repair_response(text):
+    """
+    Fix the usual small-model mistakes and validate again:
+    trailing commas, "true"/"yes" strings, lower-case or synonym severities
+    and missing text fields. Missing anomaly/severity can't be guessed.
+
+    Raises:
+        ResponseParseError
+    """
+    start = text.find('{')
+    if start < 0:
+        raise ResponseParseError('no_json')
+    try:
+        obj, _ = _decoder.raw_decode(_TRAILING_COMMA.sub(r'\1', text[start:]))
+    except json.JSONDecodeError as e:
+        raise ResponseParseError('invalid_json', str(e))
+    if not isinstance(obj, dict):
+        raise ResponseParseError('bad_type', 'not an object')
+
+    anomaly = obj.get('anomaly')
+    if isinstance(anomaly, str):
+        obj['anomaly'] = anomaly.strip().lower() in ('true', '1', 'yes')
+    elif isinstance(anomaly, (int, float)) and not isinstance(anomaly, bool):
+        obj['anomaly'] = bool(anomaly)
+
+    severity = obj.get('severity')
+    if isinstance(severity, str):
+        severity = severity.strip().upper()
+        obj['severity'] = _SEVERITY_ALIASES.get(severity, severity)
+
+    for field, default in _TEXT_DEFAULTS.items():
+        if not isinstance(obj.get(field), str) or not obj[field].strip():
+            obj[field] = default
+
+    return validate_response(obj)
@@ -0,0 +1,120 @@
+"""
+LLM Call Telemetry for IoTShield
+Collects per-call cost data from Ollama responses (token counts, load/eval
+durations) and writes it to LLMCallRecord in batches, off the request path
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db_writer import db_writer
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+_NS_PER_MS = 1_000_000
+
+
+def ollama_usage(response_json):
+    """
+    Pull the cost fields out of an Ollama /api/generate response
+
+    Ollama reports durations in nanoseconds; they are converted to ms here.
+    """
+    def ms(field):
+        value = response_json.get(field)
+        return value / _NS_PER_MS if value is not None else None
+
+    return {
+        'prompt_tokens': response_json.get('prompt_eval_count'),
+        'generated_tokens': response_json.get('eval_count'),
+        'total_ms': ms('total_duration'),
+        'load_ms': ms('load_duration'),
+        'prompt_eval_ms': ms('prompt_eval_duration'),
+        'eval_ms': ms('eval_duration'),
+    }
+
+
+class LLMTelemetryWriter:
+    """
+    Buffers call records in memory and bulk-inserts them every
+    `batch_size` records or `flush_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, enabled=None):
+        self.batch_size = batch_size or getattr(settings, 'LLM_TELEMETRY_BATCH_SIZE', 50)
+        self.flush_interval = flush_interval or getattr(settings, 'LLM_TELEMETRY_FLUSH_INTERVAL', 10)
+        self.enabled = enabled if enabled is not None else getattr(settings, 'LLM_TELEMETRY_ENABLED', True)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, model, purpose, latency_ms, status='OK', usage=None, **fields):
+        """
+        Queue one call record
+
+        Args:
+            model: Model name
+            purpose: 'analyze' or 'explain'
+            latency_ms: Wall-clock latency seen by the backend
+            status: 'OK', 'PARSE_ERROR' or 'ERROR'
+            usage: Dict from ollama_usage() (omit for failed calls)
+            **fields: Other LLMCallRecord fields (endpoint, sensor_type, provenance, prompt_version)
+        """
+        if not self.enabled:
+            return
+
+        entry = dict(usage or {}, model=model, purpose=purpose, latency_ms=latency_ms,
+                     status=status, created_at=timezone.now(), **fields)
+        metrics.increment('llm_calls', model=model, status=status)
+        if usage and usage.get('generated_tokens'):
+            metrics.increment('llm_generated_tokens', usage['generated_tokens'], model=model)
+
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        self._ensure_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far in one bulk insert"""
+        from dashboard.models import LLMCallRecord
+
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return 0
+
+        try:
+            with metrics.timer('llm_telemetry_flush_ms'):
+                records = [LLMCallRecord(**entry) for entry in entries]
+                db_writer.call(LLMCallRecord.objects.bulk_create, records)
+        except Exception as e:
+            # Telemetry must never take the pipeline down - drop the batch
+            logger.error(f"Failed to write {len(entries)} LLM call records: {e}")
+            metrics.increment('llm_telemetry_dropped', len(entries))
+            return 0
+        return len(entries)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='llm-telemetry', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+# Global telemetry writer
+llm_telemetry = LLMTelemetryWriter()
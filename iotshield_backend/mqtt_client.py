@@ -4,10 +4,17 @@ Handles MQTT broker connection, subscription, and message processing
 """
 import json
 import logging
+import threading
+import time
 import paho.mqtt.client as mqtt
 from django.conf import settings
 from datetime import datetime
 
+from .db_writer import db_writer
+from .field_encryption import field_encryptor
+from .rollups import rollup_writer
+from .utils.metrics import metrics
+
 logger = logging.getLogger('iotshield')
 
 
@@ -26,9 +33,144 @@ class IoTShieldMQTTClient:
         
         self.is_connected = False
         
-        # Initialize anomaly detector once (singleton pattern)
-        from .ollama_anomaly_detector import OllamaAnomalyDetector
-        self.anomaly_detector = OllamaAnomalyDetector()
+        # Initialize detectors once (singleton pattern) - each sensor type is
+        # routed through its own chain of tiers (see ANOMALY_DETECTOR_ROUTES)
+        from .detectors import DetectorRegistry
+        self.detector_registry = DetectorRegistry()
+        self.anomaly_detector = self.detector_registry.get_detector('llm')
+        
+        # Groups sustained incidents into one alert per episode
+        from .anomaly_episodes import AnomalyEpisodeTracker
+        self.episode_tracker = AnomalyEpisodeTracker()
+        
+        # Catches slow drifts in the mean that never cross a severity band
+        from .change_points import ChangePointDetector
+        self.change_point_detector = ChangePointDetector()
+        
+        # device_id -> (Device, cached at) so readings skip the get_or_create query
+        self._devices = {}
+        self.device_cache_ttl = getattr(settings, 'DEVICE_CACHE_TTL', 300)
+        
+        # Set once warm_up_llm() has finished (LLM jobs are held until then)
+        self.ready = False
+        self._warmup_started = None
+        self.warmup_report = {}
+        
+        # Multi-process RSA decryption (None = decrypt on paho's thread)
+        from .decrypt_offload import DecryptOffload, decrypt_workers
+        self.decrypt_offload = DecryptOffload(self._route) if decrypt_workers() else None
+    
+    def warm_up_caches(self):
+        """
+        First warm-up phase, run before connecting: hold LLM jobs and fill the
+        device registry, detector chains, seasonal baselines and explanation index
+        
+        Returns:
+            {step: duration in ms}
+        """
+        from dashboard.models import Device
+        from .alert_explanations import explanation_service
+        from .llm_dispatcher import llm_dispatcher
+        
+        self._warmup_started = time.perf_counter()
+        self.ready = False
+        metrics.set_gauge('listener_ready', 0)
+        llm_dispatcher.hold()
+        
+        def load_devices():
+            now = time.time()
+            self._devices = {device.device_id: (device, now) for device in Device.objects.all()}
+        
+        def build_detectors():
+            sensor_types = [t for t in self.detector_registry.routes if t != 'default']
+            for sensor_type in sensor_types:
+                self.detector_registry.get_chain(sensor_type, include_expensive=False)
+            # Logged here rather than by the registry, which every web worker builds too
+            for sensor_type, tiers in self.detector_registry.routes.items():
+                logger.info(f"Detector route {sensor_type}: {' -> '.join(tiers)}")
+            if any('seasonal' in tiers for tiers in self.detector_registry.routes.values()):
+                self.detector_registry.get_detector('seasonal').store.load()
+        
+        def load_explanations():
+            # Alerts a previous listener was explaining when it stopped
+            explanation_service.reset_stale()
+            if explanation_service.index is not None:
+                llm_types = [t for t in self.detector_registry.routes
+                             if t != 'default' and self.detector_registry.uses_expensive_tier(t)]
+                explanation_service.index.warm(llm_types)
+        
+        steps = [('devices', load_devices), ('detectors', build_detectors),
+                 ('explanation_index', load_explanations)]
+        if self.decrypt_offload is not None:
+            steps.append(('decrypt_workers', self.decrypt_offload.start))
+        for step, fn in steps:
+            self._warmup_step(step, fn)
+        return dict(self.warmup_report)
+    
+    def warm_up_llm(self):
+        """
+        Second warm-up phase, run after connecting (readings are analysed by the
+        fast path meanwhile): load the model on every Ollama host, then release
+        the held LLM jobs and report ready
+        
+        Returns:
+            {step: duration in ms, 'total': ms, 'ollama': per-host results}
+        """
+        from .llm_dispatcher import llm_dispatcher
+        
+        if self._warmup_started is None:
+            self._warmup_started = time.perf_counter()
+        try:
+            if getattr(settings, 'LISTENER_WARMUP_LLM', True):
+                hosts = self._warmup_step('llm', self.anomaly_detector.warm_up)
+                self.warmup_report['ollama'] = hosts
+                if not any(host['ok'] for host in hosts.values()):
+                    logger.warning("Ollama warm-up failed on every host - LLM jobs will hit a cold model")
+        finally:
+            llm_dispatcher.release()
+        
+        total_ms = (time.perf_counter() - self._warmup_started) * 1000
+        self.warmup_report['total'] = round(total_ms, 1)
+        self.ready = True
+        metrics.set_gauge('listener_warmup_ms', round(total_ms, 1))
+        metrics.set_gauge('listener_ready', 1)
+        logger.info(f"Listener ready after {total_ms:.0f}ms warm-up")
+        return dict(self.warmup_report)
+    
+    def _warmup_step(self, step, fn):
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            # A cold cache only costs latency later - never block startup on it
+            logger.error(f"Warm-up step {step} failed: {e}")
+            result = None
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.warmup_report[step] = elapsed_ms
+        metrics.set_gauge('listener_warmup_step_ms', elapsed_ms, step=step)
+        return result
+    
+    def _get_device(self, data):
+        """Device for a reading, from the registry cache when possible"""
+        from dashboard.models import Device
+        
+        device_id = data.get('device_id')
+        entry = self._devices.get(device_id)
+        if entry is not None and time.time() - entry[1] < self.device_cache_ttl:
+            return entry[0]
+        
+        # Through the writer: the device is only cached once its row is committed
+        device, created = db_writer.call(
+            Device.objects.get_or_create,
+            device_id=device_id,
+            defaults={
+                'device_type': data.get('device_type', 'ESP32'),
+                'name': data.get('device_name', f"Device {device_id}"),
+                'location': data.get('location', ''),
+            }
+        )
+        self._devices[device_id] = (device, time.time())
+        return device
     
     def connect(self):
         """Connect to MQTT broker"""
@@ -48,6 +190,11 @@ class IoTShieldMQTTClient:
         """Disconnect from MQTT broker"""
         self.client.loop_stop()
         self.client.disconnect()
+        if self.decrypt_offload is not None:
+            self.decrypt_offload.shutdown()
+        rollup_writer.flush()
+        # Commit whatever the analysis threads have queued
+        db_writer.stop()
         logger.info("Disconnected from MQTT broker")
     
     def on_connect(self, client, userdata, flags, reason_code, properties):
@@ -87,42 +234,46 @@ class IoTShieldMQTTClient:
             # Convert JSON string to Python dict
             data = json.loads(payload)
             
+            # RSA decryption is CPU bound - with decryption workers configured it
+            # runs in other processes and _route is called from the delivery
+            # thread, still in arrival order
+            if self.decrypt_offload is not None:
+                self.decrypt_offload.submit(topic, data)
+                return
+            
             # Here's the security layer - decrypt if message is encrypted
             # This protects us even if the MQTT broker is compromised
             from .privacy_engine import rsa_encryption
             if rsa_encryption:
                 data = rsa_encryption.decrypt_mqtt_payload(data)
             
-            # Now route the decrypted message to the right handler
-            if topic == settings.MQTT_TOPIC_SENSORS:
-                self.handle_sensor_data(data)       # Handle sensor readings
-            elif topic == settings.MQTT_TOPIC_CONTROL:
-                self.handle_control_command(data)   # Handle control commands
+            self._route(topic, data)
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON message: {e}")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
+    def _route(self, topic, data):
+        """Route a decrypted message to the right handler"""
+        if topic == settings.MQTT_TOPIC_SENSORS:
+            # Hybrid-encrypted messages may carry a batch of readings
+            for reading in (data if isinstance(data, list) else [data]):
+                self.handle_sensor_data(reading)       # Handle sensor readings
+        elif topic == settings.MQTT_TOPIC_CONTROL:
+            self.handle_control_command(data)   # Handle control commands
+    
     def handle_sensor_data(self, data):
         """Process incoming sensor data"""
-        from dashboard.models import Device, SensorData, Alert
-        import threading
+        from dashboard.models import SensorData, Alert
         
         try:
             # Get or create device
-            device, created = Device.objects.get_or_create(
-                device_id=data.get('device_id'),
-                defaults={
-                    'device_type': data.get('device_type', 'ESP32'),
-                    'name': data.get('device_name', f"Device {data.get('device_id')}"),
-                    'location': data.get('location', ''),
-                }
-            )
+            device = self._get_device(data)
             
             # Store sensor data
             sensor_timestamp = datetime.fromisoformat(data.get('timestamp', datetime.now().isoformat()))
-            sensor_data = SensorData.objects.create(
+            sensor_data = SensorData(
                 device=device,
                 sensor_type=data.get('sensor_type').upper(),
                 value=float(data.get('value')),
@@ -132,73 +283,87 @@ class IoTShieldMQTTClient:
             
             # Update device's last_seen timestamp to the sensor reading time
             device.last_seen = sensor_timestamp
-            device.save(update_fields=['last_seen'])
             
-            # Analyze with Ollama API in background thread to avoid blocking
+            def store():
+                sensor_data.save(force_insert=True)
+                device.save(update_fields=['last_seen'])
+            
+            # Reading and last_seen in one savepoint, committed with whatever else is queued
+            db_writer.call(store)
+            
+            # Analyze in background thread to avoid blocking the MQTT loop
             def analyze_and_alert():
+                reservation = None
                 try:
-                    # Use the singleton detector instance
+                    # O(1) drift check on every reading, independent of the band checks
+                    self._check_trend(sensor_data)
+                    
+                    # Check for an ongoing incident first - repeats of an open
+                    # episode are counted on the existing alert without an LLM call
+                    decision, episode = self.episode_tracker.check(
+                        device.device_id, sensor_data.sensor_type, sensor_data.value
+                    )
+                    if decision == self.episode_tracker.ANALYZE:
+                        # Held until open_episode() below - concurrent readings of this
+                        # stream wait for the alert instead of creating their own
+                        reservation = episode
+                    
+                    if decision == self.episode_tracker.REPEAT:
+                        self._record_repeat(sensor_data, episode)
+                        return
+                    
                     sensor_dict = {
+                        'device_id': device.device_id,
                         'sensor_type': sensor_data.sensor_type,
                         'value': sensor_data.value,
                         'unit': sensor_data.unit,
                         'device_name': device.name,
-                        'location': device.location,
+                        'location': field_encryptor.reveal(device.location),
                         'timestamp': sensor_data.timestamp.isoformat(),
                     }
                     
-                    # Call Ollama API for anomaly analysis using singleton detector
-                    analysis_result = self.anomaly_detector.analyze(sensor_dict)
+                    # Run the cheap detector tiers only - the alert is raised right away
+                    # and the LLM explanation is filled in later (see alert_explanations)
+                    analysis_result = self.detector_registry.analyze_fast(sensor_dict)
+                    needs_llm = self.detector_registry.uses_expensive_tier(sensor_data.sensor_type)
                     
                     # Update sensor data with analysis results
                     sensor_data.is_anomaly = analysis_result.get('anomaly', False)
                     sensor_data.anomaly_score = 1.0 if analysis_result.get('anomaly') else 0.0
-                    sensor_data.save()
+                    db_writer.call(sensor_data.save)
                     
-                    # Create alert if anomalous
-                    if analysis_result.get('anomaly', False):
-                        alert = Alert.objects.create(
+                    if decision == self.episode_tracker.ESCALATE:
+                        self._escalate_alert(sensor_data, episode, analysis_result, needs_llm)
+                    elif analysis_result.get('anomaly', False):
+                        # Create alert if anomalous
+                        alert = db_writer.call(
+                            Alert.objects.create,
                             sensor_data=sensor_data,
                             title=f"{sensor_data.sensor_type} Anomaly Detected",
                             description=analysis_result.get('explanation', 'Anomalous sensor reading detected'),
                             ai_suggestion=analysis_result.get('suggestion', ''),
-                            severity=analysis_result.get('severity', 'MEDIUM')
+                            severity=analysis_result.get('severity', 'MEDIUM'),
+                            last_occurrence_at=sensor_data.timestamp,
+                            explanation_status='PENDING' if needs_llm else 'NONE'
                         )
                         
-                        # Publish alert to MQTT
-                        self.publish_alert(alert)
-                        
-                        logger.info(f"Anomaly detected by Ollama: {alert.title}")
-                        
-                        # Send email notification for CRITICAL/HIGH alerts
-                        from iotshield_backend.utils.email_alerts import send_alert_email
-                        
-                        # Prepare email data
-                        email_data = {
-                            'device_name': device.name,
-                            'severity': alert.severity,
-                            'sensor_type': sensor_data.sensor_type,
-                            'sensor_value': f"{sensor_data.value} {sensor_data.unit}",
-                            'description': alert.description,
-                            'timestamp': alert.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                            'additional_data': {
-                                'Device ID': device.device_id,
-                                'Device Type': device.device_type,
-                                'Location': device.location or 'Not specified',
-                                'Sensor Type': sensor_data.sensor_type,
-                                'Reading': f"{sensor_data.value} {sensor_data.unit}",
-                                'AI Suggestion': alert.ai_suggestion or 'No suggestion available'
-                            }
-                        }
+                        self.episode_tracker.open_episode(
+                            device.device_id, sensor_data.sensor_type, alert.id, alert.severity
+                        )
                         
-                        # Send email asynchronously
-                        email_thread = threading.Thread(target=send_alert_email, args=(email_data,), daemon=True)
-                        email_thread.start()
+                        logger.info(f"Anomaly detected by {analysis_result.get('detector', 'detector')}: {alert.title}")
+                        self._notify_alert(alert)
                     else:
+                        self.episode_tracker.close_episode(device.device_id, sensor_data.sensor_type)
                         logger.debug(f"Normal reading: {sensor_data.sensor_type}={sensor_data.value}")
                 
                 except Exception as e:
                     logger.error(f"Error in anomaly analysis: {e}")
+                finally:
+                    if reservation is not None:
+                        self.episode_tracker.release(device.device_id, sensor_data.sensor_type, reservation)
+                    # is_anomaly is final now - fold the reading into the 1m/1h/1d rollups
+                    rollup_writer.record(sensor_data)
             
             # Run analysis in background thread
             analysis_thread = threading.Thread(target=analyze_and_alert, daemon=True)
@@ -207,6 +372,171 @@ class IoTShieldMQTTClient:
         except Exception as e:
             logger.error(f"Error handling sensor data: {e}")
     
+    def _check_trend(self, sensor_data):
+        """Feed the change-point detector and raise (or extend) a trend alert"""
+        from dashboard.models import Alert
+        from django.db.models import F
+        from .sensor_rules import classify_severity
+        
+        device = sensor_data.device
+        change = self.change_point_detector.update(
+            device.device_id, sensor_data.sensor_type, sensor_data.value,
+            now=sensor_data.timestamp.timestamp()
+        )
+        if change is None:
+            return
+        
+        direction = 'risen' if change['direction'] == 'UP' else 'fallen'
+        description = (
+            f"{sensor_data.sensor_type} has {direction} from a typical {change['baseline_mean']:.2f} "
+            f"to about {change['new_mean']:.2f} {sensor_data.unit} - a gradual shift in its average level."
+        )
+        
+        if change['alert_id']:
+            # The same drift is still going - update its alert instead of raising another
+            db_writer.call(
+                Alert.objects.filter(id=change['alert_id']).update,
+                description=description,
+                occurrence_count=F('occurrence_count') + 1,
+                last_occurrence_at=sensor_data.timestamp
+            )
+            return
+        
+        alert = db_writer.call(
+            Alert.objects.create,
+            sensor_data=sensor_data,
+            title=f"{sensor_data.sensor_type} Trend Change Detected",
+            description=description,
+            ai_suggestion='Check the device for a gradual fault (filling disk, memory leak, sensor degradation) before it reaches an alert threshold.',
+            severity=classify_severity(sensor_data.sensor_type, change['new_mean']) or 'LOW',
+            last_occurrence_at=sensor_data.timestamp,
+            explanation_status='NONE'
+        )
+        self.change_point_detector.attach_alert(
+            device.device_id, sensor_data.sensor_type, alert.id, change['direction'],
+            now=sensor_data.timestamp.timestamp()
+        )
+        logger.info(f"Trend change detected: {alert.title} ({description})")
+        self._notify_alert(alert)
+    
+    def _record_repeat(self, sensor_data, episode):
+        """Count a reading that belongs to an already-alerted episode"""
+        from dashboard.models import Alert
+        from django.db.models import F
+        
+        sensor_data.is_anomaly = True
+        sensor_data.anomaly_score = 1.0
+        
+        def store():
+            sensor_data.save(update_fields=['is_anomaly', 'anomaly_score'])
+            # Single UPDATE - no new alert row, MQTT publish or email
+            Alert.objects.filter(id=episode.alert_id).update(
+                occurrence_count=F('occurrence_count') + 1,
+                last_occurrence_at=sensor_data.timestamp
+            )
+        
+        db_writer.call(store)
+        logger.debug(
+            f"Repeat reading in open episode: {sensor_data.sensor_type}={sensor_data.value} "
+            f"(alert {episode.alert_id})"
+        )
+    
+    def _escalate_alert(self, sensor_data, episode, analysis_result, needs_llm=False):
+        """Raise the episode's alert to a higher severity and notify again"""
+        from dashboard.models import Alert
+        from django.db.models import F
+        from .sensor_rules import classify_severity, severity_rank
+        
+        device = sensor_data.device
+        
+        # A later tier may under-call the reading - never go below the rule severity
+        severity = analysis_result.get('severity', 'MEDIUM')
+        rule_severity = classify_severity(sensor_data.sensor_type, sensor_data.value)
+        if severity_rank(rule_severity) > severity_rank(severity):
+            severity = rule_severity
+        
+        if severity_rank(severity) <= severity_rank(episode.severity):
+            self._record_repeat(sensor_data, episode)
+            return
+        
+        sensor_data.is_anomaly = True
+        sensor_data.anomaly_score = 1.0
+        
+        def store():
+            sensor_data.save(update_fields=['is_anomaly', 'anomaly_score'])
+            Alert.objects.filter(id=episode.alert_id).update(
+                sensor_data=sensor_data,
+                severity=severity,
+                description=analysis_result.get('explanation', 'Anomalous sensor reading detected'),
+                ai_suggestion=analysis_result.get('suggestion', ''),
+                occurrence_count=F('occurrence_count') + 1,
+                last_occurrence_at=sensor_data.timestamp,
+                # The old explanation described a lower severity - regenerate it
+                explanation_status='PENDING' if needs_llm else 'NONE',
+                explained_at=None
+            )
+        
+        db_writer.call(store)
+        self.episode_tracker.escalate(device.device_id, sensor_data.sensor_type, severity)
+        
+        alert = Alert.objects.select_related('sensor_data__device').get(id=episode.alert_id)
+        logger.info(f"Anomaly escalated to {severity}: {alert.title}")
+        self._notify_alert(alert)
+    
+    def _notify_alert(self, alert):
+        """Publish an alert to MQTT and send the email notification"""
+        from .alert_explanations import explanation_service
+        
+        # Publish alert to MQTT right away with whatever text we have
+        self.publish_alert(alert)
+        
+        # Severe alerts get their LLM explanation now; the email waits for it
+        # so it carries the AI analysis. Others are explained on demand.
+        if alert.explanation_status == 'PENDING' and explanation_service.is_eager(alert.severity):
+            explanation_service.request(
+                alert.id,
+                severity=alert.severity,
+                reading_time=alert.sensor_data.timestamp.timestamp(),
+                on_complete=self._on_explanation_complete
+            )
+        else:
+            self._send_alert_email(alert)
+    
+    def _on_explanation_complete(self, alert):
+        """Re-publish the alert with its explanation and send the email"""
+        if alert.explanation_status == 'READY':
+            self.publish_alert(alert)
+        self._send_alert_email(alert)
+    
+    def _send_alert_email(self, alert):
+        """Send email notification for CRITICAL/HIGH alerts"""
+        from iotshield_backend.utils.email_alerts import send_alert_email
+        
+        sensor_data = alert.sensor_data
+        device = sensor_data.device
+        
+        # Prepare email data
+        email_data = {
+            'device_name': device.name,
+            'severity': alert.severity,
+            'sensor_type': sensor_data.sensor_type,
+            'sensor_value': f"{sensor_data.value} {sensor_data.unit}",
+            'description': alert.description,
+            'timestamp': alert.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'additional_data': {
+                'Device ID': device.device_id,
+                'Device Type': device.device_type,
+                'Location': field_encryptor.reveal(device.location) or 'Not specified',
+                'Sensor Type': sensor_data.sensor_type,
+                'Reading': f"{sensor_data.value} {sensor_data.unit}",
+                'AI Suggestion': alert.ai_suggestion or 'No suggestion available'
+            }
+        }
+        
+        # Send email asynchronously
+        email_thread = threading.Thread(target=send_alert_email, args=(email_data,), daemon=True)
+        email_thread.start()
+    
     def handle_control_command(self, data):
         """Process control command acknowledgment"""
         from .models import ControlCommand
@@ -222,7 +552,7 @@ class IoTShieldMQTTClient:
                 command.response = response
                 if status.upper() == 'EXECUTED':
                     command.executed_at = datetime.now()
-                command.save()
+                db_writer.call(command.save)
                 
                 logger.info(f"Control command {command_id} status updated: {status}")
         
@@ -265,6 +595,8 @@ class IoTShieldMQTTClient:
             'device_id': alert.sensor_data.device.device_id,
             'sensor_type': alert.sensor_data.sensor_type,
             'value': alert.sensor_data.value,
+            'occurrence_count': alert.occurrence_count,
+            'explanation_status': alert.explanation_status,
             'timestamp': alert.created_at.isoformat()
         }
         
@@ -5,23 +5,51 @@ This replaces TinyLlama transformers for better performance and easier deploymen
 """
 import json
 import logging
+import threading
+import time
 import requests
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from django.conf import settings
 
+from .detectors import BaseDetector
+from .llm_response import RESPONSE_SCHEMA, ResponseParseError, parse_response, repair_response
+from .llm_telemetry import llm_telemetry, ollama_usage
+from .ollama_pool import get_endpoint_pool
+from .utils.metrics import metrics
+
 logger = logging.getLogger('iotshield')
 
+# Bump when the prompt changes so telemetry can compare prompt versions
+PROMPT_VERSION = 'v3'
+
+_response_log_lock = threading.Lock()
+
 
-class OllamaAnomalyDetector:
+class OllamaAnomalyDetector(BaseDetector):
     """Anomaly Detection using Ollama with llama3.2:1b model"""
+    name = 'llm'
+    is_expensive = True
     
-    def __init__(self):
-        """Initialize Ollama detector with llama3.2:1b model"""
-        self.ollama_host = getattr(settings, 'OLLAMA_HOST', 'http://localhost:11434')
+    def __init__(self, hosts=None):
+        """
+        Initialize Ollama detector with llama3.2:1b model
+        Args:
+            hosts: Optional list of Ollama base URLs (default: settings.OLLAMA_HOSTS)
+        """
         self.model_name = getattr(settings, 'OLLAMA_MODEL', 'llama3.2:1b')
-        self.api_endpoint = f"{self.ollama_host}/api/generate"
+        # Requests are load balanced over every host in the pool
+        self.pool = get_endpoint_pool(hosts)
+        self.ollama_host = self.pool.endpoints[0].url
+        # 'schema' constrains generation to RESPONSE_SCHEMA (Ollama >= 0.5), 'json' to any JSON
+        structured = getattr(settings, 'OLLAMA_STRUCTURED_OUTPUT', 'schema')
+        self.output_format = {'schema': RESPONSE_SCHEMA, 'json': 'json'}.get(structured)
+        self.parse_retries = getattr(settings, 'LLM_PARSE_RETRIES', 1)
+        self.response_log_path = getattr(settings, 'LLM_RESPONSE_LOG_PATH', None)
+        # How long Ollama keeps the model loaded after a request
+        self.keep_alive = getattr(settings, 'OLLAMA_KEEP_ALIVE', '30m')
         
-        logger.info(f"Ollama Anomaly Detector initialized with model: {self.model_name}")
+        logger.info(f"Ollama Anomaly Detector initialized with model: {self.model_name} "
+                    f"({len(self.pool)} endpoint{'s' if len(self.pool) > 1 else ''})")
     
     def analyze(self, sensor_data: Dict) -> Dict:
         """
@@ -37,15 +65,72 @@ class OllamaAnomalyDetector:
         """
         try:
             prompt = self._create_analysis_prompt(sensor_data)
-            response = self._call_ollama_api(prompt)
-            result = self._parse_ollama_response(response)
+            result = self._run_prompt(prompt, sensor_data, purpose='analyze')
             logger.info(f"Ollama analysis complete: anomaly={result['anomaly']}")
             return result
         except Exception as e:
             logger.error(f"Error in Ollama analysis: {e}")
             return self._get_fallback_response(sensor_data)
     
-    def _create_analysis_prompt(self, sensor_data: Dict) -> str:
+    def explain(self, sensor_data: Dict, severity: str) -> Dict:
+        """
+        Generate the explanation and suggestion for an alert that the fast
+        detectors already raised. Unlike analyze(), this raises on failure
+        (including a response that stays unparseable after the retries)
+        instead of returning the rule-based fallback.
+        Args:
+            sensor_data: Dictionary containing sensor information
+            severity: Severity assigned by the fast detectors
+        Returns:
+            Dictionary with the same fields as analyze()
+        """
+        prompt = self._create_analysis_prompt(sensor_data, preliminary_severity=severity)
+        result = self._run_prompt(prompt, sensor_data, purpose='explain')
+        logger.info(f"Ollama explanation complete for {sensor_data.get('sensor_type')} ({severity})")
+        return result
+    
+    def warm_up(self) -> Dict:
+        """
+        Load the model on every host and run one short throwaway generation,
+        so the first real request doesn't pay for model load, the prompt
+        prefix or compiling the output schema. Hosts are warmed in parallel.
+        Returns:
+            {host: {'ok', 'load_ms', 'generate_ms'}}
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=len(self.pool)) as executor:
+            results = executor.map(self._warm_up_host, [e.url for e in self.pool.endpoints])
+            return dict(zip([e.url for e in self.pool.endpoints], results))
+    
+    def _warm_up_host(self, host: str) -> Dict:
+        result = {'ok': False, 'load_ms': None, 'generate_ms': None}
+        try:
+            # An empty prompt only loads the model
+            started = time.perf_counter()
+            self._post_generate(host, {"model": self.model_name, "prompt": "", "keep_alive": self.keep_alive})
+            result['load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            
+            sample = {'sensor_type': 'TEMPERATURE', 'value': 24.0, 'unit': '°C',
+                      'device_name': 'Warm-up', 'location': 'Warm-up'}
+            payload = {
+                "model": self.model_name,
+                "prompt": self._create_analysis_prompt(sample),
+                "stream": False,
+                "options": {"temperature": 0, "num_predict": 16},
+                "keep_alive": self.keep_alive,
+            }
+            if self.output_format:
+                payload["format"] = self.output_format
+            started = time.perf_counter()
+            self._post_generate(host, payload)
+            result['generate_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            result['ok'] = True
+        except Exception as e:
+            logger.warning(f"Ollama warm-up failed on {host}: {e}")
+        return result
+    
+    def _create_analysis_prompt(self, sensor_data: Dict, preliminary_severity: str = None) -> str:
         """Create analysis prompt for the LLM"""
         sensor_type = sensor_data.get('sensor_type', 'Unknown')
         value = sensor_data.get('value', 0)
@@ -54,6 +139,11 @@ class OllamaAnomalyDetector:
         location = sensor_data.get('location', 'Unknown Location')
         timestamp = sensor_data.get('timestamp', 'Unknown')
         normal_ranges = self._get_normal_ranges(sensor_type)
+        classifier_note = (
+            f"\n**Preliminary Classification:**\nA rule-based classifier rated this reading {preliminary_severity}. "
+            f"Confirm or correct this in your answer.\n"
+            if preliminary_severity else ''
+        )
         
         prompt = f"""You are an IoT security and monitoring expert. Analyze the following sensor data and determine if it represents an anomaly or normal behavior.
 
@@ -66,7 +156,7 @@ class OllamaAnomalyDetector:
 
 **Normal Range Context:**
 {normal_ranges}
-
+{classifier_note}
 **Severity Classification Guidelines:**
 - **LOW**: Minor deviation from normal (5-15% outside normal range). Informational only, no immediate action needed.
 - **MEDIUM**: Moderate deviation (15-30% outside normal range). Monitor closely, may need attention soon.
@@ -110,100 +200,136 @@ Respond ONLY with valid JSON. No additional text or formatting.
         }
         return ranges.get(sensor_type, 'No predefined range available. Use expert judgment and classify based on reasonable deviation from expected values.')
     
-    def _call_ollama_api(self, prompt: str) -> str:
-        """Call Ollama API to generate response"""
-        try:
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 40
-            }
+    def _run_prompt(self, prompt: str, sensor_data: Dict, purpose: str) -> Dict:
+        """
+        Generate, parse and record telemetry for one call. An unparseable
+        response is regenerated (greedy, up to LLM_PARSE_RETRIES times).
+        Raises:
+            ResponseParseError: if no attempt gave a usable response
+        """
+        record = {
+            'sensor_type': sensor_data.get('sensor_type', ''),
+            'prompt_version': PROMPT_VERSION,
+        }
+        for attempt in range(1 + self.parse_retries):
+            # Retries decode greedily - a different sample is more likely to be valid
+            options = {'temperature': 0} if attempt else None
+            started = time.perf_counter()
+            try:
+                response_text, meta = self._generate(prompt, options=options)
+            except Exception:
+                llm_telemetry.record(self.model_name, purpose, (time.perf_counter() - started) * 1000,
+                                     status='ERROR', **record)
+                raise
+            latency_ms = (time.perf_counter() - started) * 1000
+            self._record_response(response_text, purpose)
             
-            response = requests.post(
-                self.api_endpoint,
-                json=payload,
-                timeout=60
+            result = self._try_parse_response(response_text)
+            llm_telemetry.record(
+                self.model_name, purpose, latency_ms,
+                status='OK' if result is not None else 'PARSE_ERROR',
+                usage=meta['usage'], endpoint=meta['endpoint'], **record
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', '')
-            else:
-                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                raise Exception(f"Ollama API returned status code {response.status_code}")
+            if result is not None:
+                return result
+            metrics.increment('llm_parse_retries', purpose=purpose)
+        # Callers decide what a failure means - analyze() falls back to the rules, explain() fails
+        raise ResponseParseError('unparseable', f"no usable response in {1 + self.parse_retries} attempts")
+    
+    def _record_response(self, response_text: str, purpose: str):
+        """Append the raw response to LLM_RESPONSE_LOG_PATH (a corpus for benchmark_llm_parser)"""
+        if not self.response_log_path:
+            return
+        line = json.dumps({'model': self.model_name, 'prompt_version': PROMPT_VERSION,
+                           'purpose': purpose, 'response': response_text})
+        try:
+            with _response_log_lock, open(self.response_log_path, 'a') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logger.error(f"Failed to record Ollama response: {e}")
+    
+    def _call_ollama_api(self, prompt: str) -> str:
+        """Call Ollama API to generate response"""
+        return self._generate(prompt)[0]
+    
+    def _generate(self, prompt: str, options: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """
+        Call Ollama API to generate response
+        Args:
+            prompt: Prompt text
+            options: Overrides for the sampling options
+        Returns:
+            (response text, {'endpoint': host used, 'usage': token counts and durations})
+        """
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": False,
+            # Ollama only reads sampling parameters from "options"
+            "options": dict({"temperature": 0.7, "top_p": 0.9, "top_k": 40}, **(options or {})),
+            "keep_alive": self.keep_alive,
+        }
+        if self.output_format:
+            payload["format"] = self.output_format
         
-        except requests.exceptions.ConnectionError:
-            logger.error(f"Failed to connect to Ollama at {self.ollama_host}. Is Ollama running?")
-            raise Exception(f"Cannot connect to Ollama at {self.ollama_host}")
-        except requests.exceptions.Timeout:
-            logger.error("Ollama API request timeout")
-            raise Exception("Ollama API request timeout")
-        except Exception as e:
-            logger.error(f"Error calling Ollama API: {e}")
-            raise
+        # A host that refuses the connection fails fast, so try another one
+        tried = []
+        while True:
+            try:
+                with self.pool.endpoint(exclude=tried) as endpoint:
+                    tried.append(endpoint.url)
+                    result = self._post_generate(endpoint.url, payload)
+                return result.get('response', ''), {'endpoint': endpoint.url, 'usage': ollama_usage(result)}
+            except requests.exceptions.ConnectionError:
+                logger.error(f"Failed to connect to Ollama at {tried[-1]}. Is Ollama running?")
+                if len(tried) >= len(self.pool):
+                    raise Exception(f"Cannot connect to Ollama at {', '.join(tried)}")
+            except requests.exceptions.Timeout:
+                logger.error(f"Ollama API request timeout ({tried[-1]})")
+                raise Exception("Ollama API request timeout")
+            except Exception as e:
+                logger.error(f"Error calling Ollama API: {e}")
+                raise
+    
+    def _post_generate(self, host: str, payload: Dict) -> Dict:
+        """POST one generate request to a single Ollama host and return the response JSON"""
+        response = requests.post(
+            f"{host}/api/generate",
+            json=payload,
+            timeout=60
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+            raise Exception(f"Ollama API returned status code {response.status_code}")
     
     def _parse_ollama_response(self, response_text: str) -> Dict:
         """Parse JSON response from Ollama"""
-        try:
-            # Clean up response
-            cleaned = response_text.strip()
-            
-            # Remove markdown code blocks if present
-            if '```json' in cleaned:
-                start = cleaned.find('{')
-                end = cleaned.rfind('}') + 1
-                if start >= 0 and end > start:
-                    cleaned = cleaned[start:end]
-            elif '```' in cleaned:
-                lines = cleaned.split('\n')
-                cleaned = '\n'.join(lines[1:-1] if len(lines) > 2 else lines)
-            
-            # Try to find JSON object in response
-            if '{' in cleaned:
-                start = cleaned.find('{')
-                end = cleaned.rfind('}') + 1
-                if start >= 0 and end > start:
-                    cleaned = cleaned[start:end]
-            
-            result = json.loads(cleaned)
-            
-            # Validate required fields
-            required_fields = ['anomaly', 'explanation', 'severity', 'suggestion']
-            for field in required_fields:
-                if field not in result:
-                    result[field] = self._get_default_value(field)
-            
-            # Ensure anomaly is boolean
-            if isinstance(result['anomaly'], str):
-                result['anomaly'] = result['anomaly'].lower() in ['true', '1', 'yes']
-            
-            # Validate severity
-            valid_severities = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
-            if result['severity'] not in valid_severities:
-                result['severity'] = 'LOW'
-            
-            return result
-        
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Ollama JSON response: {e}")
-            logger.debug(f"Response was: {response_text}")
-            return self._get_default_response()
-        except Exception as e:
-            logger.error(f"Error parsing Ollama response: {e}")
-            return self._get_default_response()
+        result = self._try_parse_response(response_text)
+        return result if result is not None else self._get_default_response()
     
-    def _get_default_value(self, field: str):
-        """Get default value for a field"""
-        defaults = {
-            'anomaly': False,
-            'explanation': 'Analysis incomplete',
-            'severity': 'LOW',
-            'suggestion': 'Review sensor data manually'
-        }
-        return defaults.get(field, '')
+    def _try_parse_response(self, response_text: str) -> Optional[Dict]:
+        """
+        Parse JSON response from Ollama, or None if it is unusable.
+        The strict parser handles well-formed output; the repair step only
+        runs when it fails.
+        """
+        started = time.perf_counter()
+        try:
+            result, outcome = parse_response(response_text), 'ok'
+        except ResponseParseError as e:
+            metrics.increment('llm_parse_failures', reason=e.reason)
+            try:
+                result, outcome = repair_response(response_text), 'repaired'
+            except ResponseParseError as repair_error:
+                logger.error(f"Failed to parse Ollama response ({e}; repair: {repair_error})")
+                logger.debug(f"Response was: {response_text}")
+                result, outcome = None, 'failed'
+        metrics.observe('llm_parse_ms', (time.perf_counter() - started) * 1000)
+        metrics.increment('llm_parse', outcome=outcome)
+        return result
     
     def _get_default_response(self) -> Dict:
         """Get default response when parsing fails"""
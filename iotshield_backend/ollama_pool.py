@@ -0,0 +1,295 @@
+"""
+Ollama Endpoint Pool for IoTShield
+Spreads LLM requests over several Ollama hosts, picking the least loaded one,
+and takes failing or slow hosts out of rotation until they recover
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+
+from .adaptive_concurrency import AIMDLimiter
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+class OllamaEndpoint:
+    """One Ollama host plus its health and load statistics"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        # Adaptive cap on parallel generations for this host
+        self.limiter = AIMDLimiter(name=self.url)
+        self.in_flight = 0
+        self.ewma_latency_ms = None
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.eject_reason = None
+
+    @property
+    def is_ejected(self):
+        return self.eject_reason is not None
+
+    def expected_latency_ms(self):
+        """Latency estimate for one more request (unknown hosts look fast so they get tried)"""
+        return self.ewma_latency_ms or 1.0
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': not self.is_ejected,
+            'eject_reason': self.eject_reason,
+            'in_flight': self.in_flight,
+            'concurrency_limit': self.limiter.current,
+            'ewma_latency_ms': round(self.ewma_latency_ms, 1) if self.ewma_latency_ms else None,
+            'consecutive_failures': self.consecutive_failures,
+            'ejections': self.ejections,
+        }
+
+
+class OllamaEndpointPool:
+    """
+    Load balancer and health checker for a list of Ollama hosts.
+
+    Balancing:
+        'latency'        - lowest (in_flight + 1) * EWMA latency, i.e. the host
+                           expected to finish one more request soonest
+        'least_inflight' - fewest requests in progress, EWMA latency breaks ties
+
+    Each host also has an AIMD concurrency limit; a request waits (up to
+    `acquire_timeout` seconds) until some healthy host has a free slot.
+
+    Health:
+        passive - `eject_failures` consecutive errors, or an EWMA latency more
+                  than `slow_factor` times the other healthy hosts' median, ejects a host
+                  for `eject_seconds` (doubling on repeat ejections, max 10x)
+        active  - a background probe of /api/tags every `check_interval`
+                  seconds re-admits recovered hosts and ejects dead ones
+    """
+
+    def __init__(self, hosts, model_name=None, strategy=None, eject_failures=None,
+                 eject_seconds=None, slow_factor=None, check_interval=None, acquire_timeout=None):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.endpoints = [OllamaEndpoint(url) for url in hosts]
+        self.model_name = model_name or getattr(settings, 'OLLAMA_MODEL', 'llama3.2:1b')
+        self.strategy = strategy or getattr(settings, 'OLLAMA_BALANCE_STRATEGY', 'latency')
+        self.eject_failures = eject_failures or getattr(settings, 'OLLAMA_EJECT_FAILURES', 3)
+        self.eject_seconds = eject_seconds or getattr(settings, 'OLLAMA_EJECT_SECONDS', 30)
+        self.slow_factor = slow_factor or getattr(settings, 'OLLAMA_SLOW_FACTOR', 3.0)
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'OLLAMA_HEALTH_CHECK_INTERVAL', 15
+        )
+        self.acquire_timeout = acquire_timeout or getattr(settings, 'OLLAMA_ACQUIRE_TIMEOUT', 60)
+        self.ewma_alpha = 0.2
+
+        # Condition so requests can wait for a free concurrency slot
+        self._lock = threading.Condition()
+        self._checker = None
+
+        for endpoint in self.endpoints:
+            metrics.set_gauge('ollama_endpoint_healthy', 1, endpoint=endpoint.url)
+        logger.info(f"Ollama pool: {', '.join(e.url for e in self.endpoints)} ({self.strategy})")
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    # ---- request path -------------------------------------------------
+
+    @contextmanager
+    def endpoint(self, exclude=()):
+        """
+        Reserve the best endpoint for one request
+
+        Usage:
+            with pool.endpoint() as endpoint:
+                requests.post(f"{endpoint.url}/api/generate", ...)
+
+        Raising inside the block counts as a failure for that endpoint.
+        """
+        self._ensure_checker()
+        endpoint = self._acquire(exclude)
+        started = time.perf_counter()
+        try:
+            yield endpoint
+        except Exception:
+            self._release(endpoint, None)
+            raise
+        else:
+            self._release(endpoint, (time.perf_counter() - started) * 1000)
+
+    def _acquire(self, exclude=()):
+        deadline = time.time() + self.acquire_timeout
+        with self._lock:
+            while True:
+                now = time.time()
+                # Ejection has run out - give the host another chance (it is
+                # ejected again, for longer, if it keeps failing)
+                for endpoint in self.endpoints:
+                    if endpoint.is_ejected and endpoint.ejected_until <= now:
+                        self._readmit(endpoint)
+
+                candidates = [e for e in self.endpoints if not e.is_ejected and e.url not in exclude]
+                if not candidates:
+                    # Everything is ejected - fail open to whichever host is due back first
+                    candidates = [e for e in self.endpoints if e.url not in exclude] or self.endpoints
+                    candidates = [min(candidates, key=lambda e: e.ejected_until)]
+                    if candidates[0].ejected_until > now:
+                        logger.warning(f"All Ollama endpoints are ejected - trying {candidates[0].url}")
+
+                # Only hosts below their adaptive concurrency limit
+                candidates = [e for e in candidates if e.in_flight < e.limiter.current]
+                if candidates:
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    metrics.increment('ollama_acquire_timeouts')
+                    raise TimeoutError(f"No Ollama capacity after waiting {self.acquire_timeout}s")
+                self._lock.wait(remaining)
+
+            if self.strategy == 'least_inflight':
+                endpoint = min(candidates, key=lambda e: (e.in_flight, e.expected_latency_ms()))
+            else:
+                endpoint = min(candidates, key=lambda e: (e.in_flight + 1) * e.expected_latency_ms())
+
+            endpoint.in_flight += 1
+            metrics.set_gauge('ollama_in_flight', endpoint.in_flight, endpoint=endpoint.url)
+        return endpoint
+
+    def _release(self, endpoint, latency_ms):
+        """Update statistics after a request (latency_ms is None on failure)"""
+        with self._lock:
+            endpoint.in_flight -= 1
+            metrics.set_gauge('ollama_in_flight', endpoint.in_flight, endpoint=endpoint.url)
+            endpoint.limiter.on_sample(latency_ms, endpoint.in_flight, error=latency_ms is None)
+            # A slot opened up (and the limit may have changed)
+            self._lock.notify_all()
+
+            if latency_ms is None:
+                endpoint.consecutive_failures += 1
+                metrics.increment('ollama_requests', endpoint=endpoint.url, outcome='error')
+                if endpoint.consecutive_failures >= self.eject_failures:
+                    self._eject(endpoint, 'errors')
+                return
+
+            endpoint.consecutive_failures = 0
+            if endpoint.ewma_latency_ms is None:
+                endpoint.ewma_latency_ms = latency_ms
+            else:
+                endpoint.ewma_latency_ms += self.ewma_alpha * (latency_ms - endpoint.ewma_latency_ms)
+            metrics.observe('ollama_latency_ms', latency_ms, endpoint=endpoint.url)
+            metrics.increment('ollama_requests', endpoint=endpoint.url, outcome='ok')
+
+            if self._is_outlier(endpoint):
+                self._eject(endpoint, 'slow')
+
+    def _is_outlier(self, endpoint):
+        """Much slower than the other healthy hosts? (caller holds the lock)"""
+        others = sorted(
+            e.ewma_latency_ms for e in self.endpoints
+            if e is not endpoint and not e.is_ejected and e.ewma_latency_ms is not None
+        )
+        # Nothing to compare against (or it's the last host standing)
+        if not others:
+            return False
+        median = others[len(others) // 2]
+        return endpoint.ewma_latency_ms > self.slow_factor * median
+
+    def _eject(self, endpoint, reason):
+        """Take an endpoint out of rotation (caller holds the lock)"""
+        if endpoint.is_ejected:
+            return
+        endpoint.ejections += 1
+        backoff = self.eject_seconds * min(2 ** (endpoint.ejections - 1), 10)
+        endpoint.ejected_until = time.time() + backoff
+        endpoint.eject_reason = reason
+        metrics.increment('ollama_ejections', endpoint=endpoint.url, reason=reason)
+        metrics.set_gauge('ollama_endpoint_healthy', 0, endpoint=endpoint.url)
+        logger.warning(f"Ejected Ollama endpoint {endpoint.url} ({reason}) for {backoff:.0f}s")
+
+    def _readmit(self, endpoint):
+        """Put an endpoint back into rotation (caller holds the lock)"""
+        endpoint.eject_reason = None
+        endpoint.consecutive_failures = 0
+        # Forget the slow history - the host gets a fresh measurement
+        endpoint.ewma_latency_ms = None
+        metrics.set_gauge('ollama_endpoint_healthy', 1, endpoint=endpoint.url)
+        self._lock.notify_all()
+        logger.info(f"Re-admitted Ollama endpoint {endpoint.url}")
+
+    # ---- active health checks ------------------------------------------
+
+    def _ensure_checker(self):
+        if self._checker is not None or not self.check_interval:
+            return
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_loop, name='ollama-health', daemon=True)
+                self._checker.start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check_health()
+
+    def probe(self, endpoint, timeout=2):
+        """Is the host up and does it have our model?"""
+        try:
+            response = requests.get(f"{endpoint.url}/api/tags", timeout=timeout)
+            if response.status_code != 200:
+                return False
+            models = [m.get('name', '') for m in response.json().get('models', [])]
+            # Without a tag, Ollama treats "llama3.2" as "llama3.2:latest"
+            wanted = self.model_name if ':' in self.model_name else f"{self.model_name}:latest"
+            return not models or wanted in models or self.model_name in models
+        except Exception:
+            return False
+
+    def check_health(self):
+        """Probe every endpoint once, ejecting dead ones and re-admitting recovered ones"""
+        now = time.time()
+        for endpoint in self.endpoints:
+            # Slow hosts sit out their full ejection before being probed again
+            if endpoint.is_ejected and endpoint.ejected_until > now:
+                continue
+            healthy = self.probe(endpoint)
+            with self._lock:
+                if healthy and endpoint.is_ejected:
+                    self._readmit(endpoint)
+                elif not healthy and not endpoint.is_ejected:
+                    self._eject(endpoint, 'health_check')
+                elif not healthy:
+                    # Still down - extend the ejection
+                    endpoint.ejected_until = now + self.eject_seconds
+
+    def capacity(self):
+        """Total concurrency currently allowed across healthy hosts"""
+        with self._lock:
+            healthy = [e for e in self.endpoints if not e.is_ejected] or self.endpoints
+            return sum(e.limiter.current for e in healthy)
+
+    def get_stats(self):
+        with self._lock:
+            return [endpoint.to_dict() for endpoint in self.endpoints]
+
+
+# One pool per host list, shared by every detector instance in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(hosts=None):
+    """Shared pool for a list of hosts (defaults to settings.OLLAMA_HOSTS)"""
+    hosts = tuple(hosts or getattr(settings, 'OLLAMA_HOSTS', None)
+                  or [getattr(settings, 'OLLAMA_HOST', 'http://localhost:11434')])
+    with _pools_lock:
+        pool = _pools.get(hosts)
+        if pool is None:
+            pool = _pools[hosts] = OllamaEndpointPool(list(hosts))
+        return pool
@@ -0,0 +1,246 @@
+"""
+Differential-Privacy Budget Accounting for IoTShield
+Tracks how much privacy budget each consumer has spent on each sensor stream
+across noisy releases, refuses releases once the budget is gone, and keeps
+recent releases so they can be served again at no extra privacy cost
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+
+# ---- composition (zero-concentrated DP, a form of Renyi DP) ----------------
+# Spend is kept as rho, which adds up across releases; converting the total
+# back to (epsilon, delta) grows with sqrt(releases) instead of linearly.
+
+def gaussian_rho(epsilon, delta):
+    """rho of one Gaussian release calibrated to (epsilon, delta) (sigma = sqrt(2 ln(1.25/delta)) / epsilon)"""
+    return epsilon ** 2 / (4 * math.log(1.25 / delta))
+
+
+def laplace_rho(epsilon):
+    """rho of one pure epsilon-DP (Laplace) release"""
+    return epsilon ** 2 / 2
+
+
+def rho_to_epsilon(rho, delta):
+    """(epsilon, delta)-DP guarantee of a total rho"""
+    return rho + 2 * math.sqrt(rho * math.log(1 / delta))
+
+
+def epsilon_to_rho(epsilon, delta):
+    """Largest total rho that still satisfies (epsilon, delta)-DP"""
+    log_term = math.log(1 / delta)
+    return (math.sqrt(log_term + epsilon) - math.sqrt(log_term)) ** 2
+
+
+class _Spend:
+    """Committed (in the database) plus pending (not yet flushed) spend for one key"""
+    __slots__ = ('rho', 'epsilon', 'releases', 'pending_rho', 'pending_epsilon', 'pending_releases')
+
+    def __init__(self, rho=0.0, epsilon=0.0, releases=0):
+        self.rho = rho
+        self.epsilon = epsilon
+        self.releases = releases
+        self.pending_rho = 0.0
+        self.pending_epsilon = 0.0
+        self.pending_releases = 0
+
+    @property
+    def total_rho(self):
+        return self.rho + self.pending_rho
+
+
+class PrivacyAccountant:
+    """
+    Privacy budget per (device_id, sensor_type, consumer).
+
+    Charges are O(1) dictionary updates; the spend is written to
+    PrivacyBudget in one transaction every `flush_interval` seconds (as
+    increments, so several processes can share the table) and re-read at the
+    same time to pick up what other processes spent. The request path never
+    touches the database after the first load.
+    """
+
+    def __init__(self, epsilon_budget=None, delta=None, flush_interval=None):
+        self.epsilon_budget = epsilon_budget or getattr(settings, 'PRIVACY_BUDGET_EPSILON', 10.0)
+        self.delta = delta or getattr(settings, 'PRIVACY_BUDGET_DELTA', 1e-6)
+        self.flush_interval = flush_interval or getattr(settings, 'PRIVACY_BUDGET_FLUSH_INTERVAL', 30)
+        self.rho_budget = epsilon_to_rho(self.epsilon_budget, self.delta)
+        self._spend = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def charge(self, keys, rho, epsilon):
+        """
+        Spend one release on every key, all or nothing
+
+        Args:
+            keys: (device_id, sensor_type, consumer) tuples released together
+            rho: zCDP cost of the release per key
+            epsilon: Per-release epsilon (for linear-composition reporting)
+
+        Returns:
+            List of keys whose budget can't cover the release (nothing is
+            charged then); empty if the release may go ahead
+        """
+        self._ensure_loaded()
+        with self._lock:
+            spends = [self._spend.get(key) or _Spend() for key in keys]
+            exhausted = [key for key, spend in zip(keys, spends) if spend.total_rho + rho > self.rho_budget]
+            if not exhausted:
+                for key, spend in zip(keys, spends):
+                    spend.pending_rho += rho
+                    spend.pending_epsilon += epsilon
+                    spend.pending_releases += 1
+                    self._spend[key] = spend
+
+        metrics.increment('privacy_budget_charges', outcome='exhausted' if exhausted else 'ok')
+        self._ensure_flusher()
+        return exhausted
+
+    def spent(self, key):
+        """Spend so far for one key"""
+        self._ensure_loaded()
+        with self._lock:
+            spend = self._spend.get(key) or _Spend()
+            rho = spend.total_rho
+            linear = spend.epsilon + spend.pending_epsilon
+            releases = spend.releases + spend.pending_releases
+        return {
+            'rho': rho,
+            'epsilon': rho_to_epsilon(rho, self.delta) if rho else 0.0,
+            'epsilon_linear': linear,
+            'releases': releases,
+            'epsilon_remaining': max(0.0, self.epsilon_budget - (rho_to_epsilon(rho, self.delta) if rho else 0.0)),
+        }
+
+    def load(self):
+        """(Re)read committed spend from the database, keeping pending charges"""
+        from dashboard.models import PrivacyBudget
+
+        rows = PrivacyBudget.objects.values_list(
+            'device_id', 'sensor_type', 'consumer', 'rho', 'epsilon_linear', 'releases'
+        )
+        committed = {(d, t, c): (rho, eps, n) for d, t, c, rho, eps, n in rows}
+        with self._lock:
+            for key, (rho, eps, n) in committed.items():
+                spend = self._spend.get(key)
+                if spend is None:
+                    self._spend[key] = _Spend(rho, eps, n)
+                else:
+                    spend.rho, spend.epsilon, spend.releases = rho, eps, n
+            self._loaded = True
+        return len(committed)
+
+    def flush(self):
+        """Write pending spend as increments in one transaction, then re-read the totals"""
+        from django.db import transaction
+        from django.db.models import F
+        from dashboard.models import PrivacyBudget
+
+        with self._lock:
+            pending = []
+            for key, spend in self._spend.items():
+                if spend.pending_releases:
+                    pending.append((key, spend.pending_rho, spend.pending_epsilon, spend.pending_releases))
+                    # Counted as committed right away so the budget check stays correct
+                    spend.rho += spend.pending_rho
+                    spend.epsilon += spend.pending_epsilon
+                    spend.releases += spend.pending_releases
+                    spend.pending_rho = spend.pending_epsilon = 0.0
+                    spend.pending_releases = 0
+        if not pending:
+            return 0
+
+        try:
+            with metrics.timer('privacy_budget_flush_ms'), transaction.atomic():
+                for (device_id, sensor_type, consumer), rho, eps, n in pending:
+                    updated = PrivacyBudget.objects.filter(
+                        device_id=device_id, sensor_type=sensor_type, consumer=consumer
+                    ).update(rho=F('rho') + rho, epsilon_linear=F('epsilon_linear') + eps,
+                             releases=F('releases') + n)
+                    if not updated:
+                        PrivacyBudget.objects.create(device_id=device_id, sensor_type=sensor_type,
+                                                     consumer=consumer, rho=rho, epsilon_linear=eps, releases=n)
+            self.load()
+        except Exception as e:
+            # Keep the charges in memory (already counted) and retry them next time
+            logger.error(f"Failed to persist privacy budget for {len(pending)} streams: {e}")
+            with self._lock:
+                for key, rho, eps, n in pending:
+                    spend = self._spend[key]
+                    spend.rho -= rho
+                    spend.epsilon -= eps
+                    spend.releases -= n
+                    spend.pending_rho += rho
+                    spend.pending_epsilon += eps
+                    spend.pending_releases += n
+            return 0
+        return len(pending)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        try:
+            self.load()
+        except Exception as e:
+            # Start from zero rather than failing requests; the next flush re-reads
+            logger.error(f"Failed to load privacy budgets: {e}")
+            self._loaded = True
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='privacy-budget', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+class ReleaseCache:
+    """
+    LRU of recent noisy releases. Serving the same noisy answer again is
+    post-processing and costs no privacy budget.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(settings, 'PRIVACY_RELEASE_CACHE_SIZE', 256)
+        self._releases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            release = self._releases.get(key)
+            if release is not None:
+                self._releases.move_to_end(key)
+        metrics.increment('privacy_release_cache', outcome='hit' if release is not None else 'miss')
+        return release
+
+    def put(self, key, release):
+        with self._lock:
+            self._releases[key] = release
+            self._releases.move_to_end(key)
+            while len(self._releases) > self.max_size:
+                self._releases.popitem(last=False)
+
+
+# Global accountant and release cache
+privacy_accountant = PrivacyAccountant()
+release_cache = ReleaseCache()
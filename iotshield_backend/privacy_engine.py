@@ -3,24 +3,77 @@ Privacy-Preserving Engine for IoTShield
 Implements differential privacy through noise addition and RSA encryption
 """
 import logging
+import os
 import numpy as np
 import base64
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from django.conf import settings
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Random import get_random_bytes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .k_anonymity import MondrianAnonymizer, generalize_location, generalize_locations, to_datetime64
+from .utils.metrics import metrics
 
 logger = logging.getLogger('iotshield')
 
 
+# Per-sensor noise sensitivity (the largest change one reading may hide)
+SENSOR_SENSITIVITY = {
+    'TEMPERATURE': 2.0,  # ±2°C sensitivity
+    'HUMIDITY': 5.0,  # ±5% sensitivity
+    'GAS': 0.1,  # ±0.1 sensitivity
+    'FLAME': 0.05,  # ±0.05 sensitivity
+    'MOTION': 0.0,  # No noise for binary motion
+    'LIGHT': 50.0,  # ±50 lux sensitivity
+}
+DEFAULT_SENSITIVITY = 1.0
+
+# Noisy values are clipped to these physical bounds
+SENSOR_BOUNDS = {
+    'TEMPERATURE': {'min': -50, 'max': 100},
+    'HUMIDITY': {'min': 0, 'max': 100},
+    'GAS': {'min': 0, 'max': 1},
+    'FLAME': {'min': 0, 'max': 1},
+    'MOTION': {'min': 0, 'max': 1},
+    'LIGHT': {'min': 0, 'max': 2000},
+}
+DEFAULT_BOUNDS = {'min': 0, 'max': 1000}
+
+# Binary sensors whose 0/1 readings are passed through without noise
+BINARY_SENSORS = ('MOTION', 'FLAME')
+
+# Integer codes for the batch API; every other sensor type maps to OTHER_SENSOR_CODE
+SENSOR_TYPE_CODES = {sensor_type: code for code, sensor_type in enumerate(SENSOR_SENSITIVITY)}
+OTHER_SENSOR_CODE = len(SENSOR_TYPE_CODES)
+
+
 class PrivacyEngine:
     """Privacy-preserving mechanisms using differential privacy"""
     
-    def __init__(self):
-        self.epsilon = settings.PRIVACY_NOISE_EPSILON
-        self.delta = settings.PRIVACY_NOISE_DELTA
+    def __init__(self, epsilon=None, delta=None, seed=None):
+        self.epsilon = epsilon or settings.PRIVACY_NOISE_EPSILON
+        self.delta = delta or settings.PRIVACY_NOISE_DELTA
+        # Dedicated generator - seed it only for reproducible tests
+        self.rng = np.random.default_rng(seed if seed is not None else getattr(settings, 'PRIVACY_NOISE_SEED', None))
+        
+        # Gaussian sigma per unit of sensitivity, computed once instead of per value
+        self._gaussian_factor = np.sqrt(2 * np.log(1.25 / self.delta)) / self.epsilon
+        
+        # Lookup tables indexed by sensor type code (last slot = other types)
+        types = list(SENSOR_TYPE_CODES) + [None]
+        sensitivity = np.array([SENSOR_SENSITIVITY.get(t, DEFAULT_SENSITIVITY) for t in types])
+        self._sigma = sensitivity * self._gaussian_factor
+        self._laplace_scale = sensitivity / self.epsilon
+        self._lower = np.array([SENSOR_BOUNDS.get(t, DEFAULT_BOUNDS)['min'] for t in types], dtype=np.float64)
+        self._upper = np.array([SENSOR_BOUNDS.get(t, DEFAULT_BOUNDS)['max'] for t in types], dtype=np.float64)
+        self._binary = np.array([t in BINARY_SENSORS for t in types])
     
     def add_gaussian_noise(self, value, sensitivity=1.0):
         """
@@ -34,16 +87,17 @@ class PrivacyEngine:
             Noisy value with differential privacy guarantee
         """
         try:
-            # Calculate standard deviation for Gaussian mechanism
-            sigma = (sensitivity * np.sqrt(2 * np.log(1.25 / self.delta))) / self.epsilon
+            # Standard deviation for the Gaussian mechanism
+            sigma = sensitivity * self._gaussian_factor
             
             # Generate Gaussian noise
-            noise = np.random.normal(0, sigma)
+            noise = self.rng.normal(0, sigma)
             
             # Add noise to value
             noisy_value = value + noise
             
-            logger.debug(f"Added Gaussian noise: {value} -> {noisy_value} (noise: {noise:.4f})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Added Gaussian noise: {value} -> {noisy_value} (noise: {noise:.4f})")
             
             return noisy_value
         
@@ -67,12 +121,13 @@ class PrivacyEngine:
             scale = sensitivity / self.epsilon
             
             # Generate Laplace noise
-            noise = np.random.laplace(0, scale)
+            noise = self.rng.laplace(0, scale)
             
             # Add noise to value
             noisy_value = value + noise
             
-            logger.debug(f"Added Laplace noise: {value} -> {noisy_value} (noise: {noise:.4f})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Added Laplace noise: {value} -> {noisy_value} (noise: {noise:.4f})")
             
             return noisy_value
         
@@ -91,20 +146,10 @@ class PrivacyEngine:
         Returns:
             Noisy value with appropriate bounds
         """
-        # Define sensitivity for each sensor type
-        sensitivities = {
-            'TEMPERATURE': 2.0,  # ±2°C sensitivity
-            'HUMIDITY': 5.0,  # ±5% sensitivity
-            'GAS': 0.1,  # ±0.1 sensitivity
-            'FLAME': 0.05,  # ±0.05 sensitivity
-            'MOTION': 0.0,  # No noise for binary motion
-            'LIGHT': 50.0,  # ±50 lux sensitivity
-        }
-        
-        sensitivity = sensitivities.get(sensor_type, 1.0)
+        sensitivity = SENSOR_SENSITIVITY.get(sensor_type, DEFAULT_SENSITIVITY)
         
         # Don't add noise to binary sensors
-        if sensor_type in ['MOTION', 'FLAME'] and value in [0, 1]:
+        if sensor_type in BINARY_SENSORS and value in [0, 1]:
             return value
         
         # Add Gaussian noise (suitable for continuous data)
@@ -116,33 +161,92 @@ class PrivacyEngine:
         
         return noisy_value
     
+    @staticmethod
+    def sensor_type_codes(sensor_types):
+        """
+        Map sensor type names to the integer codes used by add_noise_batch
+        
+        Args:
+            sensor_types: Iterable of sensor type strings
+        
+        Returns:
+            np.ndarray of codes (unknown types get OTHER_SENSOR_CODE)
+        """
+        get = SENSOR_TYPE_CODES.get
+        return np.fromiter((get(t, OTHER_SENSOR_CODE) for t in sensor_types), dtype=np.intp)
+    
+    def add_noise_batch(self, codes, values, mechanism='gaussian'):
+        """
+        Vectorized add_noise_to_sensor_data for many readings at once
+        
+        Args:
+            codes: Array of sensor type codes (see sensor_type_codes)
+            values: Array of original values, same length
+            mechanism: 'gaussian' or 'laplace'
+        
+        Returns:
+            New float64 array of noisy values, clipped to each type's bounds
+            (0/1 readings of binary sensors are returned unchanged)
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        
+        if mechanism == 'gaussian':
+            noisy = self.rng.standard_normal(values.shape)
+            noisy *= self._sigma[codes]
+        elif mechanism == 'laplace':
+            noisy = self.rng.laplace(0.0, 1.0, values.shape)
+            noisy *= self._laplace_scale[codes]
+        else:
+            raise ValueError(f"Unknown noise mechanism: {mechanism}")
+        noisy += values
+        np.clip(noisy, self._lower[codes], self._upper[codes], out=noisy)
+        
+        passthrough = self._binary[codes] & ((values == 0) | (values == 1))
+        if passthrough.any():
+            noisy[passthrough] = values[passthrough]
+        return noisy
+    
+    def add_noise_to_readings(self, sensor_types, values, mechanism='gaussian'):
+        """add_noise_batch for sensor type names instead of codes"""
+        return self.add_noise_batch(self.sensor_type_codes(sensor_types), values, mechanism)
+    
     def _get_sensor_bounds(self, sensor_type):
         """Get min/max bounds for sensor types"""
-        bounds = {
-            'TEMPERATURE': {'min': -50, 'max': 100},
-            'HUMIDITY': {'min': 0, 'max': 100},
-            'GAS': {'min': 0, 'max': 1},
-            'FLAME': {'min': 0, 'max': 1},
-            'MOTION': {'min': 0, 'max': 1},
-            'LIGHT': {'min': 0, 'max': 2000},
-        }
+        return SENSOR_BOUNDS.get(sensor_type, DEFAULT_BOUNDS)
+    
+    def release_cost(self, mechanism='gaussian'):
+        """
+        Privacy cost of one noisy release of a sensor stream
+        
+        Returns:
+            (rho, epsilon) - zCDP cost for the budget accountant and the
+            per-release epsilon for linear-composition reporting
+        """
+        from .privacy_budget import gaussian_rho, laplace_rho
         
-        return bounds.get(sensor_type, {'min': 0, 'max': 1000})
+        if mechanism == 'laplace':
+            return laplace_rho(self.epsilon), self.epsilon
+        return gaussian_rho(self.epsilon, self.delta), self.epsilon
     
-    def calculate_privacy_loss(self, num_queries):
+    def calculate_privacy_loss(self, num_queries, delta=None):
         """
         Calculate cumulative privacy loss (epsilon) for multiple queries
         
         Args:
-            num_queries: Number of queries made
+            num_queries: Number of Gaussian releases made
+            delta: Target delta of the composed guarantee (default: PRIVACY_BUDGET_DELTA)
         
         Returns:
-            Total privacy loss (epsilon)
+            Total privacy loss (epsilon) - the tighter of linear and zCDP composition
         """
-        # Using composition theorem for differential privacy
-        total_epsilon = num_queries * self.epsilon
+        from .privacy_budget import rho_to_epsilon
         
-        return total_epsilon
+        if num_queries <= 0:
+            return 0.0
+        delta = delta or getattr(settings, 'PRIVACY_BUDGET_DELTA', 1e-6)
+        rho, _ = self.release_cost()
+        return min(num_queries * self.epsilon, rho_to_epsilon(num_queries * rho, delta))
     
     def anonymize_location(self, location_data):
         """
@@ -154,40 +258,41 @@ class PrivacyEngine:
         Returns:
             Anonymized location
         """
-        # Generalize location to room level only
-        if not location_data:
-            return "Unknown Location"
-        
-        # Remove specific identifiers, keep only general area
-        general_areas = ['Living Room', 'Bedroom', 'Kitchen', 'Bathroom', 'Office', 'Garage']
-        
-        for area in general_areas:
-            if area.lower() in location_data.lower():
-                return area
-        
-        return "General Area"
+        # Generalize location to room level only (memoized per distinct location)
+        return generalize_location(location_data)
+    
+    def anonymize_locations(self, locations):
+        """Batch anonymize_location over a column; returns an object array"""
+        return generalize_locations(locations)
     
     def apply_k_anonymity(self, dataset, k=5):
         """
         Apply k-anonymity to a dataset
         
         Args:
-            dataset: List of data records
+            dataset: List of data records (timestamp, location and value are
+                the quasi-identifiers; other fields are kept as they are)
             k: Minimum group size for anonymity
         
         Returns:
-            Anonymized dataset
+            Anonymized dataset: each record's timestamp and value are replaced
+            by its group's `_min`/`_max` range and its location by the group's
+            rooms, so every published combination is shared by >= k records
         """
-        # This is a simplified implementation
-        # In production, use proper k-anonymity algorithms
-        
         if len(dataset) < k:
             logger.warning(f"Dataset size ({len(dataset)}) is smaller than k ({k})")
             return []
         
-        # Group similar records and ensure each group has at least k members
-        # For simplicity, we're just checking the size here
-        return dataset
+        columns = {name: [record.get(name) for record in dataset] for name in dataset[0]}
+        if 'location' in columns:
+            columns['location'] = generalize_locations(columns['location'])
+        if 'timestamp' in columns:
+            columns['timestamp'] = to_datetime64(columns['timestamp'])
+        
+        anonymized, stats = MondrianAnonymizer(k=k).anonymize(columns)
+        logger.debug(f"k-anonymity (k={k}): {stats}")
+        names = list(anonymized)
+        return [dict(zip(names, row)) for row in zip(*(anonymized[name].tolist() for name in names))]
     
     def encrypt_sensitive_field(self, data, field_name):
         """
@@ -198,31 +303,91 @@ class PrivacyEngine:
             field_name: Name of field to encrypt
         
         Returns:
-            Data with encrypted field
+            Data with encrypted field (readable again with decrypt_sensitive_field)
         """
-        # This is a placeholder for encryption
-        # In production, use proper encryption libraries like cryptography
-        
-        from cryptography.fernet import Fernet
-        import json
+        from .field_encryption import field_encryptor
         
         try:
-            # Generate key (in production, use stored key)
-            key = Fernet.generate_key()
-            cipher_suite = Fernet(key)
-            
-            # Encrypt the field
-            field_value = str(data.get(field_name, ''))
-            encrypted_value = cipher_suite.encrypt(field_value.encode())
-            
-            data[field_name] = encrypted_value.decode()
-            data[f'{field_name}_encrypted'] = True
-            
+            field_encryptor.encrypt_records([data], field_name)
             return data
         
         except Exception as e:
             logger.error(f"Error encrypting field {field_name}: {e}")
             return data
+    
+    def decrypt_sensitive_field(self, data, field_name):
+        """Reverse encrypt_sensitive_field"""
+        from .field_encryption import field_encryptor
+        
+        try:
+            field_encryptor.decrypt_records([data], field_name)
+        except Exception as e:
+            logger.error(f"Error decrypting field {field_name}: {e}")
+        return data
+
+
+# Envelope types accepted on the MQTT topics
+LEGACY_ENCRYPTION_TYPE = 'RSA-OAEP'  # whole payload RSA-encrypted (max ~190 bytes)
+HYBRID_ENCRYPTION_TYPE = 'RSA-AES-GCM'  # AES-GCM payload under an RSA-wrapped session key
+
+
+def session_key_id(wrapped_key):
+    """Key id of a wrapped session key - a hash, so an id can't be re-bound to another key"""
+    return hashlib.sha256(wrapped_key).hexdigest()[:16]
+
+
+def key_fingerprint(public_key):
+    """Fingerprint of an RSA key pair - sha256 of the public key (DER), 16 hex chars"""
+    return hashlib.sha256(public_key.export_key('DER')).hexdigest()[:16]
+
+
+class RSAKeyEntry:
+    """One loaded key pair with its ready-to-use OAEP cipher"""
+    __slots__ = ('fingerprint', 'private_key', 'public_key', 'cipher', 'retired')
+
+    def __init__(self, private_key, retired=False):
+        self.private_key = private_key
+        self.public_key = private_key.publickey()
+        self.fingerprint = key_fingerprint(self.public_key)
+        self.cipher = PKCS1_OAEP.new(private_key)
+        self.retired = retired
+
+
+class SessionKeyCache:
+    """
+    Bounded LRU of unwrapped AES session keys (as ready AESGCM objects).
+    Entries expire `ttl` seconds after the key was first unwrapped, after
+    which the device's next wrapped_key is RSA-decrypted again.
+    """
+    
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or getattr(settings, 'SESSION_KEY_CACHE_SIZE', 1024)
+        self.ttl = ttl or getattr(settings, 'SESSION_KEY_TTL', 3600)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key_id):
+        """AESGCM for a key id, or None if unknown or expired"""
+        with self._lock:
+            entry = self._keys.get(key_id)
+            if entry is not None:
+                if entry[1] <= time.time():
+                    del self._keys[key_id]
+                    entry = None
+                else:
+                    self._keys.move_to_end(key_id)
+        metrics.increment('session_key_cache', outcome='hit' if entry is not None else 'miss')
+        return entry[0] if entry is not None else None
+    
+    def put(self, key_id, aesgcm):
+        with self._lock:
+            self._keys[key_id] = (aesgcm, time.time() + self.ttl)
+            self._keys.move_to_end(key_id)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._keys)
 
 
 class RSAEncryption:
@@ -243,11 +408,23 @@ class RSAEncryption:
         self.public_key = None
         # Cipher object for actual encryption/decryption operations
         self.cipher = None
+        # Session keys already unwrapped with the private key (hybrid envelopes)
+        self.session_keys = SessionKeyCache()
+        
+        # fingerprint -> RSAKeyEntry for the active key and every retired key still
+        # accepted; replaced as a whole on reload so readers never see it half-built
+        self.keys = {}
+        self.active_fingerprint = None
+        self.reload_interval = getattr(settings, 'RSA_KEY_RELOAD_INTERVAL', 30)
+        self._last_reload = 0.0
+        self._reload_lock = threading.Lock()
         
         # Set up file paths where keys will be stored
-        self.keys_dir = Path(settings.BASE_DIR) / 'keys'
+        self.keys_dir = Path(getattr(settings, 'RSA_KEYS_DIR', None) or Path(settings.BASE_DIR) / 'keys')
         self.private_key_path = self.keys_dir / 'rsa_private.pem'  # Keep this secret!
         self.public_key_path = self.keys_dir / 'rsa_public.pem'    # Can share with devices
+        # Rotated-out private keys, kept until no device uses them any more
+        self.retired_dir = self.keys_dir / 'retired'
         
         # Automatically load or create keys when this class is initialized
         self._initialize_keys()
@@ -288,6 +465,7 @@ class RSAEncryption:
             
             # Set up the cipher object using OAEP padding (more secure than basic RSA)
             self.cipher = PKCS1_OAEP.new(self.private_key)
+            self._build_key_map()
             
             logger.info(f"Generated {self.key_size}-bit RSA key pair")
             
@@ -334,12 +512,115 @@ class RSAEncryption:
             # Set up cipher for decryption using the private key
             self.cipher = PKCS1_OAEP.new(self.private_key)
             
+            # Retired keys still decrypt messages from devices not yet reflashed
+            self._build_key_map()
+            
             logger.debug("RSA keys loaded from disk")
             
         except Exception as e:
             logger.error(f"Error loading RSA keys: {e}")
             raise
     
+    def _build_key_map(self):
+        """Map the active key and every key in retired/ by fingerprint"""
+        active = RSAKeyEntry(self.private_key)
+        keys = {active.fingerprint: active}
+        if self.retired_dir.exists():
+            for path in sorted(self.retired_dir.glob('rsa_private_*.pem')):
+                try:
+                    with open(path, 'rb') as f:
+                        entry = RSAKeyEntry(RSA.import_key(f.read()), retired=True)
+                    keys.setdefault(entry.fingerprint, entry)
+                except Exception as e:
+                    logger.error(f"Skipping unreadable retired key {path.name}: {e}")
+        self.keys = keys
+        self.active_fingerprint = active.fingerprint
+        self._last_reload = time.monotonic()
+        metrics.set_gauge('rsa_keys_loaded', len(keys))
+    
+    def rotate_keys(self):
+        """
+        Generate a new active key pair. The current private key moves to
+        retired/, so devices still using the old public key keep working.
+        
+        Returns:
+            Fingerprint of the new active key
+        """
+        self.retired_dir.mkdir(parents=True, exist_ok=True)
+        old_fingerprint = self.active_fingerprint
+        retired_path = self.retired_dir / f'rsa_private_{old_fingerprint}.pem'
+        with open(retired_path, 'wb') as f:
+            f.write(self.private_key.export_key('PEM'))
+        try:
+            os.chmod(retired_path, 0o600)
+        except Exception:
+            pass  # Skip on Windows
+        
+        self.generate_keys()
+        logger.info(f"Rotated RSA key {old_fingerprint} -> {self.active_fingerprint}")
+        return self.active_fingerprint
+    
+    def remove_retired_key(self, fingerprint):
+        """Delete a retired private key - messages still encrypted for it will fail"""
+        if fingerprint == self.active_fingerprint:
+            raise ValueError("The active key can't be removed - rotate first")
+        path = self.retired_dir / f'rsa_private_{fingerprint}.pem'
+        if not path.exists():
+            raise ValueError(f"No retired key {fingerprint}")
+        path.unlink()
+        self.reload_keys()
+    
+    def reload_keys(self):
+        """Re-read the active and retired keys from disk (e.g. after a rotation by another process)"""
+        with self._reload_lock:
+            previous = self.active_fingerprint
+            self.load_keys()
+        if previous != self.active_fingerprint:
+            # Hybrid session keys unwrapped with the old key are still valid - keep them
+            logger.info(f"Reloaded RSA keys: active {previous} -> {self.active_fingerprint}, "
+                        f"{len(self.keys)} keys accepted")
+        metrics.increment('rsa_key_reloads')
+        return len(self.keys)
+    
+    def key_stats(self):
+        """[{fingerprint, active, decrypts}] - a retired key with no recent decrypts can be removed"""
+        return [{
+            'fingerprint': fingerprint,
+            'active': fingerprint == self.active_fingerprint,
+            'decrypts': metrics.get_counter('rsa_key_decrypts', key=fingerprint),
+        } for fingerprint in self.keys]
+    
+    def _private_op(self, data, fingerprint=None):
+        """
+        RSA-OAEP decrypt with the key the envelope names - one dict lookup.
+        Envelopes without a fingerprint (firmware from before rotation support)
+        try the active key, then the retired ones.
+        """
+        if fingerprint:
+            entry = self.keys.get(fingerprint)
+            if entry is None and time.monotonic() - self._last_reload >= self.reload_interval:
+                # Possibly rotated by another process since we loaded
+                self.reload_keys()
+                entry = self.keys.get(fingerprint)
+            if entry is None:
+                metrics.increment('rsa_key_decrypts', key='unknown')
+                raise ValueError(f"Unknown RSA key {fingerprint}")
+            result = entry.cipher.decrypt(data)
+            metrics.increment('rsa_key_decrypts', key=fingerprint)
+            return result
+        
+        active = self.keys.get(self.active_fingerprint)
+        candidates = [active] + [entry for entry in self.keys.values() if entry is not active]
+        for entry in candidates:
+            try:
+                result = entry.cipher.decrypt(data)
+            except ValueError:
+                continue
+            metrics.increment('rsa_key_decrypts', key=entry.fingerprint)
+            metrics.increment('rsa_unlabelled_envelopes')
+            return result
+        raise ValueError("Decryption failed with every loaded RSA key")
+    
     def get_public_key_pem(self):
         """
         Export public key as a string that can be copied to ESP32 firmware.
@@ -383,17 +664,17 @@ class RSAEncryption:
             logger.error(f"Error encrypting data: {e}")
             raise
     
-    def decrypt(self, encrypted_data):
+    def decrypt(self, encrypted_data, key_fingerprint=None):
         """
         Decrypt data that was encrypted with our public key.
-        Only works if we have the matching private key.
+        Only works if we have the matching private key (active or retired).
         """
         try:
             # First, decode the base64 text back to binary
             encrypted_bytes = base64.b64decode(encrypted_data)
             
-            # Use private key to decrypt the data
-            decrypted = self.cipher.decrypt(encrypted_bytes)
+            # Use the private key the sender encrypted for
+            decrypted = self._private_op(encrypted_bytes, key_fingerprint)
             
             # Convert decrypted bytes back to string
             decrypted_str = decrypted.decode('utf-8')
@@ -425,6 +706,7 @@ class RSAEncryption:
                 'encrypted': True,                    # Flag to indicate encryption
                 'encryption_type': 'RSA-OAEP',       # Algorithm used
                 'key_size': self.key_size,           # Key strength
+                'key_fingerprint': self.active_fingerprint,  # Which of our keys to use
                 'data': self.encrypt(payload)        # The actual encrypted data
             }
             
@@ -434,6 +716,78 @@ class RSAEncryption:
             logger.error(f"Error encrypting MQTT payload: {e}")
             return payload  # Return original payload on error
     
+    def new_session_key(self):
+        """
+        Create an AES-256 session key wrapped with our public key.
+        In real deployment, ESP32 does this once per boot (or key rotation).
+        
+        Returns:
+            {'key': raw key bytes, 'key_id': str, 'wrapped_key': base64 str}
+        """
+        key = get_random_bytes(32)
+        wrapped = PKCS1_OAEP.new(self.public_key).encrypt(key)
+        return {
+            'key': key,
+            'key_id': session_key_id(wrapped),
+            'wrapped_key': base64.b64encode(wrapped).decode('utf-8'),
+            'key_fingerprint': self.active_fingerprint,
+        }
+    
+    def encrypt_hybrid_payload(self, payload, session, include_key=True):
+        """
+        Wrap data (any size, e.g. a list of readings) in a hybrid envelope.
+        Devices include the wrapped key at least in the first message and
+        whenever the gateway may have forgotten it; it costs nothing to
+        decrypt once the key is cached.
+        """
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        nonce = get_random_bytes(12)
+        # The key id is authenticated, so a message can't be replayed under another key
+        ciphertext = AESGCM(session['key']).encrypt(nonce, payload.encode('utf-8'), session['key_id'].encode())
+        envelope = {
+            'encrypted': True,
+            'encryption_type': HYBRID_ENCRYPTION_TYPE,
+            'key_id': session['key_id'],
+            'nonce': base64.b64encode(nonce).decode('utf-8'),
+            'data': base64.b64encode(ciphertext).decode('utf-8'),
+        }
+        if include_key:
+            envelope['wrapped_key'] = session['wrapped_key']
+            if session.get('key_fingerprint'):
+                envelope['key_fingerprint'] = session['key_fingerprint']
+        return envelope
+    
+    def decrypt_hybrid(self, payload):
+        """
+        Decrypt a hybrid envelope. The RSA private-key operation only runs
+        for a key id that isn't cached yet; every other message is one
+        AES-GCM decryption.
+        """
+        key_id = payload.get('key_id', '')
+        aesgcm = self.session_keys.get(key_id)
+        
+        if aesgcm is None:
+            wrapped_b64 = payload.get('wrapped_key')
+            if not wrapped_b64:
+                raise ValueError(f"Unknown session key {key_id} - the device must resend wrapped_key")
+            wrapped = base64.b64decode(wrapped_b64)
+            if session_key_id(wrapped) != key_id:
+                raise ValueError(f"Session key id {key_id} does not match its wrapped key")
+            with metrics.timer('session_key_unwrap_ms'):
+                aesgcm = AESGCM(self._private_op(wrapped, payload.get('key_fingerprint')))
+            self.session_keys.put(key_id, aesgcm)
+        
+        plaintext = aesgcm.decrypt(
+            base64.b64decode(payload.get('nonce', '')),
+            base64.b64decode(payload.get('data', '')),
+            key_id.encode(),
+        ).decode('utf-8')
+        try:
+            return json.loads(plaintext)
+        except json.JSONDecodeError:
+            return plaintext
+    
     def decrypt_mqtt_payload(self, payload):
         """
         Unwrap and decrypt incoming MQTT messages from ESP32.
@@ -446,14 +800,18 @@ class RSAEncryption:
                 logger.debug("Payload is not encrypted, returning as-is")
                 return payload
             
-            # Make sure we support this encryption type
-            if payload.get('encryption_type') != 'RSA-OAEP':
-                logger.warning(f"Unsupported encryption type: {payload.get('encryption_type')}")
+            encryption_type = payload.get('encryption_type')
+            started = time.perf_counter()
+            if encryption_type == HYBRID_ENCRYPTION_TYPE:
+                decrypted_data = self.decrypt_hybrid(payload)
+            elif encryption_type == LEGACY_ENCRYPTION_TYPE:
+                # Legacy devices: the whole payload under RSA-OAEP
+                decrypted_data = self.decrypt(payload.get('data'), payload.get('key_fingerprint'))
+            else:
+                # Make sure we support this encryption type
+                logger.warning(f"Unsupported encryption type: {encryption_type}")
                 return payload
-            
-            # Extract encrypted data and decrypt it
-            encrypted_data = payload.get('data')
-            decrypted_data = self.decrypt(encrypted_data)
+            metrics.observe('mqtt_decrypt_ms', (time.perf_counter() - started) * 1000, scheme=encryption_type)
             
             return decrypted_data
         
@@ -463,6 +821,9 @@ class RSAEncryption:
             return payload
 
 
+# Shared privacy engine (one noise generator for the process)
+privacy_engine = PrivacyEngine()
+
 # Create a single RSA encryption instance that the whole app can use
 # If this fails (e.g., key generation error), set to None to allow app to run
 try:
@@ -0,0 +1,250 @@
+"""
+Data Retention for IoTShield
+Deletes expired sensor readings (per sensor type), system logs and
+fine-grained rollups in small timestamp-ordered chunks. Each chunk is its own
+short transaction followed by a pause, so the MQTT listener's inserts keep
+getting the SQLite write lock. Rows can be archived to gzipped JSONL first.
+"""
+import gzip
+import json
+import logging
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .rollups import MINUTE, RESOLUTIONS, bucket_start, rollup_model
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+# Stay under SQLite's bound-parameter limit in DELETE ... WHERE id IN (...)
+_MAX_PARAMS = 900
+
+
+def sensor_retention_days(sensor_type):
+    """Days a sensor type's readings are kept (None = forever)"""
+    policies = getattr(settings, 'RETENTION_POLICIES', {})
+    return policies.get(sensor_type, getattr(settings, 'RETENTION_DAYS', 30))
+
+
+def retention_cutoff(days, now=None):
+    """Rows before this are expired. Minute-aligned, so a rollup rebuild never sees a half-deleted minute."""
+    return bucket_start((now or timezone.now()) - timedelta(days=days), MINUTE)
+
+
+def _batches(ids):
+    for start in range(0, len(ids), _MAX_PARAMS):
+        yield ids[start:start + _MAX_PARAMS]
+
+
+def _delete_where_in(model, column, ids):
+    """
+    Plain DELETE ... WHERE column IN (...). QuerySet.delete() would run the
+    cascade collector, which loads every row of a model with reverse foreign
+    keys into memory first.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(column)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for batch in _batches(ids):
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(batch))})", batch)
+            deleted += cursor.rowcount
+    return deleted
+
+
+class _Archive:
+    """Gzipped JSONL files, one per table, opened on first write"""
+
+    def __init__(self, directory, stamp):
+        self.directory = Path(directory)
+        self.stamp = stamp
+        self._files = {}
+
+    def write(self, table, rows):
+        f = self._files.get(table)
+        if f is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"{table}-{self.stamp}.jsonl.gz"
+            f = self._files[table] = gzip.open(path, 'at', encoding='utf-8')
+        for row in rows:
+            f.write(json.dumps(row, default=str) + '\n')
+        # On disk before the rows are deleted (a crash in between archives them twice, never zero times)
+        f.flush()
+
+    @property
+    def paths(self):
+        return [f.name for f in self._files.values()]
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+
+class RetentionJob:
+    """
+    One retention run over readings, logs and rollups
+
+    Readings of each sensor type older than their policy (RETENTION_POLICIES,
+    default RETENTION_DAYS) are deleted together with their alerts. Their
+    rollups are kept: minute and hour rollups have retention of their own
+    (RETENTION_ROLLUP_DAYS), so long-range charts outlive the raw data.
+    """
+
+    def __init__(self, chunk_size=None, pause=None, archive_dir=None, dry_run=False, now=None):
+        self.chunk_size = chunk_size or getattr(settings, 'RETENTION_CHUNK_SIZE', 2000)
+        self.pause = getattr(settings, 'RETENTION_PAUSE', 0.05) if pause is None else pause
+        self.dry_run = dry_run
+        self.now = now or timezone.now()
+        archive_dir = archive_dir or getattr(settings, 'RETENTION_ARCHIVE_DIR', None)
+        self.archive = _Archive(archive_dir, self.now.strftime('%Y%m%dT%H%M%S')) if archive_dir else None
+
+    def run(self, sensor_types=None):
+        """
+        Purge everything that has expired
+
+        Args:
+            sensor_types: Only purge readings of these types (logs and rollups are skipped)
+
+        Returns:
+            List of per-table reports (see _purge)
+        """
+        from dashboard.models import SensorData
+
+        if sensor_types is None:
+            sensor_types = list(SensorData.objects.order_by().values_list('sensor_type', flat=True).distinct())
+            purge_rest = True
+        else:
+            purge_rest = False
+
+        reports = []
+        try:
+            for sensor_type in sorted(sensor_types):
+                days = sensor_retention_days(sensor_type)
+                if days is not None:
+                    reports.append(self.purge_readings(sensor_type, days))
+            if purge_rest:
+                days = getattr(settings, 'RETENTION_LOG_DAYS', 30)
+                if days is not None:
+                    reports.append(self.purge_logs(days))
+                for resolution in RESOLUTIONS:
+                    days = getattr(settings, 'RETENTION_ROLLUP_DAYS', {}).get(resolution.name)
+                    if days is not None:
+                        model = rollup_model(resolution)
+                        reports.append(self._purge(
+                            f'rollups_{resolution.name}',
+                            model.objects.filter(bucket__lt=retention_cutoff(days, self.now)), 'bucket',
+                            lambda ids, model=model: _delete_where_in(model, 'id', ids)))
+        finally:
+            self.close()
+        return reports
+
+    def close(self):
+        """Finish the archive files (run() does this itself)"""
+        if self.archive is not None:
+            self.archive.close()
+
+    def purge_readings(self, sensor_type, days):
+        """Delete one sensor type's expired readings and their alerts"""
+        from dashboard.models import Alert, SensorData
+
+        cutoff = retention_cutoff(days, self.now)
+
+        def delete(ids):
+            # Alerts cascade from their reading - delete them first, without the collector
+            alerts = _delete_where_in(Alert, 'sensor_data_id', ids)
+            if alerts:
+                metrics.increment('retention_rows_deleted', alerts, table='alerts')
+            return _delete_where_in(SensorData, 'id', ids)
+
+        report = self._purge(f'sensor_data[{sensor_type}]',
+                             SensorData.objects.filter(sensor_type=sensor_type, timestamp__lt=cutoff),
+                             'timestamp', delete, archive=self._archive_readings)
+        report['days'] = days
+        return report
+
+    def purge_logs(self, days):
+        """Delete system log entries older than `days`"""
+        from dashboard.models import SystemLog
+
+        report = self._purge('system_logs', SystemLog.objects.filter(timestamp__lt=retention_cutoff(days, self.now)),
+                             'timestamp', lambda ids: _delete_where_in(SystemLog, 'id', ids),
+                             archive=self._archive_logs)
+        report['days'] = days
+        return report
+
+    def _purge(self, table, queryset, time_field, delete, archive=None):
+        """
+        Delete queryset rows oldest first, chunk_size rows per transaction
+
+        Each chunk is picked through the time index (oldest first) and deleted
+        by primary key, so a transaction - and with it SQLite's write lock -
+        lasts only as long as one chunk's DELETEs.
+
+        Returns:
+            {table, deleted, chunks, seconds, rows_per_sec, lock_ms_max, lock_ms_p95}
+        """
+        report = {'table': table, 'deleted': 0, 'chunks': 0, 'seconds': 0.0,
+                  'rows_per_sec': 0.0, 'lock_ms_max': 0.0, 'lock_ms_p95': 0.0}
+        if self.dry_run:
+            report['deleted'] = queryset.count()
+            return report
+
+        started = time.perf_counter()
+        lock_ms = []
+        while True:
+            ids = list(queryset.order_by(time_field).values_list('id', flat=True)[:self.chunk_size])
+            if not ids:
+                break
+            if archive is not None and self.archive is not None:
+                archive(ids)
+
+            locked = time.perf_counter()
+            with transaction.atomic():
+                deleted = delete(ids)
+            lock_ms.append((time.perf_counter() - locked) * 1000)
+            metrics.observe('retention_lock_ms', lock_ms[-1], table=table)
+            metrics.increment('retention_rows_deleted', deleted, table=table)
+
+            report['deleted'] += deleted
+            report['chunks'] += 1
+            if len(ids) < self.chunk_size:
+                break
+            # Let the listener's queued writes in before taking the lock again
+            time.sleep(self.pause)
+
+        report['seconds'] = time.perf_counter() - started
+        if report['seconds'] > 0:
+            report['rows_per_sec'] = report['deleted'] / report['seconds']
+        if lock_ms:
+            lock_ms.sort()
+            report['lock_ms_max'] = lock_ms[-1]
+            report['lock_ms_p95'] = lock_ms[min(len(lock_ms) - 1, int(len(lock_ms) * 0.95))]
+        if report['deleted']:
+            logger.info(f"Retention: deleted {report['deleted']} rows from {table} in {report['chunks']} chunks "
+                        f"({report['rows_per_sec']:,.0f} rows/s, max lock {report['lock_ms_max']:.1f}ms)")
+        return report
+
+    # ---- archiving ---------------------------------------------------------
+
+    def _archive_readings(self, ids):
+        from dashboard.models import Alert, SensorData
+
+        for batch in _batches(ids):
+            self.archive.write('sensor_data', SensorData.objects.filter(id__in=batch).values(
+                'id', 'device__device_id', 'sensor_type', 'value', 'unit', 'is_anomaly', 'anomaly_score',
+                'timestamp'))
+            self.archive.write('alerts', Alert.objects.filter(sensor_data_id__in=batch).values(
+                'id', 'sensor_data_id', 'title', 'description', 'ai_suggestion', 'severity', 'status',
+                'occurrence_count', 'last_occurrence_at', 'created_at'))
+
+    def _archive_logs(self, ids):
+        from dashboard.models import SystemLog
+
+        for batch in _batches(ids):
+            self.archive.write('system_logs', SystemLog.objects.filter(id__in=batch).values(
+                'id', 'level', 'module', 'message', 'details', 'timestamp'))
@@ -0,0 +1,446 @@
+"""
+Multi-Resolution Rollups for IoTShield
+Per-(device, sensor type) count / sum / min / max / sum of squares / anomaly
+count at 1-minute, 1-hour and 1-day resolution. The MQTT listener folds each
+reading into all three in memory and writes them as increments every few
+seconds; charts and summary statistics read the coarsest tables that answer
+the query instead of scanning raw SensorData rows.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db_writer import db_writer
+from .utils.metrics import metrics
+
+logger = logging.getLogger('iotshield')
+
+Resolution = namedtuple('Resolution', 'name seconds model trunc')
+
+MINUTE = Resolution('1m', 60, 'SensorRollupMinute', 'minute')
+HOUR = Resolution('1h', 3600, 'SensorRollupHour', 'hour')
+DAY = Resolution('1d', 86400, 'SensorRollupDay', 'day')
+# Finest first
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+RESOLUTIONS_BY_NAME = {resolution.name: resolution for resolution in RESOLUTIONS}
+
+# Stand-in resolution for the SensorData table itself
+RAW = 'raw'
+
+# Per-bucket statistics of series() points that are exact; differentially private
+# releases leave them out and only publish the noisy mean
+EXACT_FIELDS = ('min_value', 'max_value', 'stddev', 'count', 'anomalies')
+
+
+def rollup_model(resolution):
+    from django.apps import apps
+    return apps.get_model('dashboard', resolution.model)
+
+
+def bucket_start(ts, resolution):
+    """Start of the (UTC-aligned) bucket containing ts"""
+    seconds = int(ts.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % resolution.seconds, tz=dt_timezone.utc)
+
+
+def bucket_ceil(ts, resolution):
+    """ts if it is a bucket boundary, otherwise the start of the next bucket"""
+    start = bucket_start(ts, resolution)
+    return start if start == ts else start + timedelta(seconds=resolution.seconds)
+
+
+class _Bucket:
+    """Running aggregates of one bucket (mergeable, so partial buckets add up)"""
+    __slots__ = ('readings', 'total', 'sum_squares', 'min_value', 'max_value', 'anomalies')
+
+    def __init__(self):
+        self.readings = 0
+        self.total = 0.0
+        self.sum_squares = 0.0
+        self.min_value = None
+        self.max_value = None
+        self.anomalies = 0
+
+    def add(self, value, anomaly):
+        self.merge(1, value, value * value, value, value, int(anomaly))
+
+    def merge(self, readings, total, sum_squares, min_value, max_value, anomalies):
+        if not readings:
+            return
+        self.readings += readings
+        self.total += total or 0.0
+        self.sum_squares += sum_squares or 0.0
+        self.min_value = min_value if self.min_value is None else min(self.min_value, min_value)
+        self.max_value = max_value if self.max_value is None else max(self.max_value, max_value)
+        self.anomalies += anomalies or 0
+
+    @property
+    def mean(self):
+        return self.total / self.readings if self.readings else None
+
+    @property
+    def stddev(self):
+        if not self.readings:
+            return None
+        return math.sqrt(max(self.sum_squares / self.readings - self.mean ** 2, 0.0))
+
+
+class RollupWriter:
+    """
+    Folds readings into 1m/1h/1d buckets in memory and writes them as increments.
+
+    record() is an O(1) dictionary update on the ingest path. Every
+    ROLLUP_FLUSH_INTERVAL seconds the pending buckets are written in one
+    transaction - counts and sums as increments, min/max merged - so a bucket
+    touched by several flushes (or several listeners) stays correct.
+    """
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or getattr(settings, 'ROLLUP_FLUSH_INTERVAL', 10)
+        # (resolution, device pk, sensor_type, bucket) -> _Bucket
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, sensor_data):
+        """Add one stored reading (with its final is_anomaly flag) to every resolution"""
+        ts = sensor_data.timestamp
+        if timezone.is_naive(ts):
+            # Stored the same way: naive device timestamps are in TIME_ZONE
+            ts = timezone.make_aware(ts)
+        value = float(sensor_data.value)
+        with self._lock:
+            for resolution in RESOLUTIONS:
+                key = (resolution, sensor_data.device_id, sensor_data.sensor_type, bucket_start(ts, resolution))
+                bucket = self._pending.get(key)
+                if bucket is None:
+                    bucket = self._pending[key] = _Bucket()
+                bucket.add(value, sensor_data.is_anomaly)
+        self._ensure_flusher()
+
+    def flush(self):
+        """Write all pending buckets in one transaction; returns the number of buckets written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            with metrics.timer('rollup_flush_ms'):
+                db_writer.call(self._write, pending)
+        except Exception as e:
+            # Put the buckets back (merging with anything recorded since) and retry next time
+            logger.error(f"Failed to write {len(pending)} rollup buckets: {e}")
+            with self._lock:
+                for key, bucket in pending.items():
+                    current = self._pending.get(key)
+                    if current is None:
+                        self._pending[key] = bucket
+                    else:
+                        current.merge(bucket.readings, bucket.total, bucket.sum_squares,
+                                      bucket.min_value, bucket.max_value, bucket.anomalies)
+            return 0
+
+        metrics.increment('rollup_buckets_written', len(pending))
+        return len(pending)
+
+    @staticmethod
+    def _write(pending):
+        from django.db import transaction
+        from django.db.models import F, Value
+        from django.db.models.functions import Greatest, Least
+
+        with transaction.atomic():
+            for (resolution, device_id, sensor_type, start), bucket in pending.items():
+                model = rollup_model(resolution)
+                updated = model.objects.filter(device_id=device_id, sensor_type=sensor_type, bucket=start).update(
+                    readings=F('readings') + bucket.readings,
+                    total=F('total') + bucket.total,
+                    sum_squares=F('sum_squares') + bucket.sum_squares,
+                    min_value=Least(F('min_value'), Value(bucket.min_value)),
+                    max_value=Greatest(F('max_value'), Value(bucket.max_value)),
+                    anomalies=F('anomalies') + bucket.anomalies,
+                )
+                if not updated:
+                    model.objects.create(device_id=device_id, sensor_type=sensor_type, bucket=start,
+                                         readings=bucket.readings, total=bucket.total,
+                                         sum_squares=bucket.sum_squares, min_value=bucket.min_value,
+                                         max_value=bucket.max_value, anomalies=bucket.anomalies)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='rollups', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+# ---- query planning ------------------------------------------------------
+
+def settled_until(now=None):
+    """
+    Rollups are complete for readings before this time. Newer readings may
+    still sit in the listener's buffer, so they are read from SensorData.
+    """
+    now = now or timezone.now()
+    return bucket_start(now - timedelta(seconds=getattr(settings, 'ROLLUP_SETTLE_SECONDS', 60)), MINUTE)
+
+
+def choose_resolution(span, points):
+    """
+    Resolution for a chart over `span` (timedelta): raw readings for short
+    ranges (ROLLUP_RAW_MAX_HOURS), otherwise the finest rollup that keeps
+    each series within `points` buckets
+    """
+    if span <= timedelta(hours=getattr(settings, 'ROLLUP_RAW_MAX_HOURS', 1)):
+        return RAW
+    for resolution in RESOLUTIONS:
+        if span.total_seconds() / resolution.seconds <= points:
+            return resolution
+    return DAY
+
+
+def plan(start, end, now=None):
+    """
+    Cover [start, end) with as few rows as possible: whole days from the day
+    table, the hours and minutes left over at either end from the finer
+    tables, and partial minutes plus anything not yet settled from SensorData
+
+    Returns:
+        [(resolution or RAW, lo, hi)] - disjoint and together exactly [start, end)
+    """
+    settled = max(start, min(end, settled_until(now)))
+    pieces = _cover(start, settled, RESOLUTIONS[::-1])
+    if end > settled:
+        pieces.append((RAW, settled, end))
+    return pieces
+
+
+def _cover(start, end, levels):
+    if start >= end:
+        return []
+    if not levels:
+        return [(RAW, start, end)]
+    level, finer = levels[0], levels[1:]
+    lo, hi = bucket_ceil(start, level), bucket_start(end, level)
+    if lo >= hi:
+        return _cover(start, end, finer)
+    return _cover(start, lo, finer) + [(level, lo, hi)] + _cover(hi, end, finer)
+
+
+def _aggregate(source, ranges, sensor_types=None, device_id=None, per_bucket=None):
+    """
+    One GROUP BY query over `ranges` of SensorData (source=RAW) or a rollup table
+
+    Returns:
+        Dict of (sensor_type, device pk, bucket) -> _Bucket; device and bucket
+        are None unless `per_bucket` (a resolution to group into) is given
+    """
+    from django.db.models import Count, F, Max, Min, Q, Sum
+    from django.db.models.functions import Trunc
+    from dashboard.models import SensorData
+
+    if source == RAW:
+        model, time_field = SensorData, 'timestamp'
+        measures = dict(n=Count('id'), s=Sum('value'), sq=Sum(F('value') * F('value')),
+                        lo=Min('value'), hi=Max('value'), an=Count('id', filter=Q(is_anomaly=True)))
+    else:
+        model, time_field = rollup_model(source), 'bucket'
+        measures = dict(n=Sum('readings'), s=Sum('total'), sq=Sum('sum_squares'),
+                        lo=Min('min_value'), hi=Max('max_value'), an=Sum('anomalies'))
+
+    span = Q()
+    for lo, hi in ranges:
+        span |= Q(**{f'{time_field}__gte': lo, f'{time_field}__lt': hi})
+    queryset = model.objects.filter(span)
+    if sensor_types:
+        queryset = queryset.filter(sensor_type__in=sensor_types)
+    if device_id:
+        queryset = queryset.filter(device__device_id=device_id)
+
+    group = ['sensor_type']
+    if per_bucket is not None:
+        slot = F(time_field) if source == per_bucket else Trunc(time_field, per_bucket.trunc, tzinfo=dt_timezone.utc)
+        queryset = queryset.annotate(slot=slot)
+        group += ['device_id', 'slot']
+
+    buckets = {}
+    with metrics.timer('rollup_query_ms', source=getattr(source, 'name', RAW)):
+        # order_by() clears the default ordering so it doesn't leak into GROUP BY
+        for row in queryset.order_by().values(*group).annotate(**measures):
+            key = (row['sensor_type'], row.get('device_id'), row.get('slot'))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = _Bucket()
+            bucket.merge(row['n'], row['s'], row['sq'], row['lo'], row['hi'], row['an'])
+    return buckets
+
+
+# ---- queries -------------------------------------------------------------
+
+def summarize(start, end, sensor_types=None, device_id=None, now=None):
+    """
+    Exact per-sensor-type statistics over [start, end) from at most one query
+    per table (see plan())
+
+    Returns:
+        Dict of sensor_type -> {count, anomalies, avg_value, min_value, max_value, stddev}
+    """
+    pieces = plan(start, end, now)
+    totals = {}
+    for source in (RAW,) + RESOLUTIONS:
+        ranges = [(lo, hi) for resolution, lo, hi in pieces if resolution == source]
+        if not ranges:
+            continue
+        for (sensor_type, _, _), part in _aggregate(source, ranges, sensor_types, device_id).items():
+            bucket = totals.setdefault(sensor_type, _Bucket())
+            bucket.merge(part.readings, part.total, part.sum_squares, part.min_value, part.max_value, part.anomalies)
+
+    return {
+        sensor_type: {
+            'count': bucket.readings,
+            'anomalies': bucket.anomalies,
+            'avg_value': bucket.mean,
+            'min_value': bucket.min_value,
+            'max_value': bucket.max_value,
+            'stddev': bucket.stddev,
+        }
+        for sensor_type, bucket in totals.items() if bucket.readings
+    }
+
+
+def series(start, end, resolution, sensor_types=None, device_id=None, now=None):
+    """
+    Chart points at `resolution` from the bucket containing start up to end,
+    one per (device, sensor type, bucket), oldest first. Whole settled
+    buckets come straight from the rollup table; the newest, still-filling
+    bucket is assembled from finer rollups and raw readings.
+    """
+    from dashboard.models import Device
+
+    cut = max(bucket_start(start, resolution), bucket_start(min(end, settled_until(now)), resolution))
+    buckets = _aggregate(resolution, [(bucket_start(start, resolution), cut)], sensor_types, device_id,
+                         per_bucket=resolution)
+    tail = plan(cut, end, now)
+    for source in (RAW,) + RESOLUTIONS:
+        ranges = [(lo, hi) for piece, lo, hi in tail if piece == source]
+        if not ranges:
+            continue
+        for key, part in _aggregate(source, ranges, sensor_types, device_id, per_bucket=resolution).items():
+            bucket = buckets.setdefault(key, _Bucket())
+            bucket.merge(part.readings, part.total, part.sum_squares, part.min_value, part.max_value, part.anomalies)
+    metrics.increment('rollup_series', resolution=resolution.name)
+
+    device_ids = dict(Device.objects.filter(pk__in={key[1] for key in buckets}).values_list('pk', 'device_id'))
+    return [
+        {
+            'timestamp': slot.isoformat(),
+            'sensor_type': sensor_type,
+            'device_id': device_ids.get(device_pk),
+            'value': bucket.mean,
+            'min_value': bucket.min_value,
+            'max_value': bucket.max_value,
+            'stddev': bucket.stddev,
+            'count': bucket.readings,
+            'anomalies': bucket.anomalies,
+            'is_anomaly': bucket.anomalies > 0,
+        }
+        for (sensor_type, device_pk, slot), bucket in sorted(buckets.items(), key=lambda item: item[0][2])
+    ]
+
+
+# ---- compaction ------------------------------------------------------------
+
+def rebuild(start, end, now=None):
+    """
+    Recompute the rollups for [start, end) from SensorData, one day per
+    transaction: minutes from the raw readings, hours from minutes and days
+    from hours. Use it to backfill, or after readings were re-scored.
+
+    Rollups outlive their readings, and each level is purged on its own
+    schedule (see retention), so every level is rewritten per stream from
+    the oldest source row left in the range on (see _replace). History
+    whose readings or minute rollups were already deleted survives a
+    rebuild. Ranges after settled_until() are left to the listener.
+
+    Returns:
+        Number of raw readings folded into the minute rollups
+    """
+    from django.db import transaction
+
+    end = min(end, settled_until(now))
+    lo = bucket_ceil(start, MINUTE)
+    folded = 0
+    while lo < end:
+        hi = min(bucket_start(lo, DAY) + timedelta(days=1), end)
+        with transaction.atomic():
+            folded += _replace(MINUTE, RAW, lo, hi)
+            _replace(HOUR, MINUTE, bucket_start(lo, HOUR), bucket_ceil(hi, HOUR))
+            _replace(DAY, HOUR, bucket_start(lo, DAY), bucket_ceil(hi, DAY))
+        lo = hi
+    return folded
+
+
+def _oldest(source, start, end):
+    """(sensor_type, device pk) -> oldest reading time or source bucket in [start, end)"""
+    from django.db.models import Min
+    from dashboard.models import SensorData
+
+    if source == RAW:
+        model, time_field = SensorData, 'timestamp'
+    else:
+        model, time_field = rollup_model(source), 'bucket'
+    rows = model.objects.filter(**{f'{time_field}__gte': start, f'{time_field}__lt': end}).order_by().values(
+        'sensor_type', 'device_id').annotate(first=Min(time_field))
+    return {(row['sensor_type'], row['device_id']): row['first'] for row in rows}
+
+
+def _replace(target, source, start, end):
+    """
+    Rewrite the target-resolution buckets in [start, end) from the finer source.
+
+    Retention deletes each level oldest first at minute-aligned cutoffs, so a
+    stream's source is complete from (the minute of) its oldest remaining row
+    on. Target buckets before that are kept. The bucket that row falls in is
+    kept too if it already counts more readings than the source still holds.
+    Streams with no source rows in the range are not touched.
+    """
+    model = rollup_model(target)
+    buckets = _aggregate(source, [(start, end)], per_bucket=target)
+    for (sensor_type, device_pk), first in _oldest(source, start, end).items():
+        complete = bucket_start(first, MINUTE) if source == RAW else first
+        stream = model.objects.filter(device_id=device_pk, sensor_type=sensor_type)
+        slot = bucket_start(complete, target)
+        if slot < complete:
+            key = (sensor_type, device_pk, slot)
+            held = stream.filter(bucket=slot).values_list('readings', flat=True).first()
+            rebuilt = buckets.get(key)
+            if held is not None and held > (rebuilt.readings if rebuilt else 0):
+                buckets.pop(key, None)
+                slot = bucket_ceil(complete, target)
+        stream.filter(bucket__gte=slot, bucket__lt=end).delete()
+    model.objects.bulk_create([
+        model(device_id=device_pk, sensor_type=sensor_type, bucket=slot, readings=bucket.readings,
+              total=bucket.total, sum_squares=bucket.sum_squares, min_value=bucket.min_value,
+              max_value=bucket.max_value, anomalies=bucket.anomalies)
+        for (sensor_type, device_pk, slot), bucket in buckets.items()
+    ], batch_size=500)
+    return sum(bucket.readings for bucket in buckets.values())
+
+
+# Global writer (fed by the MQTT listener)
+rollup_writer = RollupWriter()
@@ -0,0 +1,122 @@
+"""
+Rule-Based Severity Bands for IoTShield
+Numeric version of the normal ranges described in the Ollama analysis prompt,
+so the backend can classify a reading without calling the LLM
+"""
+
+# Severity levels ordered from least to most severe
+SEVERITY_ORDER = {'LOW': 1, 'MEDIUM': 2, 'HIGH': 3, 'CRITICAL': 4}
+
+# Per-sensor bands. 'normal' is the (min, max) normal range.
+# 'high' thresholds trigger when the value rises ABOVE them, 'low' thresholds
+# when it falls BELOW them. Each list is ordered from LOW to CRITICAL.
+SENSOR_RULES = {
+    'TEMPERATURE': {
+        'normal': (18.0, 28.0),
+        'high': [(28.0, 'LOW'), (35.0, 'MEDIUM'), (42.0, 'HIGH'), (50.0, 'CRITICAL')],
+        'low': [(18.0, 'LOW'), (10.0, 'MEDIUM'), (5.0, 'HIGH'), (0.0, 'CRITICAL')],
+    },
+    'HUMIDITY': {
+        'normal': (30.0, 60.0),
+        'high': [(60.0, 'LOW'), (70.0, 'MEDIUM'), (80.0, 'HIGH'), (90.0, 'CRITICAL')],
+        'low': [(30.0, 'LOW'), (20.0, 'MEDIUM'), (15.0, 'HIGH'), (10.0, 'CRITICAL')],
+    },
+    'GAS': {
+        'normal': (0.0, 0.35),
+        'high': [(0.35, 'LOW'), (0.50, 'MEDIUM'), (0.65, 'HIGH'), (0.75, 'CRITICAL')],
+        'low': [],
+    },
+    'FLAME': {
+        'normal': (0.0, 0.15),
+        'high': [(0.15, 'LOW'), (0.35, 'MEDIUM'), (0.55, 'HIGH'), (0.70, 'CRITICAL')],
+        'low': [],
+    },
+    'MOTION': {
+        'normal': (0.0, 0.4),
+        'high': [(0.4, 'LOW'), (0.6, 'MEDIUM'), (0.75, 'HIGH'), (0.90, 'CRITICAL')],
+        'low': [],
+    },
+    'LIGHT': {
+        'normal': (100.0, 600.0),
+        'high': [(600.0, 'LOW'), (800.0, 'MEDIUM'), (900.0, 'HIGH')],
+        'low': [(100.0, 'LOW'), (50.0, 'MEDIUM'), (20.0, 'HIGH')],
+    },
+    'CPU_TEMPERATURE': {
+        'normal': (30.0, 65.0),
+        'high': [(65.0, 'LOW'), (75.0, 'MEDIUM'), (85.0, 'HIGH'), (95.0, 'CRITICAL')],
+        'low': [],
+    },
+    'MEMORY_USAGE': {
+        'normal': (0.0, 70.0),
+        'high': [(70.0, 'LOW'), (80.0, 'MEDIUM'), (90.0, 'HIGH'), (95.0, 'CRITICAL')],
+        'low': [],
+    },
+    'DISK_USAGE': {
+        'normal': (0.0, 70.0),
+        'high': [(70.0, 'LOW'), (80.0, 'MEDIUM'), (90.0, 'HIGH'), (95.0, 'CRITICAL')],
+        'low': [],
+    },
+}
+
+
+def classify_severity(sensor_type, value):
+    """
+    Classify a reading using the rule bands
+
+    Args:
+        sensor_type: Sensor type (e.g. 'GAS')
+        value: Sensor reading
+
+    Returns:
+        Severity string, or None if the reading is normal or the type is unknown
+    """
+    rules = SENSOR_RULES.get(sensor_type)
+    if rules is None:
+        return None
+
+    value = float(value)
+    severity = None
+
+    # Thresholds are ordered, so the last one crossed is the most severe
+    for threshold, level in rules['high']:
+        if value > threshold:
+            severity = level
+    for threshold, level in rules['low']:
+        if value < threshold:
+            if severity is None or SEVERITY_ORDER[level] > SEVERITY_ORDER[severity]:
+                severity = level
+
+    return severity
+
+
+def is_within_band(sensor_type, value, margin=0.0):
+    """
+    Check whether a reading is inside the normal band shrunk by a margin
+
+    Args:
+        sensor_type: Sensor type
+        value: Sensor reading
+        margin: Fraction of the band width to trim from each side (0.1 = 10%)
+
+    Returns:
+        True if the reading is inside the (shrunk) normal band
+    """
+    rules = SENSOR_RULES.get(sensor_type)
+    if rules is None:
+        return True
+
+    low, high = rules['normal']
+    trim = (high - low) * margin
+
+    # Only trim the sides that actually have alert thresholds
+    if rules['low']:
+        low += trim
+    if rules['high']:
+        high -= trim
+
+    return low <= float(value) <= high
+
+
+def severity_rank(severity):
+    """Numeric rank of a severity level (0 for None/unknown)"""
+    return SEVERITY_ORDER.get(severity, 0)
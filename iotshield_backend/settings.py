@@ -3,6 +3,7 @@ Django settings for IoTShield project.
 """
 
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -46,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'iotshield_backend.sqlite_profile.DashboardReadMiddleware',
 ]
 
 ROOT_URLCONF = 'iotshield_backend.urls'
@@ -77,6 +79,33 @@ DATABASES = {
     }
 }
 
+# SQLite Production Profile - every connection gets WAL journaling, synchronous=NORMAL,
+# a busy timeout and bigger page/mmap caches (see iotshield_backend/sqlite_profile.py)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # FULL survives power loss, NORMAL is enough with WAL
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes, 0 = off
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))  # page cache per connection
+# Dashboard GET requests read through a query_only connection so they never hold the write lock
+SQLITE_READONLY_DASHBOARD = os.getenv('SQLITE_READONLY_DASHBOARD', 'True') == 'True'
+# The MQTT listener sends all its writes through one thread that group-commits them
+DB_SINGLE_WRITER = os.getenv('DB_SINGLE_WRITER', 'True') == 'True'
+DB_WRITER_MAX_BATCH = int(os.getenv('DB_WRITER_MAX_BATCH', 200))  # jobs per commit
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Take the write lock when a transaction starts: a deferred transaction that reads first
+    # and then writes gets "database is locked" immediately instead of waiting its turn
+    DATABASES['default']['OPTIONS'] = {
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+    }
+    if SQLITE_READONLY_DASHBOARD:
+        DATABASES['readonly'] = {
+            **DATABASES['default'],
+            'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_ROUTERS = ['iotshield_backend.sqlite_profile.DashboardReadRouter']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -148,15 +177,161 @@ MQTT_TOPIC_LOGS = os.getenv('MQTT_TOPIC_LOGS', 'iotshield/logs')
 # Ollama Configuration (Local LLM)
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.2:1b')
+# Constrained decoding: 'schema' (response JSON schema, Ollama >= 0.5), 'json' (any JSON) or 'off'
+OLLAMA_STRUCTURED_OUTPUT = os.getenv('OLLAMA_STRUCTURED_OUTPUT', 'schema')
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # how long Ollama keeps the model loaded between requests
+LLM_PARSE_RETRIES = int(os.getenv('LLM_PARSE_RETRIES', 1))  # regenerations after an unrepairable response
+# Append raw responses here (JSONL) to build a corpus for: python manage.py benchmark_llm_parser
+LLM_RESPONSE_LOG_PATH = os.getenv('LLM_RESPONSE_LOG_PATH') or None
+
+# Ollama Endpoint Pool - comma-separated hosts to spread LLM requests over (defaults to OLLAMA_HOST)
+OLLAMA_HOSTS = [h.strip() for h in os.getenv('OLLAMA_HOSTS', OLLAMA_HOST).split(',') if h.strip()]
+OLLAMA_BALANCE_STRATEGY = os.getenv('OLLAMA_BALANCE_STRATEGY', 'latency')  # 'latency' or 'least_inflight'
+OLLAMA_HEALTH_CHECK_INTERVAL = int(os.getenv('OLLAMA_HEALTH_CHECK_INTERVAL', 15))  # seconds, 0 = passive only
+OLLAMA_EJECT_FAILURES = int(os.getenv('OLLAMA_EJECT_FAILURES', 3))  # consecutive errors before ejecting a host
+OLLAMA_EJECT_SECONDS = int(os.getenv('OLLAMA_EJECT_SECONDS', 30))  # doubles on repeat ejections (max 10x)
+OLLAMA_SLOW_FACTOR = float(os.getenv('OLLAMA_SLOW_FACTOR', 3.0))  # eject hosts this much slower than their peers
+
+# Adaptive Ollama Concurrency (AIMD, per host) - the limit grows while latency stays
+# under target and is cut by 30% when a request is slower than target or fails
+OLLAMA_TARGET_LATENCY_MS = int(os.getenv('OLLAMA_TARGET_LATENCY_MS', 8000))
+OLLAMA_INITIAL_CONCURRENCY = int(os.getenv('OLLAMA_INITIAL_CONCURRENCY', 2))
+OLLAMA_MIN_CONCURRENCY = int(os.getenv('OLLAMA_MIN_CONCURRENCY', 1))
+OLLAMA_MAX_CONCURRENCY = int(os.getenv('OLLAMA_MAX_CONCURRENCY', 8))
+OLLAMA_ACQUIRE_TIMEOUT = int(os.getenv('OLLAMA_ACQUIRE_TIMEOUT', 60))  # seconds to wait for a free slot
+
+# LLM Call Telemetry - per-call tokens/durations, bulk-written to LLMCallRecord
+LLM_TELEMETRY_ENABLED = os.getenv('LLM_TELEMETRY_ENABLED', 'True') == 'True'
+LLM_TELEMETRY_BATCH_SIZE = int(os.getenv('LLM_TELEMETRY_BATCH_SIZE', 50))
+LLM_TELEMETRY_FLUSH_INTERVAL = int(os.getenv('LLM_TELEMETRY_FLUSH_INTERVAL', 10))  # seconds
+
+# Anomaly Detector Routing - tiers run in order, each only if the previous one flagged the reading
+# 'rules' = fixed severity bands, 'seasonal' = hour-of-week baseline, 'stats' = per-sensor z-score, 'llm' = Ollama
+# Override per sensor type with a JSON env var, e.g. ANOMALY_DETECTOR_ROUTES='{"LIGHT": ["rules"]}'
+ANOMALY_DETECTOR_ROUTES = {
+    'default': ['rules', 'llm'],
+    'GAS': ['rules', 'llm'],
+    'FLAME': ['rules', 'llm'],
+    'TEMPERATURE': ['rules', 'llm'],
+    'HUMIDITY': ['rules', 'stats', 'llm'],
+    'MOTION': ['rules', 'seasonal', 'stats'],
+    'LIGHT': ['rules', 'seasonal', 'stats'],
+    'CPU_TEMPERATURE': ['rules'],
+    'MEMORY_USAGE': ['rules'],
+    'DISK_USAGE': ['rules'],
+}
+ANOMALY_DETECTOR_ROUTES.update(json.loads(os.getenv('ANOMALY_DETECTOR_ROUTES', '{}')))
+STATS_DETECTOR_Z_THRESHOLD = float(os.getenv('STATS_DETECTOR_Z_THRESHOLD', 3.0))
+STATS_DETECTOR_MIN_SAMPLES = int(os.getenv('STATS_DETECTOR_MIN_SAMPLES', 30))
+
+# Seasonal Baselines - recompute periodically with: python manage.py compute_baselines
+BASELINE_LOOKBACK_DAYS = int(os.getenv('BASELINE_LOOKBACK_DAYS', 28))
+BASELINE_MIN_SAMPLES = int(os.getenv('BASELINE_MIN_SAMPLES', 5))  # per hour-of-week slot
+BASELINE_MARGIN = float(os.getenv('BASELINE_MARGIN', 0.1))  # fraction of the p05-p95 spread
+BASELINE_RELOAD_INTERVAL = int(os.getenv('BASELINE_RELOAD_INTERVAL', 3600))  # seconds
+
+# Listener Warm-up - caches are prefilled before connecting, and LLM jobs are held
+# until the model is loaded on every Ollama host (readings use the fast path meanwhile)
+LISTENER_WARMUP_LLM = os.getenv('LISTENER_WARMUP_LLM', 'True') == 'True'
+DEVICE_CACHE_TTL = int(os.getenv('DEVICE_CACHE_TTL', 300))  # seconds before a cached device is re-read
+
+# Sensor Rollups - 1m/1h/1d aggregates kept by the listener; backfill or repair with
+# python manage.py compact_rollups
+ROLLUP_FLUSH_INTERVAL = int(os.getenv('ROLLUP_FLUSH_INTERVAL', 10))  # seconds between rollup writes
+ROLLUP_SETTLE_SECONDS = int(os.getenv('ROLLUP_SETTLE_SECONDS', 60))  # newer readings are read raw
+ROLLUP_MAX_POINTS = int(os.getenv('ROLLUP_MAX_POINTS', 1500))  # default chart points per series
+ROLLUP_RAW_MAX_HOURS = int(os.getenv('ROLLUP_RAW_MAX_HOURS', 1))  # shorter charts show every reading
+
+# Data Retention - run periodically (e.g. nightly from cron) with: python manage.py apply_retention
+# Readings are deleted in chunks with a pause in between so the listener keeps writing
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))  # readings of sensor types without a policy
+# Per sensor type days, null = keep forever, e.g. RETENTION_POLICIES='{"MOTION": 7, "GAS": 365}'
+RETENTION_POLICIES = json.loads(os.getenv('RETENTION_POLICIES', '{}'))
+RETENTION_LOG_DAYS = int(os.getenv('RETENTION_LOG_DAYS', 30))
+# Rollups outlive the readings; None = keep forever
+RETENTION_ROLLUP_DAYS = {
+    '1m': int(os.getenv('RETENTION_ROLLUP_MINUTE_DAYS', 90)),
+    '1h': int(os.getenv('RETENTION_ROLLUP_HOUR_DAYS', 730)),
+    '1d': None,
+}
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 2000))  # rows deleted per transaction
+RETENTION_PAUSE = float(os.getenv('RETENTION_PAUSE', 0.05))  # seconds between chunks
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '') or None  # gzipped JSONL of deleted rows
+
+# Metrics snapshot written by the MQTT listener so the web API can serve it
+METRICS_SNAPSHOT_PATH = BASE_DIR / os.getenv('METRICS_SNAPSHOT_PATH', 'metrics_snapshot.json')
+
+# Lazy LLM Explanations - alerts are raised by the fast detectors and explained afterwards
+LLM_EXPLANATION_EAGER_SEVERITIES = ['HIGH', 'CRITICAL']  # explained immediately, others on demand
+# GENERATING alerts claimed longer ago than this (seconds) go back to PENDING
+LLM_EXPLANATION_STALE_AFTER = int(os.getenv('LLM_EXPLANATION_STALE_AFTER', 300))
+
+# Explanation Reuse - alerts close to an already explained one (same sensor type and severity,
+# value within this fraction of the normal band at a similar hour) reuse its explanation
+LLM_REUSE_ENABLED = os.getenv('LLM_REUSE_ENABLED', 'True') == 'True'
+LLM_REUSE_MAX_DISTANCE = float(os.getenv('LLM_REUSE_MAX_DISTANCE', 0.05))
+LLM_REUSE_INDEX_SIZE = int(os.getenv('LLM_REUSE_INDEX_SIZE', 500))  # explanations kept per sensor type/severity
+
+# LLM Dispatch Queue - pending Ollama jobs are served by severity, then reading age
+LLM_DISPATCH_WORKERS = int(os.getenv('LLM_DISPATCH_WORKERS', 8))  # upper bound - see OLLAMA_MAX_CONCURRENCY
+LLM_QUEUE_MAX_SIZE = int(os.getenv('LLM_QUEUE_MAX_SIZE', 1000))
+# Jobs whose reading is older than this (seconds) fall back to the rule result; None = never expire
+LLM_QUEUE_MAX_AGE = {
+    'LOW': int(os.getenv('LLM_QUEUE_MAX_AGE_LOW', 60)),
+    'MEDIUM': int(os.getenv('LLM_QUEUE_MAX_AGE_MEDIUM', 180)),
+    'HIGH': int(os.getenv('LLM_QUEUE_MAX_AGE_HIGH', 600)),
+    'CRITICAL': None,
+}
+
+# Anomaly Episode Settings - fold sustained incidents into one alert
+# Hysteresis is the fraction of the normal band a reading must come back inside to close an episode
+ANOMALY_EPISODE_HYSTERESIS = float(os.getenv('ANOMALY_EPISODE_HYSTERESIS', 0.1))
+ANOMALY_MIN_REALERT_INTERVAL = int(os.getenv('ANOMALY_MIN_REALERT_INTERVAL', 300))  # seconds
+
+# Change-Point Detection - two-sided CUSUM per stream for slow drifts in the mean
+CHANGE_POINT_SENSOR_TYPES = os.getenv(
+    'CHANGE_POINT_SENSOR_TYPES', 'TEMPERATURE,HUMIDITY,CPU_TEMPERATURE,MEMORY_USAGE,DISK_USAGE'
+).split(',')
+CHANGE_POINT_THRESHOLD = float(os.getenv('CHANGE_POINT_THRESHOLD', 10.0))  # h, in standard deviations
+CHANGE_POINT_DRIFT = float(os.getenv('CHANGE_POINT_DRIFT', 0.5))  # k, smallest shift of interest (std devs)
+CHANGE_POINT_MIN_SAMPLES = int(os.getenv('CHANGE_POINT_MIN_SAMPLES', 100))  # readings to learn the reference
+CHANGE_POINT_CLIP = float(os.getenv('CHANGE_POINT_CLIP', 3.0))  # cap per-reading z so spikes don't count as drift
+CHANGE_POINT_REALERT_INTERVAL = int(os.getenv('CHANGE_POINT_REALERT_INTERVAL', 3600))  # seconds
 
 # Privacy Settings - for adding noise to sensor data
 PRIVACY_NOISE_EPSILON = float(os.getenv('PRIVACY_NOISE_EPSILON', 0.5))
 PRIVACY_NOISE_DELTA = float(os.getenv('PRIVACY_NOISE_DELTA', 1e-5))
+PRIVACY_NOISE_SEED = int(os.getenv('PRIVACY_NOISE_SEED')) if os.getenv('PRIVACY_NOISE_SEED') else None  # tests only
+PRIVACY_NOISE_API = os.getenv('PRIVACY_NOISE_API', 'False') == 'True'  # always add noise to /api/sensors/data/
+# Privacy budget per consumer and sensor stream (zCDP composition); exhausted streams
+# are served from cached releases or refused
+PRIVACY_BUDGET_EPSILON = float(os.getenv('PRIVACY_BUDGET_EPSILON', 10.0))
+PRIVACY_BUDGET_DELTA = float(os.getenv('PRIVACY_BUDGET_DELTA', 1e-6))
+PRIVACY_BUDGET_FLUSH_INTERVAL = int(os.getenv('PRIVACY_BUDGET_FLUSH_INTERVAL', 30))  # seconds
+PRIVACY_RELEASE_CACHE_SIZE = int(os.getenv('PRIVACY_RELEASE_CACHE_SIZE', 256))
+# Noisy aggregates for /api/stats/summary/: one release per consumer, query and window
+DP_AGGREGATES_API = os.getenv('DP_AGGREGATES_API', 'False') == 'True'  # otherwise only with ?private=true
+DP_RELEASE_WINDOW = int(os.getenv('DP_RELEASE_WINDOW', 300))  # seconds a release is reused for
+DP_AGGREGATE_EPSILON = float(os.getenv('DP_AGGREGATE_EPSILON', 0.5))  # per stream per release
+# Dataset exports are k-anonymous over timestamp, location and value (Mondrian)
+K_ANONYMITY_K = int(os.getenv('K_ANONYMITY_K', 5))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 50000))  # rows anonymized and streamed at a time
 
 # RSA Encryption Settings - for securing MQTT messages
 # This protects data even if MQTT broker is compromised
 RSA_ENCRYPTION_ENABLED = os.getenv('RSA_ENCRYPTION_ENABLED', 'True') == 'True'
 RSA_KEY_SIZE = int(os.getenv('RSA_KEY_SIZE', 2048))  # 2048 bits is standard, 4096 is extra secure
+RSA_KEY_RELOAD_INTERVAL = int(os.getenv('RSA_KEY_RELOAD_INTERVAL', 30))  # min seconds between reloads on unknown keys
+RSA_KEYS_DIR = os.getenv('RSA_KEYS_DIR', '') or None  # default: keys/
+# Field encryption keyring (AES-256-GCM keys with ids, rotated with manage.py field_keys)
+FIELD_KEYRING_PATH = os.getenv('FIELD_KEYRING_PATH', '') or None  # default: keys/field_keys.json
+FIELD_ENCRYPTION_BATCH_SIZE = int(os.getenv('FIELD_ENCRYPTION_BATCH_SIZE', 1000))  # rows per bulk_update
+# Hybrid envelopes (RSA-AES-GCM): unwrapped device session keys are cached so RSA runs once per key
+SESSION_KEY_CACHE_SIZE = int(os.getenv('SESSION_KEY_CACHE_SIZE', 1024))
+SESSION_KEY_TTL = int(os.getenv('SESSION_KEY_TTL', 3600))  # seconds before a key must be unwrapped again
+# Legacy RSA-OAEP payloads are decrypted in worker processes (unset = one per spare core, 0 = inline)
+MQTT_DECRYPT_WORKERS = int(os.getenv('MQTT_DECRYPT_WORKERS')) if os.getenv('MQTT_DECRYPT_WORKERS') else None
+MQTT_DECRYPT_MAX_PENDING = int(os.getenv('MQTT_DECRYPT_MAX_PENDING', 1000))  # paho blocks beyond this
 
 # Email Configuration (Gmail SMTP)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -0,0 +1,110 @@
+"""
+SQLite Production Profile for IoTShield
+Sets up every SQLite connection for a web server and the MQTT listener
+sharing one database file:
+
+- WAL journaling: readers no longer block the writer, and the writer no
+  longer blocks readers
+- synchronous=NORMAL: with WAL a commit no longer waits on fsync, and a crash
+  can lose only the last commits, never corrupt the file
+- a busy timeout, so a writer waits for the lock instead of failing with
+  "database is locked"
+- bigger page cache and memory-mapped reads for the dashboard's range queries
+
+Dashboard GET requests read through the 'readonly' alias, a second
+connection with query_only=ON, so a slow chart query never takes part in the
+write lock. Writes, and reads inside a transaction on 'default', always use
+'default'.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('iotshield')
+
+READONLY_ALIAS = 'readonly'
+
+# Set while a dashboard GET request is served (see DashboardReadMiddleware)
+_dashboard_read = ContextVar('iotshield_dashboard_read', default=False)
+
+
+def profile_pragmas(readonly=False):
+    """PRAGMA statements of the production profile, in the order they must run"""
+    pragmas = [
+        # Persistent in the file, so effectively a no-op after the first connection
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA synchronous={getattr(settings, 'SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={int(getattr(settings, 'SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(getattr(settings, 'SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}",
+        # Negative = KiB rather than pages
+        f"PRAGMA cache_size={-int(getattr(settings, 'SQLITE_CACHE_SIZE_KB', 64 * 1024))}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+    if readonly:
+        pragmas.append('PRAGMA query_only=ON')
+    return pragmas
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Apply the production profile to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+
+    # Straight on the sqlite3 connection - no Django cursor wrapping or query logging
+    for pragma in profile_pragmas(readonly=connection.alias == READONLY_ALIAS):
+        try:
+            connection.connection.execute(pragma).fetchall()
+        except Exception as e:
+            # Switching to WAL needs a moment without other writers; the next connection retries
+            logger.warning(f"SQLite connection '{connection.alias}': {pragma} failed: {e}")
+
+
+@contextmanager
+def dashboard_reads():
+    """Send ORM reads in this block to the read-only connection"""
+    token = _dashboard_read.set(True)
+    try:
+        yield
+    finally:
+        _dashboard_read.reset(token)
+
+
+class DashboardReadRouter:
+    """Reads of dashboard GET requests go to 'readonly'; everything else to 'default'"""
+
+    def db_for_read(self, model, **hints):
+        # Inside a transaction on 'default' read your own uncommitted writes
+        if _dashboard_read.get() and not connections['default'].in_atomic_block:
+            return READONLY_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database file
+        if {obj1._state.db, obj2._state.db} <= {'default', READONLY_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class DashboardReadMiddleware:
+    """Serve GET/HEAD requests' reads from the read-only connection"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return self.get_response(request)
+        with dashboard_reads():
+            return self.get_response(request)
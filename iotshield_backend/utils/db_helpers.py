@@ -37,15 +37,20 @@ def get_sensor_stats_by_type(sensor_type, hours=24):
 
 
 def cleanup_old_data(days=30):
-    """Remove sensor data older than specified days"""
-    from dashboard.models import SensorData, SystemLog
+    """Remove sensor data and logs older than specified days (in chunks, see retention.RetentionJob)"""
+    from dashboard.models import SensorData
+    from iotshield_backend.retention import RetentionJob
     
-    cutoff_date = timezone.now() - timedelta(days=days)
+    job = RetentionJob()
+    sensor_types = SensorData.objects.order_by().values_list('sensor_type', flat=True).distinct()
     
-    deleted_sensors = SensorData.objects.filter(timestamp__lt=cutoff_date).delete()
-    deleted_logs = SystemLog.objects.filter(timestamp__lt=cutoff_date).delete()
+    try:
+        deleted_sensors = sum(job.purge_readings(sensor_type, days)['deleted'] for sensor_type in sensor_types)
+        deleted_logs = job.purge_logs(days)['deleted']
+    finally:
+        job.close()
     
     return {
-        'sensor_data_deleted': deleted_sensors[0],
-        'logs_deleted': deleted_logs[0]
+        'sensor_data_deleted': deleted_sensors,
+        'logs_deleted': deleted_logs
     }
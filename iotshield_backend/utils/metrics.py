@@ -0,0 +1,156 @@
+"""In-process metrics for IoTShield (counters, gauges and latency timings)"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('iotshield')
+
+
+class MetricsRegistry:
+    """
+    Thread-safe metrics store.
+
+    Metrics are identified by a name plus optional labels, e.g.
+    metrics.increment('detector_verdicts', detector='rules', verdict='anomaly').
+    Timings keep running totals plus a bounded window of recent samples
+    for percentiles.
+    """
+
+    def __init__(self, window_size=1000):
+        self.window_size = window_size
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        if not labels:
+            return name
+        label_str = ','.join(f"{k}={v}" for k, v in sorted(labels.items()))
+        return f"{name}{{{label_str}}}"
+
+    def increment(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to its current value"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record one timing/size sample"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._observe(key, value)
+
+    def _observe(self, key, value):
+        timing = self._timings.get(key)
+        if timing is None:
+            timing = {'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': deque(maxlen=self.window_size)}
+            self._timings[key] = timing
+        timing['count'] += 1
+        timing['sum'] += value
+        timing['max'] = max(timing['max'], value)
+        timing['samples'].append(value)
+
+    def timer(self, name, **labels):
+        """Context manager that observes elapsed milliseconds"""
+        return _Timer(self, name, labels)
+
+    def get_counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict"""
+        with self._lock:
+            timings = {}
+            for key, timing in self._timings.items():
+                samples = sorted(timing['samples'])
+                timings[key] = {
+                    'count': timing['count'],
+                    'avg': round(timing['sum'] / timing['count'], 3) if timing['count'] else 0.0,
+                    'p50': round(_percentile(samples, 50), 3),
+                    'p95': round(_percentile(samples, 95), 3),
+                    'p99': round(_percentile(samples, 99), 3),
+                    'max': round(timing['max'], 3),
+                }
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'timings': timings,
+                'generated_at': time.time(),
+            }
+
+    def collect(self):
+        """
+        Counter increments and timing samples recorded since the last collect(),
+        for a worker process to send to the parent (see merge()). Gauges stay.
+        """
+        with self._lock:
+            collected = {
+                'counters': dict(self._counters),
+                'timings': {key: list(timing['samples']) for key, timing in self._timings.items()},
+            }
+            self._counters.clear()
+            self._timings.clear()
+        return collected
+
+    def merge(self, collected):
+        """Add the metrics another process collect()ed"""
+        with self._lock:
+            for key, value in collected['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, samples in collected['timings'].items():
+                for value in samples:
+                    self._observe(key, value)
+
+    def dump(self, path):
+        """Write a snapshot to disk so another process (the web server) can read it"""
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.snapshot(), f)
+        except Exception as e:
+            logger.error(f"Failed to write metrics snapshot: {e}")
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed_ms = (time.perf_counter() - self.started) * 1000
+        self.registry.observe(self.name, self.elapsed_ms, **self.labels)
+        return False
+
+
+def _percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(pct / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
@@ -0,0 +1,96 @@
+"""
+Vectorized Anomaly Detectors for IoTShield
+NumPy versions of the rule-based and statistical checks, used to score whole
+arrays of readings at once (bulk re-scoring, batch analysis)
+"""
+import numpy as np
+
+from .sensor_rules import SENSOR_RULES, SEVERITY_ORDER
+
+# Rank -> severity name (index 0 means normal)
+SEVERITY_NAMES = np.array([None, 'LOW', 'MEDIUM', 'HIGH', 'CRITICAL'], dtype=object)
+
+# Anomaly scores are stored with this many decimals
+SCORE_DECIMALS = 2
+
+
+def rule_severity_ranks(sensor_types, values):
+    """
+    Vectorized equivalent of sensor_rules.classify_severity
+
+    Args:
+        sensor_types: Array of sensor type strings
+        values: Array of readings (same length)
+
+    Returns:
+        int8 array of severity ranks (0 = normal, 4 = CRITICAL)
+    """
+    sensor_types = np.asarray(sensor_types)
+    values = np.asarray(values, dtype=np.float64)
+    ranks = np.zeros(len(values), dtype=np.int8)
+
+    for sensor_type in np.unique(sensor_types):
+        rules = SENSOR_RULES.get(sensor_type)
+        if rules is None:
+            continue
+
+        mask = sensor_types == sensor_type
+        type_values = values[mask]
+        type_ranks = np.zeros(len(type_values), dtype=np.int8)
+
+        for threshold, level in rules['high']:
+            type_ranks = np.where(type_values > threshold, np.maximum(type_ranks, SEVERITY_ORDER[level]), type_ranks)
+        for threshold, level in rules['low']:
+            type_ranks = np.where(type_values < threshold, np.maximum(type_ranks, SEVERITY_ORDER[level]), type_ranks)
+
+        ranks[mask] = type_ranks
+
+    return ranks
+
+
+def zscores(values, means, stds):
+    """
+    Absolute z-score of each reading against its stream's mean/std
+
+    Args:
+        values: Array of readings
+        means: Per-reading stream mean (same length)
+        stds: Per-reading stream standard deviation (same length)
+
+    Returns:
+        float array of |z|; 0 where the stream has no spread
+    """
+    values = np.asarray(values, dtype=np.float64)
+    means = np.asarray(means, dtype=np.float64)
+    stds = np.asarray(stds, dtype=np.float64)
+
+    z = np.zeros(len(values), dtype=np.float64)
+    valid = stds > 0
+    z[valid] = np.abs(values[valid] - means[valid]) / stds[valid]
+    return z
+
+
+def score_readings(sensor_types, values, means, stds, z_threshold=3.0):
+    """
+    Combine the rule and statistical detectors into one verdict per reading
+
+    Args:
+        sensor_types: Array of sensor type strings
+        values: Array of readings
+        means: Per-reading stream mean
+        stds: Per-reading stream standard deviation
+        z_threshold: |z| at which the statistical detector flags a reading
+
+    Returns:
+        Tuple of (is_anomaly bool array, anomaly_score float array in [0, 1])
+    """
+    ranks = rule_severity_ranks(sensor_types, values)
+    z = zscores(values, means, stds)
+
+    # Rule score: severity rank / 4. Statistical score reaches 1.0 at 2x the threshold.
+    rule_score = ranks / 4.0
+    stat_score = np.clip(z / (2.0 * z_threshold), 0.0, 1.0)
+
+    is_anomaly = (ranks > 0) | (z >= z_threshold)
+    scores = np.maximum(rule_score, stat_score)
+    return is_anomaly, np.round(scores, SCORE_DECIMALS)
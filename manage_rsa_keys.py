@@ -28,33 +28,36 @@ def display_menu():
     print("\n" + "="*60)
     print("       IoTShield RSA Key Management")
     print("="*60)
-    print("1. Generate New RSA Key Pair")
+    print("1. Rotate RSA Key Pair (old key kept for decryption)")
     print("2. Display Public Key (for IoT devices)")
     print("3. View Key Information")
     print("4. Test Encryption/Decryption")
     print("5. Export Public Key to File")
-    print("6. Exit")
+    print("6. Remove a Retired Key")
+    print("7. Exit")
     print("="*60)
 
 
-def generate_keys():
-    """Create a brand new pair of RSA keys"""
-    print("\n[WARNING] This will overwrite existing keys!")
-    confirm = input("Are you sure you want to generate new keys? (yes/no): ")
+def rotate_keys():
+    """Create a new active key pair; the current private key is retired, not deleted"""
+    print("\n[INFO] Devices still using the old public key keep working until you remove it.")
+    confirm = input("Are you sure you want to rotate the RSA keys? (yes/no): ")
     
     if confirm.lower() != 'yes':
         print("Operation cancelled.")
         return
     
     try:
-        # Create RSA encryption object and generate keys
+        # Create RSA encryption object and rotate keys
         rsa = RSAEncryption()
-        rsa.generate_keys()
+        old_fingerprint = rsa.active_fingerprint
+        new_fingerprint = rsa.rotate_keys()
         print(f"\n[SUCCESS] New {rsa.key_size}-bit RSA key pair generated!")
-        print(f"  Private Key: {rsa.private_key_path}")
-        print(f"  Public Key: {rsa.public_key_path}")
+        print(f"  Active Key: {new_fingerprint} ({rsa.private_key_path})")
+        print(f"  Retired Key: {old_fingerprint} ({rsa.retired_dir})")
+        print("\nThe listener picks up the new key on its own, or right away with: kill -HUP <listener pid>")
     except Exception as e:
-        print(f"[ERROR] Error generating keys: {e}")
+        print(f"[ERROR] Error rotating keys: {e}")
 
 
 def display_public_key():
@@ -86,6 +89,11 @@ def view_key_info():
         print(f"Public Key Path: {rsa.public_key_path}")
         print(f"Private Key Exists: {rsa.private_key_path.exists()}")
         print(f"Public Key Exists: {rsa.public_key_path.exists()}")
+        print(f"Active Key Fingerprint: {rsa.active_fingerprint}")
+        for fingerprint, entry in rsa.keys.items():
+            if entry.retired:
+                print(f"Retired Key: {fingerprint}")
+        print("(Decrypts per key are in the listener's metrics: rsa_key_decrypts{key=...})")
         
         # Check if keys are loaded and working
         if rsa.private_key:
@@ -164,15 +172,37 @@ def export_public_key():
         print(f"[ERROR] Error exporting public key: {e}")
 
 
+def remove_retired_key():
+    """Delete a retired private key once no device encrypts for it any more"""
+    try:
+        rsa = RSAEncryption()
+        retired = [fingerprint for fingerprint, entry in rsa.keys.items() if entry.retired]
+        if not retired:
+            print("\nNo retired keys.")
+            return
+        print("\nRetired keys:")
+        for fingerprint in retired:
+            print(f"  {fingerprint}")
+        fingerprint = input("Fingerprint to remove: ").strip()
+        print("[WARNING] Messages still encrypted for this key will fail to decrypt!")
+        if input("Are you sure? (yes/no): ").lower() != 'yes':
+            print("Operation cancelled.")
+            return
+        rsa.remove_retired_key(fingerprint)
+        print(f"\n[SUCCESS] Removed retired key {fingerprint}")
+    except Exception as e:
+        print(f"[ERROR] Error removing key: {e}")
+
+
 def main():
     """Main loop - shows menu and handles user choices"""
     while True:
         display_menu()
-        choice = input("\nEnter your choice (1-6): ").strip()
+        choice = input("\nEnter your choice (1-7): ").strip()
         
         # Handle each menu option
         if choice == '1':
-            generate_keys()
+            rotate_keys()
         elif choice == '2':
             display_public_key()
         elif choice == '3':
@@ -182,6 +212,8 @@ def main():
         elif choice == '5':
             export_public_key()
         elif choice == '6':
+            remove_retired_key()
+        elif choice == '7':
             print("\nExiting...")
             break
         else:
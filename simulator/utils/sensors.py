@@ -3,12 +3,23 @@
 import random
 import json
 import os
+from datetime import datetime, timedelta, timezone
 
 
 class SensorSimulator:
     """Simulates various IoT sensors"""
     
-    def __init__(self, config_file='config.json'):
+    # (sensor type, reader method, unit) as published by the device simulators
+    SENSORS = [
+        ('TEMPERATURE', 'read_temperature', '°C'),
+        ('HUMIDITY', 'read_humidity', '%'),
+        ('GAS', 'read_gas', 'ppm'),
+        ('FLAME', 'read_flame', ''),
+        ('MOTION', 'read_motion', ''),
+        ('LIGHT', 'read_light', 'lux'),
+    ]
+    
+    def __init__(self, config_file='config.json', seed=None):
         # Handle both string path and dict config
         if isinstance(config_file, dict):
             config = config_file
@@ -21,6 +32,12 @@ class SensorSimulator:
         
         self.sensor_config = config.get('sensors', {})
         self.privacy_config = config.get('privacy', {})
+        
+        # Own RNG so a seed reproduces a dataset exactly
+        self.random = random.Random(seed)
+        
+        # Ground truth for the most recent reading: (is_anomaly, severity or None)
+        self.last_label = (False, None)
     
     def read_temperature(self):
         """Simulate temperature sensor (°C)"""
@@ -30,14 +47,16 @@ class SensorSimulator:
         anomaly_chance = config.get('anomaly_chance', 0.05)
         
         # Normal reading
-        value = random.normalvariate(base, variance)
+        value = self.random.normalvariate(base, variance)
+        self.last_label = (False, None)
         
         # Occasionally generate anomalies
-        if random.random() < anomaly_chance:
-            value = random.choice([
-                random.uniform(40, 50),  # High temperature
-                random.uniform(5, 15),   # Low temperature
+        if self.random.random() < anomaly_chance:
+            value = self.random.choice([
+                self.random.uniform(40, 50),  # High temperature
+                self.random.uniform(5, 15),   # Low temperature
             ])
+            self.last_label = (True, None)
         
         # Add privacy noise
         if self.privacy_config.get('enable_noise', False):
@@ -52,10 +71,12 @@ class SensorSimulator:
         variance = config.get('variance', 10)
         anomaly_chance = config.get('anomaly_chance', 0.05)
         
-        value = random.normalvariate(base, variance)
+        value = self.random.normalvariate(base, variance)
+        self.last_label = (False, None)
         
-        if random.random() < anomaly_chance:
-            value = random.uniform(85, 95)  # High humidity
+        if self.random.random() < anomaly_chance:
+            value = self.random.uniform(85, 95)  # High humidity
+            self.last_label = (True, None)
         
         if self.privacy_config.get('enable_noise', False):
             value = self._add_noise(value)
@@ -69,19 +90,24 @@ class SensorSimulator:
         variance = config.get('variance', 0.05)
         anomaly_chance = config.get('anomaly_chance', 0.02)
         
-        value = random.normalvariate(base, variance)
+        value = self.random.normalvariate(base, variance)
+        self.last_label = (False, None)
         
-        if random.random() < anomaly_chance:
+        if self.random.random() < anomaly_chance:
             # Generate anomalies across different severity ranges
-            severity_roll = random.random()
+            severity_roll = self.random.random()
             if severity_roll < 0.15:  # 15% CRITICAL
-                value = random.uniform(0.76, 0.90)  # Critical gas leak
+                value = self.random.uniform(0.76, 0.90)  # Critical gas leak
+                self.last_label = (True, 'CRITICAL')
             elif severity_roll < 0.40:  # 25% HIGH
-                value = random.uniform(0.66, 0.75)  # High gas level
+                value = self.random.uniform(0.66, 0.75)  # High gas level
+                self.last_label = (True, 'HIGH')
             elif severity_roll < 0.70:  # 30% MEDIUM
-                value = random.uniform(0.51, 0.65)  # Medium gas level
+                value = self.random.uniform(0.51, 0.65)  # Medium gas level
+                self.last_label = (True, 'MEDIUM')
             else:  # 30% LOW
-                value = random.uniform(0.36, 0.50)  # Slightly elevated
+                value = self.random.uniform(0.36, 0.50)  # Slightly elevated
+                self.last_label = (True, 'LOW')
         
         # Clamp value BEFORE adding noise to prevent overflow
         value = max(0, min(0.95, value))
@@ -90,7 +116,7 @@ class SensorSimulator:
         if self.privacy_config.get('enable_noise', False):
             epsilon = self.privacy_config.get('noise_epsilon', 0.5)
             # Reduce noise impact for bounded values
-            noise = random.gauss(0, 0.01 / epsilon)  # Much smaller noise
+            noise = self.random.gauss(0, 0.01 / epsilon)  # Much smaller noise
             value = value + noise
         
         return round(max(0, min(0.95, value)), 3)
@@ -101,20 +127,25 @@ class SensorSimulator:
         anomaly_chance = config.get('anomaly_chance', 0.01)
         
         # Usually 0, rarely detect flame with varying intensity
-        if random.random() < anomaly_chance:
+        if self.random.random() < anomaly_chance:
             # Flame detected - vary by severity
-            severity_roll = random.random()
+            severity_roll = self.random.random()
             if severity_roll < 0.2:  # 20% CRITICAL - actual fire
-                value = random.uniform(0.71, 0.95)
+                value = self.random.uniform(0.71, 0.95)
+                self.last_label = (True, 'CRITICAL')
             elif severity_roll < 0.5:  # 30% HIGH - strong heat signature
-                value = random.uniform(0.56, 0.70)
+                value = self.random.uniform(0.56, 0.70)
+                self.last_label = (True, 'HIGH')
             elif severity_roll < 0.75:  # 25% MEDIUM - notable heat
-                value = random.uniform(0.36, 0.55)
+                value = self.random.uniform(0.36, 0.55)
+                self.last_label = (True, 'MEDIUM')
             else:  # 25% LOW - minor heat signature
-                value = random.uniform(0.16, 0.35)
+                value = self.random.uniform(0.16, 0.35)
+                self.last_label = (True, 'LOW')
         else:
             # Normal - very low or no flame
-            value = random.uniform(0, 0.10)
+            value = self.random.uniform(0, 0.10)
+            self.last_label = (False, None)
         
         return round(value, 2)
     
@@ -123,18 +154,21 @@ class SensorSimulator:
         config = self.sensor_config.get('motion', {})
         activity_chance = config.get('activity_chance', 0.3)
         
+        # Motion is normal activity - there is no injected anomaly to label
+        self.last_label = (False, None)
+        
         # Generate motion intensity instead of binary
-        if random.random() < activity_chance:
+        if self.random.random() < activity_chance:
             # Motion detected - vary intensity
             base_intensity = config.get('base_intensity', 0.3)
-            value = random.uniform(base_intensity * 0.5, base_intensity * 2)
+            value = self.random.uniform(base_intensity * 0.5, base_intensity * 2)
             
             # Rare high-intensity motion
-            if random.random() < 0.05:
-                value = random.uniform(0.7, 0.95)
+            if self.random.random() < 0.05:
+                value = self.random.uniform(0.7, 0.95)
         else:
             # No motion or very low
-            value = random.uniform(0, 0.15)
+            value = self.random.uniform(0, 0.15)
         
         return round(max(0, min(1, value)), 2)
     
@@ -145,27 +179,61 @@ class SensorSimulator:
         variance = config.get('variance', 100)
         anomaly_chance = config.get('anomaly_chance', 0.03)
         
-        value = random.normalvariate(base, variance)
+        value = self.random.normalvariate(base, variance)
+        self.last_label = (False, None)
         
-        if random.random() < anomaly_chance:
-            value = random.choice([
-                random.uniform(0, 50),      # Very dark
-                random.uniform(900, 1500),  # Very bright
+        if self.random.random() < anomaly_chance:
+            value = self.random.choice([
+                self.random.uniform(0, 50),      # Very dark
+                self.random.uniform(900, 1500),  # Very bright
             ])
+            self.last_label = (True, None)
         
         if self.privacy_config.get('enable_noise', False):
             value = self._add_noise(value)
         
         return round(max(0, value), 2)
     
+    def labeled_readings(self, rounds, device_id='EVAL_SIM_001', start=None, interval=5):
+        """
+        Generate readings with ground-truth labels for offline evaluation
+        
+        Args:
+            rounds: Number of publish cycles (one reading per sensor each)
+            device_id: Device ID to stamp on the readings
+            start: datetime of the first cycle (defaults to now minus the run length)
+            interval: Seconds between cycles, like publish_interval
+        
+        Yields:
+            Message dicts as published over MQTT plus 'label_anomaly' and
+            'label_severity' (severity is None when the simulator doesn't encode one)
+        """
+        if start is None:
+            start = datetime.now(timezone.utc) - timedelta(seconds=rounds * interval)
+        
+        for i in range(rounds):
+            timestamp = (start + timedelta(seconds=i * interval)).isoformat()
+            for sensor_type, reader, unit in self.SENSORS:
+                value = getattr(self, reader)()
+                is_anomaly, severity = self.last_label
+                yield {
+                    'device_id': device_id,
+                    'sensor_type': sensor_type,
+                    'value': value,
+                    'unit': unit,
+                    'timestamp': timestamp,
+                    'label_anomaly': is_anomaly,
+                    'label_severity': severity,
+                }
+    
     def _add_noise(self, value):
         """Add privacy-preserving noise"""
         epsilon = self.privacy_config.get('noise_epsilon', 0.5)
         noise_type = self.privacy_config.get('noise_type', 'gaussian')
         
         if noise_type == 'gaussian':
-            noise = random.gauss(0, 1/epsilon)
+            noise = self.random.gauss(0, 1/epsilon)
         else:  # laplace
-            noise = random.expovariate(epsilon) * random.choice([-1, 1])
+            noise = self.random.expovariate(epsilon) * self.random.choice([-1, 1])
         
         return value + noise
@@ -0,0 +1,247 @@
+"""
+Alert Explanation Test
+Checks the explanation lifecycle of an alert: the claim, READY and FAILED
+outcomes, the fallback when the job expires, retries from FAILED, recovery
+of stale GENERATING claims, that only the LLM's own explanations seed the
+reuse index, and that reading an alert or the polled alert list never
+generates one
+"""
+import os
+import sys
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+import json
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from dashboard import views
+from dashboard.models import Alert, Device, SensorData
+from iotshield_backend import alert_explanations
+from iotshield_backend.alert_explanations import ExplanationService
+from iotshield_backend.explanation_index import ExplanationIndex
+from iotshield_backend.llm_response import ResponseParseError
+
+EXPLANATION = {'anomaly': True, 'explanation': 'Gas is well above the safe level.', 'severity': 'HIGH',
+               'suggestion': 'Ventilate the room.'}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class FakeDetector:
+    """Stands in for Ollama: returns EXPLANATION, or raises like an unparseable response"""
+    model_name = 'fake'
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def explain(self, sensor_data, severity):
+        self.calls += 1
+        if self.fail:
+            raise ResponseParseError('unparseable', 'stand-in')
+        return dict(EXPLANATION, severity=severity)
+
+
+class InlineDispatcher:
+    """Runs jobs on the caller's thread, so they see the test's transaction"""
+
+    def __init__(self, expire=False):
+        self.expire = expire
+        self.severities = []
+
+    def submit(self, fn, severity='LOW', reading_time=None, fallback=None):
+        self.severities.append(severity)
+        future = Future()
+        future.set_result(fallback() if self.expire and fallback else fn())
+        return future
+
+
+def make_alert(status='PENDING', severity='HIGH', value=0.8):
+    device, _ = Device.objects.get_or_create(device_id='TEST_EXPLAIN', defaults={
+        'device_type': 'SIMULATOR', 'name': 'Kitchen Node', 'location': 'Kitchen'})
+    reading = SensorData.objects.create(device=device, sensor_type='GAS', value=value, unit='ppm')
+    return Alert.objects.create(sensor_data=reading, title='Gas high', description='Rule: gas above 0.7 ppm',
+                                severity=severity, explanation_status=status)
+
+
+def service(detector=None, dispatcher=None, index=False):
+    # No reuse index unless given - every explanation comes from the detector
+    return ExplanationService(detector=detector or FakeDetector(), dispatcher=dispatcher or InlineDispatcher(),
+                              index=index)
+
+
+def in_rollback(test):
+    """Run the test in a transaction that is rolled back afterwards"""
+    def run():
+        try:
+            with transaction.atomic():
+                test()
+                raise _Rollback
+        except _Rollback:
+            pass
+    run.__name__ = test.__name__
+    return run
+
+
+@in_rollback
+def test_claim_and_ready():
+    alert = make_alert()
+    detector = FakeDetector()
+    explainer = service(detector)
+    completed = []
+
+    explained = explainer.request(alert.id, severity='HIGH', on_complete=completed.append).result()
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'READY' and alert.explained_at is not None
+    assert alert.description == EXPLANATION['explanation'] and alert.ai_suggestion == EXPLANATION['suggestion']
+    assert completed == [explained]
+
+    # Only PENDING alerts are claimed - a READY one is never generated again
+    assert explainer._generate(alert.id) is None
+    assert explainer.explain_on_demand(alert) is None
+    assert detector.calls == 1
+
+
+@in_rollback
+def test_failure_then_retry():
+    alert = make_alert()
+    service(FakeDetector(fail=True)).request(alert.id).result()
+    alert.refresh_from_db()
+    # The rule text stays, and the alert doesn't claim to be explained
+    assert alert.explanation_status == 'FAILED'
+    assert alert.description == 'Rule: gas above 0.7 ppm' and alert.explained_at is None
+
+    # Background requests leave FAILED alone; asking for it explicitly retries
+    detector = FakeDetector()
+    dispatcher = InlineDispatcher()
+    explainer = service(detector, dispatcher)
+    assert explainer.request(alert.id).result() is None and detector.calls == 0
+    explainer.explain_on_demand(alert).result()
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'READY' and detector.calls == 1
+    assert dispatcher.severities[-1] == 'HIGH'
+
+
+@in_rollback
+def test_expired_job_keeps_rule_text():
+    alert = make_alert(severity='LOW')
+    detector = FakeDetector()
+    completed = []
+    expired = service(detector, InlineDispatcher(expire=True)).request(
+        alert.id, severity='LOW', on_complete=completed.append).result()
+
+    alert.refresh_from_db()
+    # Still PENDING, so it can be explained on demand later
+    assert alert.explanation_status == 'PENDING' and detector.calls == 0
+    assert alert.description == 'Rule: gas above 0.7 ppm'
+    assert [a.id for a in completed] == [expired.id] == [alert.id]
+
+
+@in_rollback
+def test_stale_generating_is_recovered():
+    alert = make_alert(status='GENERATING')
+    detector = FakeDetector()
+    explainer = service(detector)
+
+    # A fresh claim belongs to a live generator and is left alone
+    explainer.explain_on_demand(alert).result()
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'GENERATING' and detector.calls == 0
+
+    # A claim older than LLM_EXPLANATION_STALE_AFTER goes back to PENDING and is generated
+    Alert.objects.filter(id=alert.id).update(
+        updated_at=timezone.now() - timedelta(seconds=explainer.stale_after + 1))
+    explainer.explain_on_demand(alert).result()
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'READY' and detector.calls == 1
+
+
+@in_rollback
+def test_only_llm_output_is_indexed():
+    index = ExplanationIndex(max_distance=0.05)
+    failed = make_alert()
+    service(FakeDetector(fail=True), index=index).request(failed.id).result()
+    assert failed.id not in loaded_ids(index)
+
+    detector = FakeDetector()
+    explainer = service(detector, index=index)
+    original, copy = make_alert(), make_alert(value=0.801)
+    explainer.request(original.id).result()
+    explainer.request(copy.id).result()
+    original.refresh_from_db()
+    copy.refresh_from_db()
+    assert detector.calls == 1
+    assert original.explanation_reused_from is None and copy.explanation_reused_from == original.id
+
+    # A fresh index seeds from the database: the original only, never the copy or the failure
+    ids = loaded_ids(ExplanationIndex())
+    assert original.id in ids and copy.id not in ids and failed.id not in ids
+
+
+def loaded_ids(index):
+    partition = index._partition('GAS', 'HIGH')
+    return {template[2] for template in partition.templates[:partition.size]}
+
+
+@in_rollback
+def test_detail_is_read_only_and_explain_queues():
+    alert = make_alert(status='FAILED')
+    factory = RequestFactory()
+
+    response = views.api_alert_detail(factory.get(f'/api/alerts/{alert.id}/'), alert.id)
+    assert json.loads(response.content)['alert']['explanation_status'] == 'FAILED'
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'FAILED'
+
+    assert views.api_alert_explain(factory.get(f'/api/alerts/{alert.id}/explain/'), alert.id).status_code == 405
+
+    original, alert_explanations.explanation_service = alert_explanations.explanation_service, service()
+    try:
+        response = views.api_alert_explain(factory.post(f'/api/alerts/{alert.id}/explain/'), alert.id)
+    finally:
+        alert_explanations.explanation_service = original
+    body = json.loads(response.content)
+    assert response.status_code == 202 and body['queued']
+    assert body['alert']['explanation_status'] == 'READY'
+
+
+@in_rollback
+def test_alert_list_never_queues():
+    alert = make_alert(severity='LOW')
+    detector = FakeDetector()
+    dispatcher = InlineDispatcher()
+
+    # The dashboard polls the list every few seconds - that must not spend LLM calls
+    original, alert_explanations.explanation_service = alert_explanations.explanation_service, service(
+        detector, dispatcher)
+    try:
+        response = views.api_alerts_list(RequestFactory().get('/api/alerts/list/?limit=100'))
+    finally:
+        alert_explanations.explanation_service = original
+    listed = {item['id']: item for item in json.loads(response.content)['alerts']}
+    assert listed[alert.id]['explanation_status'] == 'PENDING'
+    alert.refresh_from_db()
+    assert alert.explanation_status == 'PENDING'
+    assert detector.calls == 0 and dispatcher.severities == []
+
+
+if __name__ == '__main__':
+    test_claim_and_ready()
+    test_failure_then_retry()
+    test_expired_job_keeps_rule_text()
+    test_stale_generating_is_recovered()
+    test_only_llm_output_is_indexed()
+    test_detail_is_read_only_and_explain_queues()
+    test_alert_list_never_queues()
+    print("✓ Alert explanation tests passed!")
@@ -0,0 +1,108 @@
+"""
+Anomaly Episode Tracker Test
+Checks that sustained incidents fold into one alert without extra LLM calls
+"""
+import os
+import sys
+import threading
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from iotshield_backend.anomaly_episodes import AnomalyEpisodeTracker
+from iotshield_backend.sensor_rules import classify_severity
+
+
+def test_rule_severity_bands():
+    """Rule bands match the ranges in the LLM prompt"""
+    assert classify_severity('GAS', 0.10) is None
+    assert classify_severity('GAS', 0.40) == 'LOW'
+    assert classify_severity('GAS', 0.55) == 'MEDIUM'
+    assert classify_severity('GAS', 0.70) == 'HIGH'
+    assert classify_severity('GAS', 0.80) == 'CRITICAL'
+    assert classify_severity('TEMPERATURE', 3) == 'HIGH'
+    assert classify_severity('LIGHT', 10) == 'HIGH'
+    assert classify_severity('UNKNOWN', 1000) is None
+
+
+def test_sustained_incident_is_one_episode():
+    """Ten minutes of 0.8 ppm gas at 5 s intervals -> one analysis, 119 repeats"""
+    tracker = AnomalyEpisodeTracker(hysteresis=0.1, min_realert_interval=300)
+    decisions = []
+
+    for i in range(120):
+        now = 1000.0 + i * 5
+        decision, episode = tracker.check('dev1', 'GAS', 0.8, now=now)
+        decisions.append(decision)
+        if decision == tracker.ANALYZE:
+            tracker.open_episode('dev1', 'GAS', alert_id=1, severity='CRITICAL', now=now)
+
+    assert decisions.count(tracker.ANALYZE) == 1
+    assert decisions.count(tracker.REPEAT) == 119
+
+
+def test_hysteresis_and_escalation():
+    """Episode stays open between thresholds, escalates on higher severity, closes in band"""
+    tracker = AnomalyEpisodeTracker(hysteresis=0.1, min_realert_interval=300)
+    tracker.open_episode('dev1', 'GAS', alert_id=7, severity='LOW', now=0)
+
+    # 0.33 is below the 0.35 enter threshold but above the 0.315 exit threshold
+    decision, _ = tracker.check('dev1', 'GAS', 0.33, now=5)
+    assert decision == tracker.REPEAT
+
+    decision, episode = tracker.check('dev1', 'GAS', 0.70, now=10)
+    assert decision == tracker.ESCALATE and episode.alert_id == 7
+    tracker.escalate('dev1', 'GAS', 'HIGH', now=10)
+
+    decision, _ = tracker.check('dev1', 'GAS', 0.60, now=15)
+    assert decision == tracker.REPEAT
+
+    # Back to normal closes the episode
+    decision, _ = tracker.check('dev1', 'GAS', 0.10, now=20)
+    assert decision == tracker.ANALYZE
+
+    # A new spike inside the re-alert window reuses the same alert
+    decision, episode = tracker.check('dev1', 'GAS', 0.40, now=60)
+    assert decision == tracker.REPEAT and episode.alert_id == 7
+
+    # After the window a new spike is analyzed again
+    tracker.check('dev1', 'GAS', 0.10, now=70)
+    decision, _ = tracker.check('dev1', 'GAS', 0.40, now=1000)
+    assert decision == tracker.ANALYZE
+
+
+def test_concurrent_readings_share_one_alert():
+    """Readings analyzed in parallel wait for the first one's alert instead of raising their own"""
+    tracker = AnomalyEpisodeTracker(hysteresis=0.1, min_realert_interval=300)
+    decision, reservation = tracker.check('dev1', 'GAS', 0.8, now=0)
+    assert decision == tracker.ANALYZE and reservation is not None
+
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(tracker.check('dev1', 'GAS', 0.8, now=1)))
+               for _ in range(4)]
+    for thread in waiters:
+        thread.start()
+    # The first reading's alert is committed while the others wait
+    tracker.open_episode('dev1', 'GAS', alert_id=42, severity='CRITICAL', now=0)
+    tracker.release('dev1', 'GAS', reservation)  # no-op once the episode is open
+    for thread in waiters:
+        thread.join(5)
+    assert [(d, e.alert_id) for d, e in results] == [(tracker.REPEAT, 42)] * 4
+
+    # A reading whose analysis raises no alert hands the stream to the next one
+    decision, reservation = tracker.check('dev2', 'GAS', 0.8, now=0)
+    tracker.close_episode('dev2', 'GAS', now=0)
+    tracker.release('dev2', 'GAS', reservation)
+    decision, second = tracker.check('dev2', 'GAS', 0.8, now=1)
+    assert decision == tracker.ANALYZE and second is not reservation
+
+
+if __name__ == '__main__':
+    test_rule_severity_bands()
+    test_sustained_incident_is_one_episode()
+    test_hysteresis_and_escalation()
+    test_concurrent_readings_share_one_alert()
+    print("✓ Anomaly episode tests passed!")
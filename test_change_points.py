@@ -0,0 +1,62 @@
+"""
+Change-Point Detector Test
+Checks that slow drifts raise one trend alert and spikes don't
+"""
+import os
+import random
+import sys
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from iotshield_backend.change_points import ChangePointDetector
+
+
+def run(detector, values):
+    """Feed values at 5 s intervals, attaching an alert id to each new change point"""
+    new, continued = [], 0
+    for i, value in enumerate(values):
+        change = detector.update('rpi', 'DISK_USAGE', value, now=i * 5)
+        if change is None:
+            continue
+        if change['alert_id']:
+            continued += 1
+        else:
+            new.append((i, change))
+            detector.attach_alert('rpi', 'DISK_USAGE', len(new), change['direction'], now=i * 5)
+    return new, continued
+
+
+def test_stationary_with_spikes():
+    """Noise plus occasional spikes is not a trend"""
+    rng = random.Random(7)
+    values = [rng.uniform(85, 95) if rng.random() < 0.03 else 35 + rng.uniform(-15, 15) for _ in range(10000)]
+    new, _ = run(ChangePointDetector(sensor_types=['DISK_USAGE']), values)
+    assert new == [], new
+
+
+def test_slow_drift_is_one_alert():
+    """Disk usage creeping up 0.01%/reading never crosses a band but is caught once"""
+    rng = random.Random(7)
+    values = [45 + rng.uniform(-2, 3) + max(0, i - 1000) * 0.01 for i in range(6000)]
+    new, continued = run(ChangePointDetector(sensor_types=['DISK_USAGE']), values)
+
+    assert len(new) == 1 and continued > 0
+    index, change = new[0]
+    assert 1000 < index < 1300 and change['direction'] == 'UP'
+
+
+def test_ignores_other_sensor_types():
+    detector = ChangePointDetector(sensor_types=['DISK_USAGE'])
+    assert detector.update('rpi', 'GAS', 0.9) is None
+    assert detector.get_stats()['streams'] == 0
+
+
+if __name__ == '__main__':
+    test_stationary_with_spikes()
+    test_slow_drift_is_one_alert()
+    test_ignores_other_sensor_types()
+    print("✓ Change-point detector tests passed!")
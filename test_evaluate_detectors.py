@@ -0,0 +1,130 @@
+"""
+Detector Evaluation Test
+Checks the ground truth the sensor simulator attaches to its readings and
+the metrics evaluate_detectors computes from it, including severities that
+are not in the confusion matrix
+"""
+import os
+import sys
+import tempfile
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from django.core.management import call_command
+
+from dashboard.management.commands.evaluate_detectors import OTHER, Command
+from simulator.utils.sensors import SensorSimulator
+
+# Anomalies often enough that every labeled branch shows up in a short run
+CONFIG = {'sensors': {'temperature': {'anomaly_chance': 0.3}, 'humidity': {'anomaly_chance': 0.3},
+                      'gas': {'anomaly_chance': 0.5}, 'flame': {'anomaly_chance': 0.5},
+                      'light': {'anomaly_chance': 0.3}}}
+
+# Value range of each labeled severity for the sensors that encode one (no privacy noise)
+SEVERITY_RANGES = {
+    'GAS': {'LOW': (0.36, 0.50), 'MEDIUM': (0.51, 0.65), 'HIGH': (0.66, 0.75), 'CRITICAL': (0.76, 0.90)},
+    'FLAME': {'LOW': (0.16, 0.35), 'MEDIUM': (0.36, 0.55), 'HIGH': (0.56, 0.70), 'CRITICAL': (0.71, 0.95)},
+}
+
+
+def test_labeled_readings():
+    start = datetime(2025, 1, 6, tzinfo=timezone.utc)
+    rows = list(SensorSimulator(CONFIG, seed=7).labeled_readings(400, device_id='EVAL', start=start, interval=5))
+
+    assert len(rows) == 400 * len(SensorSimulator.SENSORS)
+    assert rows == list(SensorSimulator(CONFIG, seed=7).labeled_readings(400, device_id='EVAL', start=start,
+                                                                          interval=5))
+    assert rows[6]['timestamp'] == (start + timedelta(seconds=5)).isoformat()
+    assert [row['sensor_type'] for row in rows[:6]] == [sensor for sensor, _, _ in SensorSimulator.SENSORS]
+
+    seen = set()
+    for row in rows:
+        sensor_type, value = row['sensor_type'], row['value']
+        assert row['device_id'] == 'EVAL'
+        if not row['label_anomaly']:
+            assert row['label_severity'] is None
+            continue
+        seen.add((sensor_type, row['label_severity']))
+        if sensor_type in SEVERITY_RANGES:
+            low, high = SEVERITY_RANGES[sensor_type][row['label_severity']]
+            assert low - 0.005 <= value <= high + 0.005, row
+        elif sensor_type == 'HUMIDITY':
+            assert value >= 85 and row['label_severity'] is None
+        elif sensor_type == 'TEMPERATURE':
+            assert (40 <= value <= 50 or 5 <= value <= 15) and row['label_severity'] is None
+        elif sensor_type == 'LIGHT':
+            assert (value <= 50 or value >= 900) and row['label_severity'] is None
+        else:
+            # Motion is activity, never an anomaly
+            assert False, row
+
+    for sensor_type, ranges in SEVERITY_RANGES.items():
+        assert {(sensor_type, severity) for severity in ranges} <= seen
+
+
+def test_evaluation_metrics():
+    def row(value, anomaly, severity=None):
+        return {'sensor_type': 'GAS', 'value': value, 'label_anomaly': anomaly, 'label_severity': severity}
+
+    rows = [
+        row(0.9, True, 'CRITICAL'),   # TP, severity right
+        row(0.7, True, 'HIGH'),       # TP, predicted 'SEVERE' - not a known severity
+        row(0.6, True, 'MEDIUM'),     # FN
+        row(0.55, True, 'Extreme'),   # TP, unknown label
+        row(0.2, False),              # FP
+        row(0.1, False),              # TN (abstained)
+        row(0.05, False),             # TN
+    ]
+    predictions = {
+        0.9: {'anomaly': True, 'severity': 'CRITICAL'},
+        0.7: {'anomaly': True, 'severity': 'SEVERE'},
+        0.6: {'anomaly': False},
+        0.55: {'anomaly': True, 'severity': 'medium'},
+        0.2: {'anomaly': True, 'severity': 'LOW'},
+        0.1: None,
+        0.05: {'anomaly': False},
+    }
+
+    def analyze(reading):
+        assert not any(key.startswith('label_') for key in reading)
+        return predictions[reading['value']]
+
+    result = Command._evaluate(analyze, rows)
+    assert (result['tp'], result['fp'], result['fn'], result['tn'], result['abstained']) == (3, 1, 1, 2, 1)
+    assert result['precision'] == 0.75 and result['recall'] == 0.75
+    confusion = result['severity_confusion']
+    assert confusion['CRITICAL']['CRITICAL'] == 1
+    assert confusion['HIGH'][OTHER] == 1
+    assert confusion['MEDIUM']['NONE'] == 1
+    assert confusion[OTHER]['MEDIUM'] == 1
+    assert result['severity_accuracy'] == 0.25
+
+
+def test_command_report():
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'report.json')
+        call_command('evaluate_detectors', rounds=300, seed=3, detectors='rules', output=output,
+                     stdout=io.StringIO())
+        with open(output) as f:
+            report = json.load(f)
+
+    assert report['dataset']['readings'] == 300 * len(SensorSimulator.SENSORS)
+    rules = report['detectors']['rules']
+    assert rules['tp'] + rules['fp'] + rules['fn'] + rules['tn'] == rules['readings']
+    # Labeled gas and flame anomalies are inside the rules' alert bands
+    assert rules['recall'] > 0.5 and rules['severity_accuracy'] > 0.5
+
+
+if __name__ == '__main__':
+    test_labeled_readings()
+    test_evaluation_metrics()
+    test_command_report()
+    print("✓ Detector evaluation tests passed!")
@@ -0,0 +1,102 @@
+"""
+Explanation Reuse Index Test
+Checks that near-identical alerts reuse a past explanation with the new
+values filled in, and reports the reuse rate and lookup latency on a
+simulated stream of alerts
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from iotshield_backend.explanation_index import ExplanationIndex, fill_template, make_template
+from iotshield_backend.utils.metrics import metrics
+
+START = datetime(2025, 1, 6, 14, 0)
+
+
+def empty_index(**options):
+    index = ExplanationIndex(**options)
+    # Start from nothing instead of the alerts in the local database
+    index._load = lambda *args: None
+    return index
+
+
+def reading(value, when=START, device='Kitchen Node', location='Kitchen'):
+    return {'sensor_type': 'GAS', 'value': value, 'timestamp': when.isoformat(),
+            'device_name': device, 'location': location}
+
+
+def test_template_round_trip():
+    old = reading(0.8)
+    template = make_template("Gas at 0.80 ppm in Kitchen (Kitchen Node), not 0.85 {sic}", old)
+    assert template == "Gas at {value} ppm in {location} ({device_name}), not 0.85 {{sic}}", template
+
+    new = reading(0.82, device='Garage Node', location='Garage')
+    assert fill_template(template, new) == "Gas at 0.82 ppm in Garage (Garage Node), not 0.85 {sic}"
+
+
+def test_reuses_only_close_readings():
+    index = empty_index(max_distance=0.05)
+    index.add(reading(0.8), 'HIGH', {'explanation': 'Gas is 0.8 ppm', 'suggestion': 'Ventilate Kitchen'},
+              alert_id=1)
+
+    hit = index.lookup(reading(0.805, device='Garage Node', location='Garage'), 'HIGH')
+    assert hit['reused_from'] == 1
+    assert hit['explanation'] == 'Gas is 0.805 ppm' and hit['suggestion'] == 'Ventilate Garage'
+
+    # Different severity, a far-off value, or the middle of the night don't match
+    assert index.lookup(reading(0.805), 'CRITICAL') is None
+    assert index.lookup(reading(0.9), 'HIGH') is None
+    assert index.lookup(reading(0.805, when=START.replace(hour=2)), 'HIGH') is None
+
+
+def test_prefers_same_location():
+    index = empty_index(max_distance=0.05)
+    index.add(reading(0.8), 'HIGH', {'explanation': 'Gas is 0.8 ppm', 'suggestion': 'Ventilate'}, alert_id=1)
+    index.add(reading(0.802, device='Garage Node', location='Garage'), 'HIGH',
+              {'explanation': 'Gas is 0.802 ppm', 'suggestion': 'Open the garage door'}, alert_id=2)
+
+    # The Garage value is closer, but the Kitchen explanation is from the same place
+    assert index.lookup(reading(0.802), 'HIGH')['reused_from'] == 1
+    assert index.lookup(reading(0.8, device='Garage Node', location='Garage'), 'HIGH')['reused_from'] == 2
+
+    # Another location only matches a very close value
+    index = empty_index(max_distance=0.05)
+    index.add(reading(0.8), 'HIGH', {'explanation': 'Gas is 0.8 ppm', 'suggestion': 'Ventilate'}, alert_id=1)
+    assert index.lookup(reading(0.815), 'HIGH')['reused_from'] == 1
+    assert index.lookup(reading(0.815, device='Attic Node', location='Attic'), 'HIGH') is None
+    assert index.lookup(reading(0.805, device='Attic Node', location='Attic'), 'HIGH')['reused_from'] == 1
+
+
+def test_reuse_rate_on_alert_stream():
+    """Most alerts of a recurring incident type are served from the index"""
+    metrics.reset()
+    rng = random.Random(42)
+    index = empty_index(capacity=200)
+    live = 0
+    for i in range(2000):
+        sensor = reading(round(rng.uniform(0.56, 0.70), 3), when=START + timedelta(minutes=17 * i))
+        if index.lookup(sensor, 'HIGH') is None:
+            live += 1
+            index.add(sensor, 'HIGH', {'explanation': f"Gas at {sensor['value']}", 'suggestion': 'Ventilate'})
+
+    stats = index.get_stats()
+    print(f"  reuse rate {stats['reuse_rate']:.1%} ({live} live calls for 2000 alerts), "
+          f"lookup p50 {stats['lookup_ms']['p50']:.3f}ms p99 {stats['lookup_ms']['p99']:.3f}ms")
+    assert stats['reuse_rate'] > 0.8
+    assert stats['entries'] <= 200
+
+
+if __name__ == '__main__':
+    test_template_round_trip()
+    test_reuses_only_close_readings()
+    test_prefers_same_location()
+    test_reuse_rate_on_alert_stream()
+    print("✓ Explanation index tests passed!")
@@ -0,0 +1,159 @@
+"""
+Field Encryption Test
+Checks keyring persistence and rotation, bulk record and queryset
+round trips, that tampered or re-labelled tokens are rejected, and that the
+dashboard and admin show and search encrypted locations as plaintext
+"""
+import os
+import sys
+import tempfile
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from pathlib import Path
+
+from cryptography.exceptions import InvalidTag
+from django.db import transaction
+
+from dashboard.models import Device
+from iotshield_backend.field_encryption import FieldEncryptor, FieldKeyring, KeyringError, is_encrypted
+
+TMP = tempfile.mkdtemp()
+
+
+class _Rollback(Exception):
+    pass
+
+
+def make_encryptor(name='field_keys.json'):
+    return FieldEncryptor(FieldKeyring(Path(TMP) / name))
+
+
+def test_keyring_persists_and_rotates():
+    encryptor = make_encryptor('rotate.json')
+    old_token = encryptor.encrypt_value('Kitchen')
+    old_id = encryptor.key_id_of(old_token)
+
+    new_id = encryptor.keyring.rotate()
+    assert new_id != old_id and encryptor.key_id_of(encryptor.encrypt_value('x')) == new_id
+
+    # A second process reading the same file can decrypt both generations
+    other = make_encryptor('rotate.json')
+    assert other.decrypt_value(old_token) == 'Kitchen'
+    assert [key['active'] for key in other.keyring.keys()] == [False, True]
+
+    try:
+        encryptor.keyring.remove(new_id)
+        assert False, 'removed the active key'
+    except KeyringError:
+        pass
+    encryptor.keyring.remove(old_id)
+    assert encryptor.reveal(old_token, default='?') == '?'
+
+
+def test_bulk_records_round_trip():
+    encryptor = make_encryptor()
+    records = [{'location': f'Room {i}', 'value': i} for i in range(1000)] + [{'location': None}]
+    assert encryptor.encrypt_records(records, 'location') == 1000
+    assert all(is_encrypted(r['location']) and r['location_encrypted'] for r in records[:1000])
+    # Already-encrypted values aren't encrypted twice
+    assert encryptor.encrypt_records(records, 'location') == 0
+
+    assert encryptor.decrypt_records(records, 'location') == 1000
+    assert records[999] == {'location': 'Room 999', 'value': 999}
+    assert records[1000] == {'location': None}
+
+
+def test_tampered_tokens_are_rejected():
+    encryptor = make_encryptor('tamper.json')
+    token = encryptor.encrypt_value('Bedroom')
+    other_id = encryptor.keyring.rotate()
+    _, old_id, sealed = token.split(':', 2)
+    for bad in (token[:-2] + ('AA' if not token.endswith('AA') else 'BB'),
+                # Same ciphertext claimed under another key id
+                f'fk1:{other_id}:{sealed}'):
+        try:
+            encryptor.decrypt_value(bad)
+            assert False, 'tampered token decrypted'
+        except (InvalidTag, ValueError):
+            pass
+    assert encryptor.decrypt_value('plain text') == 'plain text'
+
+
+def test_queryset_encrypt_and_reencrypt():
+    encryptor = make_encryptor('queryset.json')
+    try:
+        # Everything is rolled back so the local database is untouched
+        with transaction.atomic():
+            Device.objects.bulk_create([Device(device_id=f'TEST_ENC_{i}', device_type='ESP32', name=f'Node {i}',
+                                               location=f'Garage {i}') for i in range(25)])
+            devices = Device.objects.filter(device_id__startswith='TEST_ENC_')
+            assert encryptor.encrypt_queryset(devices, 'location', batch_size=10) == 25
+            first_key = encryptor.keyring.active_id
+            assert all(encryptor.key_id_of(v) == first_key for v in devices.values_list('location', flat=True))
+
+            encryptor.keyring.rotate()
+            assert encryptor.reencrypt_queryset(devices, 'location', batch_size=10) == 25
+            assert encryptor.reencrypt_queryset(devices, 'location') == 0
+
+            assert encryptor.decrypt_queryset(devices, 'location') == 25
+            assert devices.get(device_id='TEST_ENC_7').location == 'Garage 7'
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def test_admin_and_template_show_plaintext():
+    from django.contrib import admin
+    from django.template.loader import render_to_string
+    from django.test import RequestFactory
+
+    from dashboard.admin import DeviceAdminForm
+    from iotshield_backend.field_encryption import field_encryptor
+
+    # The shared encryptor (used by the model, admin and templates) on a scratch keyring
+    original, field_encryptor.keyring = field_encryptor.keyring, FieldKeyring(Path(TMP) / 'display.json')
+    try:
+        with transaction.atomic():
+            kitchen = Device.objects.create(device_id='TEST_ENC_K', device_type='ESP32', name='Node K',
+                                            location=field_encryptor.encrypt_value('Kitchen'))
+            Device.objects.create(device_id='TEST_ENC_G', device_type='ESP32', name='Node G', location='Garage')
+            devices = Device.objects.filter(device_id__startswith='TEST_ENC_')
+            assert kitchen.location_plaintext == 'Kitchen'
+
+            html = render_to_string('devices.html', {'devices': devices})
+            assert 'Kitchen' in html and 'fk1:' not in html
+
+            model_admin = admin.site._registry[Device]
+            assert model_admin.location_display(kitchen) == 'Kitchen'
+            request = RequestFactory().get('/admin/dashboard/device/')
+            searches = [('kitch', {'TEST_ENC_K'}), ('garage', {'TEST_ENC_G'}), ('node', {'TEST_ENC_K', 'TEST_ENC_G'})]
+            for term, expected in searches:
+                results, _ = model_admin.get_search_results(request, devices, term)
+                assert {d.device_id for d in results} == expected, term
+
+            # The change form edits plaintext and keeps the value encrypted
+            form = DeviceAdminForm(instance=kitchen)
+            assert form.initial['location'] == 'Kitchen'
+            data = {'device_id': 'TEST_ENC_K', 'device_type': 'ESP32', 'name': 'Node K', 'location': 'Pantry',
+                    'is_active': 'on'}
+            saved = DeviceAdminForm(data, instance=kitchen).save()
+            assert is_encrypted(saved.location) and saved.location_plaintext == 'Pantry'
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        field_encryptor.keyring = original
+
+
+if __name__ == '__main__':
+    test_keyring_persists_and_rotates()
+    test_bulk_records_round_trip()
+    test_tampered_tokens_are_rejected()
+    test_queryset_encrypt_and_reencrypt()
+    test_admin_and_template_show_plaintext()
+    print("✓ Field encryption tests passed!")
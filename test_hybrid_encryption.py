@@ -0,0 +1,110 @@
+"""
+Hybrid Envelope Encryption Test
+Checks RSA-AES-GCM envelopes (session key caching, expiry, tampering,
+batched payloads), that legacy RSA-OAEP payloads still decrypt, and
+compares the per-message decrypt cost of both schemes
+"""
+import os
+import sys
+import tempfile
+import time
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from django.test import override_settings
+
+# RSA keys created on import go to a scratch directory, never into keys/
+os.environ.setdefault('RSA_KEYS_DIR', tempfile.mkdtemp())
+with override_settings(RSA_KEYS_DIR=os.environ['RSA_KEYS_DIR']):
+    from iotshield_backend.privacy_engine import RSAEncryption, SessionKeyCache
+
+READING = {'device_id': 'ESP32_001', 'sensor_type': 'TEMPERATURE', 'value': 25.5, 'unit': '°C'}
+
+
+def make_rsa():
+    rsa = RSAEncryption()
+    # Private cache so tests don't depend on each other
+    rsa.session_keys = SessionKeyCache(max_size=4, ttl=3600)
+    return rsa
+
+
+def test_hybrid_round_trip_and_legacy():
+    rsa = make_rsa()
+    session = rsa.new_session_key()
+
+    first = rsa.encrypt_hybrid_payload(READING, session)
+    assert rsa.decrypt_mqtt_payload(first) == READING
+    # Later messages can leave out the wrapped key
+    assert rsa.decrypt_mqtt_payload(rsa.encrypt_hybrid_payload(READING, session, include_key=False)) == READING
+
+    # Any size works - a batch of readings in one message
+    batch = [dict(READING, value=i) for i in range(500)]
+    assert rsa.decrypt_mqtt_payload(rsa.encrypt_hybrid_payload(batch, session)) == batch
+
+    assert rsa.decrypt_mqtt_payload(rsa.encrypt_mqtt_payload(READING)) == READING
+
+
+def test_rejects_unknown_tampered_and_rebound_keys():
+    rsa = make_rsa()
+    session, other = rsa.new_session_key(), rsa.new_session_key()
+
+    # Key never seen and not included
+    envelope = rsa.encrypt_hybrid_payload(READING, session, include_key=False)
+    assert rsa.decrypt_mqtt_payload(envelope) == envelope
+
+    # Flipped ciphertext byte fails authentication
+    envelope = rsa.encrypt_hybrid_payload(READING, session)
+    data = bytearray(envelope['data'].encode())
+    data[10] = ord('A') if data[10] != ord('A') else ord('B')
+    tampered = dict(envelope, data=data.decode())
+    assert rsa.decrypt_mqtt_payload(tampered) == tampered
+
+    # Another key can't be registered under an existing key id
+    rebound = dict(rsa.encrypt_hybrid_payload(READING, other), key_id=session['key_id'])
+    assert rsa.decrypt_mqtt_payload(rebound) == rebound
+
+
+def test_session_key_expiry():
+    rsa = make_rsa()
+    rsa.session_keys.ttl = 0.05
+    session = rsa.new_session_key()
+    assert rsa.decrypt_mqtt_payload(rsa.encrypt_hybrid_payload(READING, session)) == READING
+    time.sleep(0.1)
+    envelope = rsa.encrypt_hybrid_payload(READING, session, include_key=False)
+    assert rsa.decrypt_mqtt_payload(envelope) == envelope
+    assert len(rsa.session_keys) == 0
+
+
+def test_decrypt_cost():
+    rsa = make_rsa()
+    session = rsa.new_session_key()
+    n = 200
+    legacy = [rsa.encrypt_mqtt_payload(READING) for _ in range(n)]
+    hybrid = [rsa.encrypt_hybrid_payload(READING, session) for _ in range(n)]
+    rsa.decrypt_mqtt_payload(hybrid[0])
+
+    started = time.perf_counter()
+    for envelope in legacy:
+        rsa.decrypt_mqtt_payload(envelope)
+    legacy_us = (time.perf_counter() - started) / n * 1e6
+
+    started = time.perf_counter()
+    for envelope in hybrid:
+        rsa.decrypt_mqtt_payload(envelope)
+    hybrid_us = (time.perf_counter() - started) / n * 1e6
+
+    print(f"  RSA-OAEP {legacy_us:.0f}us/message, RSA-AES-GCM (cached key) {hybrid_us:.1f}us/message "
+          f"({legacy_us / hybrid_us:.0f}x)")
+    assert legacy_us / hybrid_us > 20
+
+
+if __name__ == '__main__':
+    test_hybrid_round_trip_and_legacy()
+    test_rejects_unknown_tampered_and_rebound_keys()
+    test_session_key_expiry()
+    test_decrypt_cost()
+    print("✓ Hybrid encryption tests passed!")
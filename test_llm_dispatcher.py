@@ -0,0 +1,82 @@
+"""
+LLM Dispatcher Test
+Checks that severe jobs jump the queue and stale low-priority jobs fall back
+"""
+import os
+import sys
+import threading
+import time
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from iotshield_backend.llm_dispatcher import LLMDispatcher
+
+
+def test_priority_order_and_expiry():
+    """With one busy worker, queued jobs run CRITICAL first and stale LOW jobs expire"""
+    dispatcher = LLMDispatcher(workers=1, max_age={'LOW': 5, 'MEDIUM': 60, 'HIGH': 60, 'CRITICAL': None})
+    gate = threading.Event()
+    order = []
+
+    # Occupy the only worker so the rest queue up
+    blocker = dispatcher.submit(gate.wait, severity='CRITICAL')
+    time.sleep(0.05)
+
+    now = time.time()
+    jobs = [
+        dispatcher.submit(lambda: order.append('low'), 'LOW', now),
+        dispatcher.submit(lambda: order.append('stale'), 'LOW', now - 30, fallback=lambda: 'rule'),
+        dispatcher.submit(lambda: order.append('medium'), 'MEDIUM', now),
+        dispatcher.submit(lambda: order.append('critical-new'), 'CRITICAL', now),
+        dispatcher.submit(lambda: order.append('critical-old'), 'CRITICAL', now - 10),
+    ]
+    gate.set()
+    blocker.result(timeout=5)
+    results = [job.result(timeout=5) for job in jobs]
+
+    assert order == ['critical-old', 'critical-new', 'medium', 'low'], order
+    assert results[1] == 'rule'
+
+
+def test_queue_is_bounded():
+    """Overflow sheds the lowest-priority job through its fallback"""
+    dispatcher = LLMDispatcher(workers=1, max_queue=2)
+    gate = threading.Event()
+    blocker = dispatcher.submit(gate.wait, severity='CRITICAL')
+    time.sleep(0.05)
+
+    low = dispatcher.submit(lambda: 'llm', 'LOW', fallback=lambda: 'shed')
+    high = dispatcher.submit(lambda: 'llm', 'HIGH')
+    critical = dispatcher.submit(lambda: 'llm', 'CRITICAL')
+    assert low.result(timeout=1) == 'shed'
+
+    gate.set()
+    blocker.result(timeout=5)
+    assert high.result(timeout=5) == 'llm' and critical.result(timeout=5) == 'llm'
+
+
+def test_hold_buffers_jobs_until_release():
+    """Jobs submitted during warm-up wait, then run in priority order"""
+    dispatcher = LLMDispatcher(workers=1)
+    order = []
+    dispatcher.hold()
+    low = dispatcher.submit(lambda: order.append('low'), 'LOW')
+    high = dispatcher.submit(lambda: order.append('high'), 'HIGH')
+    time.sleep(0.1)
+    assert order == [] and not low.done()
+
+    dispatcher.release()
+    low.result(timeout=5)
+    high.result(timeout=5)
+    assert order == ['high', 'low'], order
+
+
+if __name__ == '__main__':
+    test_priority_order_and_expiry()
+    test_queue_is_bounded()
+    test_hold_buffers_jobs_until_release()
+    print("✓ LLM dispatcher tests passed!")
@@ -0,0 +1,128 @@
+"""
+LLM Response Parser Test
+Checks the strict parser, the repair fallback and the detector's retry
+policy on responses typical of small models
+"""
+import json
+import os
+import sys
+import tempfile
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from django.core.management import call_command
+
+from iotshield_backend.llm_response import ResponseParseError, parse_response, repair_response
+from iotshield_backend.llm_telemetry import LLMTelemetryWriter
+from iotshield_backend import ollama_anomaly_detector
+from iotshield_backend.ollama_anomaly_detector import OllamaAnomalyDetector
+
+VALID = '{"anomaly": true, "explanation": "Gas is high.", "severity": "HIGH", "suggestion": "Ventilate."}'
+
+# (response, strict parse ok?, repairable?)
+CORPUS = [
+    (VALID, True, True),
+    ('```json\n' + VALID + '\n```', True, True),
+    ('Here is my analysis:\n' + VALID + '\nLet me know {if} you need more.', True, True),
+    ('{"anomaly": "true", "explanation": "x", "severity": "high", "suggestion": "y",}', False, True),
+    ('{"anomaly": 1, "explanation": "x", "severity": "Moderate", "suggestion": "y"}', False, True),
+    ('{"anomaly": false, "severity": "LOW"}', False, True),
+    ('{"anomaly": false, "explanation": "x", "severity": "UNKNOWN", "suggestion": "y"}', False, False),
+    ('{"explanation": "cut off mid', False, False),
+    ('The reading looks normal.', False, False),
+]
+
+
+def test_strict_and_repair():
+    for text, strict_ok, repairable in CORPUS:
+        try:
+            result = parse_response(text)
+            assert strict_ok, text
+            assert result['severity'] == 'HIGH' and result['anomaly'] is True
+        except ResponseParseError:
+            assert not strict_ok, text
+
+        try:
+            result = repair_response(text)
+            assert repairable, text
+            assert isinstance(result['anomaly'], bool) and result['severity'] in ('LOW', 'MEDIUM', 'HIGH')
+        except ResponseParseError as e:
+            assert not repairable, (text, e)
+
+
+def test_retries_only_unrepairable_responses():
+    detector = OllamaAnomalyDetector(hosts=['http://127.0.0.1:9'])
+    detector.parse_retries = 1
+    replies = iter(['The reading looks normal.', VALID])
+    calls = []
+
+    def fake_generate(prompt, options=None):
+        calls.append(options)
+        return next(replies), {'endpoint': 'stand-in', 'usage': {}}
+
+    detector._generate = fake_generate
+    writer = LLMTelemetryWriter(batch_size=1000, flush_interval=3600)
+    original, ollama_anomaly_detector.llm_telemetry = ollama_anomaly_detector.llm_telemetry, writer
+    try:
+        result = detector.explain({'sensor_type': 'GAS', 'value': 0.8}, 'HIGH')
+    finally:
+        ollama_anomaly_detector.llm_telemetry = original
+
+    assert result['severity'] == 'HIGH'
+    # The retry decodes greedily
+    assert calls == [None, {'temperature': 0}]
+    statuses = [writer._buffer.pop()['status'] for _ in range(2)]
+    assert statuses == ['OK', 'PARSE_ERROR']
+
+
+def test_unparseable_after_retries_raises():
+    detector = OllamaAnomalyDetector(hosts=['http://127.0.0.1:9'])
+    detector.parse_retries = 1
+    detector._generate = lambda prompt, options=None: ('The reading looks normal.', {'endpoint': 'stand-in',
+                                                                                    'usage': {}})
+    writer = LLMTelemetryWriter(batch_size=1000, flush_interval=3600)
+    original, ollama_anomaly_detector.llm_telemetry = ollama_anomaly_detector.llm_telemetry, writer
+    try:
+        # explain() must not hand back a made-up "normal" answer
+        try:
+            detector.explain({'sensor_type': 'GAS', 'value': 0.8}, 'HIGH')
+            assert False, 'explain() returned after unparseable responses'
+        except ResponseParseError as e:
+            assert e.reason == 'unparseable'
+
+        # analyze() falls back to the rule-based verdict instead
+        result = detector.analyze({'sensor_type': 'GAS', 'value': 0.8})
+    finally:
+        ollama_anomaly_detector.llm_telemetry = original
+    assert result['anomaly'] is True and result['severity'] == 'CRITICAL'
+
+
+def test_benchmark_command():
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+        for text, _, _ in CORPUS:
+            f.write(json.dumps({'response': text}) + '\n')
+    try:
+        output = f.name + '.report.json'
+        call_command('benchmark_llm_parser', corpus=f.name, repeat=5, output=output)
+        with open(output) as report_file:
+            report = json.load(report_file)
+        os.remove(output)
+    finally:
+        os.remove(f.name)
+
+    parsers = report['parsers']
+    assert parsers['strict']['failures'] == 6
+    assert parsers['strict+repair']['failures'] == 3
+    assert parsers['strict+repair']['failures'] < parsers['legacy']['failures']
+
+
+if __name__ == '__main__':
+    test_strict_and_repair()
+    test_retries_only_unrepairable_responses()
+    test_unparseable_after_retries_raises()
+    test_benchmark_command()
+    print("✓ LLM response parser tests passed!")
@@ -0,0 +1,191 @@
+"""
+Ollama Endpoint Pool Test
+Runs the detector against local stand-in Ollama servers to check load
+balancing, failover and ejection of dead or slow hosts
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from iotshield_backend import ollama_anomaly_detector
+from iotshield_backend.adaptive_concurrency import AIMDLimiter
+from iotshield_backend.llm_telemetry import LLMTelemetryWriter
+from iotshield_backend.ollama_anomaly_detector import OllamaAnomalyDetector
+from iotshield_backend.ollama_pool import OllamaEndpointPool
+from iotshield_backend.utils.metrics import metrics
+
+RESPONSE = {'anomaly': True, 'explanation': 'stand-in', 'severity': 'HIGH', 'suggestion': 'none'}
+
+
+def start_stand_in(delay):
+    """
+    Minimal Ollama look-alike answering /api/generate after `delay` seconds
+    (or delay(n) seconds when n generations are running at once)
+    """
+    hits = []
+    active = [0]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._reply({'models': [{'name': 'llama3.2:1b'}]})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            hits.append(time.time())
+            with lock:
+                active[0] += 1
+                n = active[0]
+            time.sleep(delay(n) if callable(delay) else delay)
+            with lock:
+                active[0] -= 1
+            self._reply({
+                'response': json.dumps(RESPONSE),
+                'prompt_eval_count': 120, 'eval_count': 40,
+                'total_duration': 250_000_000, 'load_duration': 5_000_000,
+                'prompt_eval_duration': 50_000_000, 'eval_duration': 200_000_000,
+            })
+
+        def _reply(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", hits
+
+
+def dead_host():
+    """URL of a port nothing listens on"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def make_detector(hosts, **pool_options):
+    detector = OllamaAnomalyDetector(hosts=hosts)
+    # Private pool so tests don't share state through get_endpoint_pool()
+    detector.pool = OllamaEndpointPool(hosts, check_interval=0, **pool_options)
+    return detector
+
+
+def test_balances_toward_faster_host():
+    fast, fast_hits = start_stand_in(0.01)
+    slow, slow_hits = start_stand_in(0.05)
+    detector = make_detector([fast, slow], slow_factor=100)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: detector._call_ollama_api('prompt'), range(60)))
+
+    assert all(json.loads(r)['severity'] == 'HIGH' for r in results)
+    assert len(fast_hits) > len(slow_hits) > 0, (len(fast_hits), len(slow_hits))
+
+
+def test_fails_over_and_ejects_dead_host():
+    live, hits = start_stand_in(0)
+    dead = dead_host()
+    detector = make_detector([dead, live], eject_failures=2)
+
+    for _ in range(5):
+        assert detector._call_ollama_api('prompt')
+    assert len(hits) == 5
+
+    stats = {e['url']: e for e in detector.pool.get_stats()}
+    assert not stats[dead]['healthy'] and stats[dead]['eject_reason'] == 'errors'
+    # Once ejected, the dead host isn't tried any more
+    assert stats[dead]['consecutive_failures'] == 2
+
+
+def test_ejects_slow_host_and_readmits():
+    fast_a, _ = start_stand_in(0.005)
+    fast_b, _ = start_stand_in(0.005)
+    slow, _ = start_stand_in(0.1)
+    pool = OllamaEndpointPool([fast_a, fast_b, slow], check_interval=0, eject_seconds=1,
+                              strategy='least_inflight')
+    detector = make_detector([fast_a])
+    detector.pool = pool
+
+    for _ in range(9):
+        detector._call_ollama_api('prompt')
+    stats = {e['url']: e for e in pool.get_stats()}
+    assert stats[slow]['eject_reason'] == 'slow'
+
+    # Active check re-admits it once the ejection has run out
+    time.sleep(1.1)
+    pool.check_health()
+    assert all(e['healthy'] for e in pool.get_stats())
+
+
+def test_adaptive_limit_converges():
+    """Latency grows with parallel generations; the limit settles near target"""
+    # 20 ms per generation running at once -> 100 ms target allows about 5
+    host, _ = start_stand_in(lambda n: 0.02 * n)
+    detector = make_detector([host])
+    endpoint = detector.pool.endpoints[0]
+    endpoint.limiter = AIMDLimiter(name=host, initial=1, max_limit=16, target_latency_ms=100)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: detector._call_ollama_api('prompt'), range(300)))
+
+    decisions = metrics.snapshot()['counters']
+    assert decisions.get(f"ollama_limit_decisions{{decision=increase,endpoint={host}}}", 0) > 0
+    assert decisions.get(f"ollama_limit_decisions{{decision=decrease,endpoint={host}}}", 0) > 0
+    assert 2 <= endpoint.limiter.current <= 8, endpoint.limiter.current
+
+
+def test_records_call_telemetry():
+    """Token counts and durations from the response end up in the telemetry buffer"""
+    host, _ = start_stand_in(0)
+    detector = make_detector([host])
+    writer = LLMTelemetryWriter(batch_size=1000, flush_interval=3600)
+    original, ollama_anomaly_detector.llm_telemetry = ollama_anomaly_detector.llm_telemetry, writer
+    try:
+        result = detector.analyze({'sensor_type': 'GAS', 'value': 0.8, 'unit': 'ppm'})
+    finally:
+        ollama_anomaly_detector.llm_telemetry = original
+    assert result['severity'] == 'HIGH'
+
+    # Nothing is written to the database by this test
+    entry = writer._buffer.pop()
+    assert entry['status'] == 'OK' and entry['purpose'] == 'analyze' and entry['endpoint'] == host
+    assert entry['prompt_tokens'] == 120 and entry['generated_tokens'] == 40
+    assert entry['eval_ms'] == 200.0 and entry['load_ms'] == 5.0
+
+
+def test_warm_up_loads_every_host():
+    """Model load plus one throwaway generation per host, dead hosts reported"""
+    live, hits = start_stand_in(0)
+    dead = dead_host()
+    detector = make_detector([live, dead])
+
+    report = detector.warm_up()
+    assert report[live]['ok'] and report[live]['generate_ms'] is not None
+    assert not report[dead]['ok']
+    assert len(hits) == 2
+
+
+if __name__ == '__main__':
+    test_balances_toward_faster_host()
+    test_fails_over_and_ejects_dead_host()
+    test_ejects_slow_host_and_readmits()
+    test_adaptive_limit_converges()
+    test_records_call_telemetry()
+    test_warm_up_loads_every_host()
+    print("✓ Ollama endpoint pool tests passed!")
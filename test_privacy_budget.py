@@ -0,0 +1,107 @@
+"""
+Privacy Budget Accountant Test
+Checks zCDP composition, all-or-nothing charging, refusal once exhausted,
+and that persisted spend is shared between accountant instances
+"""
+import os
+import sys
+import tempfile
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from django.db import transaction
+from django.test import override_settings
+
+# RSA keys created on import go to a scratch directory, never into keys/
+os.environ.setdefault('RSA_KEYS_DIR', tempfile.mkdtemp())
+with override_settings(RSA_KEYS_DIR=os.environ['RSA_KEYS_DIR']):
+    from iotshield_backend.privacy_budget import (
+        PrivacyAccountant, ReleaseCache, epsilon_to_rho, gaussian_rho, rho_to_epsilon,
+    )
+    from iotshield_backend.privacy_engine import PrivacyEngine
+
+KEY = ('TEST_DEVICE', 'TEMPERATURE', 'test-consumer')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def memory_accountant(**options):
+    accountant = PrivacyAccountant(**options)
+    # Start empty instead of reading the local database
+    accountant._loaded = True
+    return accountant
+
+
+def test_composition_is_tighter_than_linear():
+    engine = PrivacyEngine(epsilon=0.5, delta=1e-5)
+    assert engine.calculate_privacy_loss(1) == 0.5
+    # 100 releases: linear composition says 50, zCDP much less
+    composed = engine.calculate_privacy_loss(100, delta=1e-6)
+    assert composed < 15, composed
+
+    # Conversions are inverse of each other
+    rho = epsilon_to_rho(10.0, 1e-6)
+    assert abs(rho_to_epsilon(rho, 1e-6) - 10.0) < 1e-9
+
+
+def test_refuses_once_exhausted():
+    accountant = memory_accountant(epsilon_budget=5.0, delta=1e-6)
+    rho = gaussian_rho(0.5, 1e-5)
+    other = ('TEST_DEVICE', 'HUMIDITY', 'test-consumer')
+
+    served = 0
+    while not accountant.charge([KEY], rho, 0.5):
+        served += 1
+    spent = accountant.spent(KEY)
+    assert spent['epsilon'] <= 5.0 and spent['releases'] == served
+    # Far more releases than linear composition (5.0 / 0.5 = 10) would allow
+    assert served > 10, served
+
+    # All or nothing: the fresh stream isn't charged when its partner is exhausted
+    assert accountant.charge([KEY, other], rho, 0.5) == [KEY]
+    assert accountant.spent(other)['releases'] == 0
+    accountant._spend.clear()
+
+
+def test_release_cache_is_bounded():
+    cache = ReleaseCache(max_size=2)
+    for i in range(3):
+        cache.put(i, {'data': i})
+    assert cache.get(0) is None and cache.get(2) == {'data': 2}
+
+
+def test_flush_persists_increments():
+    """Two accountants (like two processes) see each other's spend after a flush"""
+    rho = gaussian_rho(0.5, 1e-5)
+    try:
+        # Everything is rolled back so the local database is untouched
+        with transaction.atomic():
+            first, second = PrivacyAccountant(), PrivacyAccountant()
+            first.load()
+            second.load()
+            first.charge([KEY], rho, 0.5)
+            second.charge([KEY], rho, 0.5)
+            assert first.flush() == 1 and second.flush() == 1
+
+            first.load()
+            assert first.spent(KEY)['releases'] == 2
+            assert abs(first.spent(KEY)['rho'] - 2 * rho) < 1e-12
+            raise _Rollback
+    except _Rollback:
+        pass
+    first._spend.clear()
+    second._spend.clear()
+
+
+if __name__ == '__main__':
+    test_composition_is_tighter_than_linear()
+    test_refuses_once_exhausted()
+    test_release_cache_is_bounded()
+    test_flush_persists_increments()
+    print("✓ Privacy budget tests passed!")
@@ -0,0 +1,221 @@
+"""
+Sensor Rollup Test
+Checks that incrementally written 1m/1h/1d rollups answer summaries and
+chart series exactly like the raw readings, that the planner covers a range
+without gaps or overlaps, that a rebuild repairs stale buckets without
+erasing history whose readings or minute rollups retention already deleted,
+and that private chart series carry no exact per-bucket statistics
+"""
+import json
+import os
+import sys
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from dashboard.models import Device, SensorData, SensorRollupDay, SensorRollupHour, SensorRollupMinute
+from iotshield_backend import rollups
+from iotshield_backend.rollups import DAY, HOUR, MINUTE, RAW, RollupWriter
+
+NOW = datetime(2026, 3, 10, 12, 0, 30, tzinfo=timezone.utc)
+
+
+class _Rollback(Exception):
+    pass
+
+
+def make_readings():
+    device = Device.objects.create(device_id='TEST_ROLLUP', device_type='SIMULATOR', name='Rollup node')
+    readings = [
+        SensorData(device=device, sensor_type='TEMPERATURE' if i % 3 else 'HUMIDITY',
+                   value=20.0 + (i * 7919 % 200) / 10.0, is_anomaly=(i % 41 == 0),
+                   timestamp=NOW - timedelta(seconds=97 * i + 5))
+        for i in range(2700)  # about three days
+    ]
+    SensorData.objects.bulk_create(readings, batch_size=500)
+    return device, readings
+
+
+def raw_stats(device, start, end):
+    rows = SensorData.objects.filter(device=device, timestamp__gte=start, timestamp__lt=end).order_by().values(
+        'sensor_type').annotate(n=Count('id'), s=Sum('value'), lo=Min('value'), hi=Max('value'),
+                                an=Count('id', filter=Q(is_anomaly=True)))
+    return {row['sensor_type']: row for row in rows}
+
+
+def assert_matches_raw(device, start, end):
+    exact = raw_stats(device, start, end)
+    summary = rollups.summarize(start, end, device_id=device.device_id, now=NOW)
+    assert set(summary) == set(exact)
+    for sensor_type, row in exact.items():
+        got = summary[sensor_type]
+        assert got['count'] == row['n'] and got['anomalies'] == row['an'], (sensor_type, got, row)
+        assert got['min_value'] == row['lo'] and got['max_value'] == row['hi']
+        assert abs(got['avg_value'] - row['s'] / row['n']) < 1e-9
+
+
+def test_plan_covers_range_exactly():
+    start = NOW - timedelta(hours=47, seconds=13)
+    pieces = rollups.plan(start, NOW, now=NOW)
+    assert pieces[0][1] == start and pieces[-1][2] == NOW
+    assert all(a[2] == b[1] for a, b in zip(pieces, pieces[1:]))
+    assert [piece[0] for piece in pieces] == [RAW, MINUTE, HOUR, DAY, HOUR, MINUTE, RAW]
+
+    assert rollups.choose_resolution(timedelta(minutes=30), 1500) == RAW
+    assert rollups.choose_resolution(timedelta(hours=24), 1500) == MINUTE
+    assert rollups.choose_resolution(timedelta(days=7), 1500) == HOUR
+    assert rollups.choose_resolution(timedelta(days=365), 100) == DAY
+
+
+def test_incremental_rollups_match_raw():
+    try:
+        # Everything is rolled back so the local database is untouched
+        with transaction.atomic():
+            device, readings = make_readings()
+            writer = RollupWriter()
+            writer._flusher = object()  # flushed by hand, no background thread
+            # Two flushes touch the same buckets - they must add up, not overwrite
+            for reading in readings[:1000]:
+                writer.record(reading)
+            assert writer.flush() > 0
+            for reading in readings[1000:]:
+                writer.record(reading)
+            writer.flush()
+
+            start = NOW - timedelta(hours=47, seconds=13)
+            assert_matches_raw(device, start, NOW)
+            assert_matches_raw(device, NOW - timedelta(minutes=90), NOW - timedelta(minutes=3))
+
+            # Chart points: whole hours from the hour table, the current hour assembled from finer data
+            points = rollups.series(start, NOW, HOUR, sensor_types=['TEMPERATURE'], device_id='TEST_ROLLUP', now=NOW)
+            first = rollups.bucket_start(start, HOUR)
+            # 47 hours: the newest TEMPERATURE reading is at 11:58
+            assert len(points) == 47 and points[0]['timestamp'] == first.isoformat()
+            assert sum(p['count'] for p in points) == raw_stats(device, first, NOW)['TEMPERATURE']['n']
+            assert all(p['min_value'] <= p['value'] <= p['max_value'] for p in points)
+
+            # A rebuild leaves correct buckets alone and repairs stale ones
+            before = sorted(SensorRollupMinute.objects.filter(device=device).values_list(
+                'sensor_type', 'bucket', 'readings', 'anomalies'))
+            SensorRollupMinute.objects.filter(device=device).update(anomalies=0, readings=1)
+            folded = rollups.rebuild(NOW - timedelta(days=4), NOW, now=NOW)
+            assert folded >= len(readings) - 3  # the unsettled last minute is the listener's
+            after = sorted(SensorRollupMinute.objects.filter(device=device).values_list(
+                'sensor_type', 'bucket', 'readings', 'anomalies'))
+            settled = rollups.settled_until(NOW)
+            assert [r for r in after if r[1] < settled] == [r for r in before if r[1] < settled]
+            assert_matches_raw(device, start, NOW - timedelta(minutes=2))
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def test_rebuild_keeps_history_of_purged_levels():
+    def coarse_rows():
+        return {model.__name__: sorted(model.objects.filter(device=device).values_list(
+                    'sensor_type', 'bucket', 'readings', 'anomalies', 'min_value', 'max_value'))
+                for model in (SensorRollupHour, SensorRollupDay)}
+
+    try:
+        with transaction.atomic():
+            device = Device.objects.create(device_id='TEST_ROLLUP', device_type='SIMULATOR', name='Rollup node')
+            # Five months back: past the minute rollups' 90 days, within a year of GAS readings
+            origin = datetime(2025, 10, 11, 6, 0, tzinfo=timezone.utc)
+            readings = SensorData.objects.bulk_create([
+                SensorData(device=device, sensor_type=('GAS', 'TEMPERATURE', 'HUMIDITY')[i % 3],
+                           value=0.1 + i % 17, timestamp=origin + timedelta(seconds=37 * i + 5))
+                for i in range(1500)  # about 15 hours
+            ], batch_size=500)
+            writer = RollupWriter()
+            writer._flusher = object()
+            for reading in readings:
+                writer.record(reading)
+            writer.flush()
+            before = coarse_rows()
+
+            # What retention leaves behind: every minute rollup, the TEMPERATURE readings
+            # and, from a mid-hour minute-aligned cutoff on, the HUMIDITY readings
+            cutoff = origin + timedelta(hours=2, minutes=30)
+            SensorRollupMinute.objects.filter(device=device).delete()
+            SensorData.objects.filter(device=device, sensor_type='TEMPERATURE').delete()
+            SensorData.objects.filter(device=device, sensor_type='HUMIDITY', timestamp__lt=cutoff).delete()
+
+            rollups.rebuild(origin - timedelta(hours=1), origin + timedelta(days=1), now=NOW)
+            assert coarse_rows() == before
+            stored = SensorData.objects.filter(device=device)
+            assert SensorRollupMinute.objects.filter(device=device).aggregate(n=Sum('readings'))['n'] == stored.count()
+
+            # Re-scored readings still reach every level
+            rescored = stored.filter(sensor_type='GAS', timestamp__lt=origin + timedelta(hours=1))
+            flagged = rescored.update(is_anomaly=True)
+            rollups.rebuild(origin - timedelta(hours=1), origin + timedelta(days=1), now=NOW)
+            hour = SensorRollupHour.objects.get(device=device, sensor_type='GAS', bucket=origin)
+            day = SensorRollupDay.objects.get(device=device, sensor_type='GAS', bucket=rollups.bucket_start(origin, DAY))
+            assert flagged and hour.anomalies == day.anomalies == flagged
+            assert coarse_rows()['SensorRollupHour'] == [
+                row if row[:2] != ('GAS', origin) else row[:3] + (flagged,) + row[4:]
+                for row in before['SensorRollupHour']]
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def test_private_series_publishes_only_noisy_values():
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import RequestFactory
+    from django.utils import timezone as django_timezone
+
+    from dashboard import views
+    from iotshield_backend import privacy_budget
+    from iotshield_backend.privacy_budget import PrivacyAccountant, ReleaseCache
+
+    # In-memory budget: nothing is read from or flushed to the local database
+    accountant = PrivacyAccountant()
+    accountant._loaded = True
+    accountant._flusher = object()
+    originals = privacy_budget.privacy_accountant, privacy_budget.release_cache
+    privacy_budget.privacy_accountant, privacy_budget.release_cache = accountant, ReleaseCache()
+    try:
+        with transaction.atomic():
+            device = Device.objects.create(device_id='TEST_ROLLUP', device_type='SIMULATOR', name='Rollup node')
+            now = django_timezone.now()
+            writer = RollupWriter()
+            writer._flusher = object()
+            readings = SensorData.objects.bulk_create([
+                SensorData(device=device, sensor_type='TEMPERATURE', value=21.0 + i % 5,
+                           timestamp=now - timedelta(seconds=30 * i + 5)) for i in range(600)])
+            for reading in readings:
+                writer.record(reading)
+            writer.flush()
+
+            def series(**params):
+                request = RequestFactory().get('/api/sensors/data/', dict(
+                    hours=6, resolution='1h', device_id='TEST_ROLLUP', **params))
+                request.user = AnonymousUser()
+                return json.loads(views.api_sensor_data(request).content)['data']
+
+            exact = {'min_value', 'max_value', 'stddev', 'count', 'anomalies'}
+            assert all(exact <= set(row) for row in series())
+            private = series(private='true')
+            assert private and all(not exact & set(row) for row in private), private
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        privacy_budget.privacy_accountant, privacy_budget.release_cache = originals
+
+
+if __name__ == '__main__':
+    test_plan_covers_range_exactly()
+    test_incremental_rollups_match_raw()
+    test_rebuild_keeps_history_of_purged_levels()
+    test_private_series_publishes_only_noisy_values()
+    print("✓ Rollup tests passed!")
@@ -0,0 +1,104 @@
+"""
+SQLite Profile Test
+Checks that connections get the production pragmas, that dashboard reads are
+routed to the query_only connection (except inside a transaction), and that
+the serialized writer group-commits queued jobs with a savepoint per job
+"""
+import os
+import sys
+import django
+
+# Setup Django
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'iotshield_backend.settings')
+django.setup()
+
+import sqlite3
+import threading
+
+from django.db import connection, connections, transaction
+
+from dashboard.models import Device
+from iotshield_backend.db_writer import DatabaseWriter
+from iotshield_backend.sqlite_profile import READONLY_ALIAS, dashboard_reads
+from iotshield_backend.utils.metrics import metrics
+
+
+def pragma(alias, name):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+
+def test_connection_profile_and_routing():
+    assert pragma('default', 'journal_mode') == 'wal'
+    assert pragma('default', 'synchronous') == 1  # NORMAL
+    assert pragma('default', 'busy_timeout') == 5000
+    assert pragma('default', 'query_only') == 0
+    assert pragma(READONLY_ALIAS, 'query_only') == 1
+
+    # Writes on the read-only connection are refused by SQLite itself
+    try:
+        with connections[READONLY_ALIAS].cursor() as cursor:
+            cursor.execute('CREATE TABLE iotshield_should_not_exist (id INTEGER)')
+        assert False, 'read-only connection accepted a write'
+    except django.db.OperationalError:
+        pass
+
+    assert Device.objects.all().db == 'default'
+    with dashboard_reads():
+        assert Device.objects.all().db == READONLY_ALIAS
+        with transaction.atomic():
+            # Inside a transaction reads must see its own uncommitted writes
+            assert Device.objects.all().db == 'default'
+
+
+def test_writer_group_commits_with_savepoints():
+    writer = DatabaseWriter(max_batch=50)
+    writer.start()
+    gate = threading.Event()
+
+    def create_scratch():
+        # A temp table lives on the writer's connection only - the database file is untouched
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMP TABLE writer_jobs (n INTEGER)')
+        gate.wait(5)
+
+    def insert(n, fail=False):
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO temp.writer_jobs (n) VALUES (%s)', [n])
+        if fail:
+            raise ValueError(n)
+        return threading.current_thread().name
+
+    def rows():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT n FROM temp.writer_jobs ORDER BY n')
+            # A job writing through the writer again runs inline instead of deadlocking
+            return [row[0] for row in cursor.fetchall()], writer.call(lambda: 'inline')
+
+    try:
+        jobs_before = metrics.get_counter('db_writer_jobs')
+        blocker = writer.submit(create_scratch)
+        # Everything queued while the writer is busy goes into the next commit
+        futures = [writer.submit(insert, n, fail=(n == 3)) for n in range(6)]
+        gate.set()
+        blocker.result(5)
+
+        assert futures[0].result(5) == 'db-writer'
+        assert isinstance(futures[3].exception(5), ValueError)
+        # The failing job rolled back its own insert only
+        assert writer.call(rows) == ([0, 1, 2, 4, 5], 'inline')
+        assert metrics.get_counter('db_writer_jobs') - jobs_before == 8
+        assert metrics.snapshot()['timings']['db_writer_batch_size']['max'] >= 6
+    finally:
+        writer.stop()
+
+    # Stopped: jobs run inline on the caller's thread
+    assert writer.call(lambda: threading.current_thread().name) == threading.current_thread().name
+
+
+if __name__ == '__main__':
+    test_connection_profile_and_routing()
+    test_writer_group_commits_with_savepoints()
+    print("✓ SQLite profile tests passed!")